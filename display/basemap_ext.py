@@ -36,6 +36,7 @@ import sys, os
 sys.path.insert(0,
                 os.path.split(os.path.dirname(os.path.abspath(__file__)))[0])
 from .. import talos
+from .. import io
 sys.path.pop(0)
 
 
@@ -118,14 +119,29 @@ def getd(config = None, filename = "", Nt = None,
     @param Nx: The number of space steps along xin the file to be loaded. If
     it is not given, it is read in 'config'.
 
+    If the file has a header (see 'io.write_header'), the dimensions that are
+    not given are read in the header, and 'config' is not needed.
+
     @rtype: numpy.array
     @return: The data.
     """
-    if isinstance(config, str):
-        config = talos.Config(config)
     if filename == "":
+        if isinstance(config, str):
+            config = talos.Config(config)
         filename = config.input_file
 
+    header = io.read_header(filename)
+    if header is not None and len(header["shape"]) in (3, 4):
+        shape = list(header["shape"])
+        if len(shape) == 3:
+            shape.insert(1, 1)
+        for i, N in enumerate([Nt, Nz, Ny, Nx]):
+            if N is not None and N != 0:
+                shape[i] = N
+        return io.load_binary(filename, tuple(shape))
+
+    if isinstance(config, str):
+        config = talos.Config(config)
     import os
     if Nx is None:
         Nx = config.Nx
@@ -176,14 +192,27 @@ def getdJ(config = None, filename = "", Ndays = None,
     @param Nx: The number of levels in the file to be loaded. If
     it is not given, it is read in 'config'.
 
+    If the file has a header (see 'io.write_header'), the dimensions that are
+    not given are read in the header, and 'config' is not needed.
+
     @rtype: numpy.array
     @return: The data.
     """
-    if isinstance(config, str):
-        config = talos.Config(config)
     if filename == "":
+        if isinstance(config, str):
+            config = talos.Config(config)
         filename = config.input_file
 
+    header = io.read_header(filename)
+    if header is not None and len(header["shape"]) == 4:
+        shape = list(header["shape"])
+        for i, N in enumerate([Ndays, Ntheta, Ny, Nz]):
+            if N is not None and N != 0:
+                shape[i] = N
+        return io.load_binary(filename, tuple(shape)).transpose().copy()
+
+    if isinstance(config, str):
+        config = talos.Config(config)
     import os
     if Ndays is None:
         Ndays = config.Ndays
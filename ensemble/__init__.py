@@ -33,3 +33,4 @@ from atmopy.ensemble.probability import *
 from atmopy.ensemble.ensemble_data import *
 from atmopy.ensemble.ensemble_method import *
 from atmopy.ensemble.learning import *
+from atmopy.ensemble.sweep import *
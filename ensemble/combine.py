@@ -30,7 +30,6 @@ sys.path.pop(0)
 from scipy import *
 from numpy import *
 import scipy.linalg
-import scipy.stats.stats
 
 def collect(sim, obs, dates = None, stations = None, period = None,
             stations_out = None):
@@ -207,6 +206,48 @@ def collect_dates(sim, obs, dates = None, stations = None, period = None,
     return array(out_sim), array(out_obs)
 
 
+def collect_dense(sim, obs, dates, all_dates):
+    """
+    Gathers data (observations and simulated concentrations) in dense arrays
+    indexed by the dates of a reference list. Missing data is flagged in a
+    mask, so that the data at a given set of dates may be extracted with
+    array indexing only.
+
+    @type sim: list of list of 1D-array
+    @param sim: The list (indexed by simulations) of lists (indexed by
+    stations) of simulated concentrations.
+    @type obs: list of 1D-array
+    @param obs: The list (indexed by stations) of observed concentrations.
+    @type dates: list of list of datetime
+    @param dates: The list (indexed by stations) of list of dates at which the
+    data is defined.
+    @type all_dates: list of datetime
+    @param all_dates: The reference dates. Data at other dates is discarded.
+
+    @rtype: (3D-array, 2D-array, 2D-array)
+    @return: The simulated concentrations (dates x simulations x stations),
+    the observations (dates x stations) and the mask (dates x stations) which
+    is True where data is available. Missing data is set to 0.
+    """
+    Nsim = len(sim)
+    Nstation = len(obs)
+    index = dict([(all_dates[i], i) for i in range(len(all_dates))])
+    out_sim = zeros((len(all_dates), Nsim, Nstation), 'd')
+    out_obs = zeros((len(all_dates), Nstation), 'd')
+    mask = zeros((len(all_dates), Nstation), 'bool')
+    for istation in range(Nstation):
+        position = array([index.get(x, -1) for x in dates[istation]],
+                         dtype = 'int')
+        selection = position >= 0
+        position = position[selection]
+        mask[position, istation] = True
+        out_obs[position, istation] = asarray(obs[istation])[selection]
+        for isim in range(Nsim):
+            out_sim[position, isim, istation] \
+                              = asarray(sim[isim][istation])[selection]
+    return out_sim, out_obs, mask
+
+
 def w_least_squares(sim, obs):
     """
     Solves a least square problem in order to optimally combine
@@ -245,13 +286,83 @@ def w_penalized_least_squares(sim, obs, penalization):
     @rtype: 1D-array
     @return: The coefficients (or weights) 'alpha' of the linear combination.
     """
-    A = penalization * identity(sim.shape[0], dtype = 'd')
-    for i in range(sim.shape[1]):
-        A += outer(sim[:, i], sim[:, i])
-    return dot(linalg.inv(A), dot(sim, obs))
+    A = dot(sim, transpose(sim)) \
+        + penalization * identity(sim.shape[0], dtype = 'd')
+    return scipy.linalg.cho_solve(scipy.linalg.cho_factor(A), dot(sim, obs))
+
 
+def simplex_quadratic(A, b, weight = None, Niteration_max = None):
+    """
+    Minimizes 'w^T A w / 2 - b^T w' over the simplex of probability
+    distributions, with a primal active-set method. The method is exact: it
+    stops when the Karush-Kuhn-Tucker conditions are satisfied.
+
+    @type A: 2D-array
+    @param A: The symmetric positive semidefinite matrix of the quadratic
+    form.
+    @type b: 1D-array
+    @param b: The linear term.
+    @type weight: 1D-array or None
+    @param weight: The starting point (warm start), which is projected onto
+    the simplex. If None, the uniform distribution is used.
+    @type Niteration_max: integer or None
+    @param Niteration_max: The maximum number of iterations. If None, it is
+    set to ten times the dimension.
 
-def w_least_squares_simplex(sim, obs):
+    @rtype: 1D-array
+    @return: The minimizer.
+    """
+    N = len(b)
+    if Niteration_max is None:
+        Niteration_max = 10 * N + 10
+    if weight is None:
+        w = ones(N, dtype = 'd') / float(N)
+    else:
+        w = maximum(asarray(weight, dtype = 'd'), 0.)
+        if w.sum() > 0.:
+            w /= w.sum()
+        else:
+            w = ones(N, dtype = 'd') / float(N)
+    tolerance = 1.e-12 * (abs(A).max() + abs(b).max() + 1.)
+    free = w > 0.
+    for iteration in range(Niteration_max):
+        # Minimization with the equality constraint only, over the free
+        # weights: KKT system [A_FF 1; 1^T 0] [w_F; l] = [b_F; 1].
+        index = where(free)[0]
+        Nfree = len(index)
+        K = zeros((Nfree + 1, Nfree + 1), dtype = 'd')
+        K[:Nfree, :Nfree] = A[index[:, newaxis], index]
+        K[:Nfree, Nfree] = 1.
+        K[Nfree, :Nfree] = 1.
+        rhs = concatenate((b[index], [1.]))
+        # 'A_FF' may be singular, when there are fewer observations than
+        # free weights.
+        solution = scipy.linalg.lstsq(K, rhs, lapack_driver = "gelsy")[0]
+        candidate = solution[:Nfree]
+        if (candidate >= 0.).all():
+            w[:] = 0.
+            w[index] = candidate
+            # Multipliers of the constraints w_i >= 0 on the fixed weights.
+            multiplier = dot(A, w) - b + solution[Nfree]
+            multiplier[index] = 0.
+            i = argmin(multiplier)
+            if multiplier[i] >= - tolerance:
+                break
+            free[i] = True
+        else:
+            # Moves towards the candidate until a weight vanishes.
+            negative = where(candidate < 0.)[0]
+            ratio = w[index[negative]] / (w[index[negative]]
+                                          - candidate[negative])
+            j = argmin(ratio)
+            w[index] += ratio[j] * (candidate - w[index])
+            w[index[negative[j]]] = 0.
+            w[w < 0.] = 0.
+            free = w > 0.
+    return w / w.sum()
+
+
+def w_least_squares_simplex(sim, obs, weight = None):
     """
     Computes the optimal combination weights in the least-square sense, with
     weights in the simplex of probability distributions.
@@ -261,26 +372,114 @@ def w_least_squares_simplex(sim, obs):
     concentrations).
     @type obs: 1D-array
     @param obs: Observations (or any other target).
+    @type weight: 1D-array or None
+    @param weight: An initial guess for the weights (warm start), or None.
 
     @rtype: 1D-array
     @return: The coefficients (or weights) 'alpha' of the linear combination.
     """
-    def cost(w):
-        s = dot(transpose(w), sim) / w.sum()
-        return dot(transpose(s - obs), s - obs)
-    def cost_gradient(w):
-        w_sum = w.sum()
-        s = dot(transpose(w), sim) / w_sum
-        return dot(sim - s, s - obs) / w_sum
-    res, f, d = \
-         scipy.optimize.fmin_l_bfgs_b(cost,
-                                      ones(sim.shape[0], dtype = 'd'),
-                                      fprime = cost_gradient,
-                                      bounds = [(0., 1.) for i in
-                                                range(sim.shape[0])],
-                                      approx_grad = False)
-    res = array(res)
-    return res / res.sum()
+    return simplex_quadratic(dot(sim, transpose(sim)), dot(sim, obs), weight)
+
+
+def _gram_batch(sim, obs, mask):
+    """
+    Computes the Gram matrices 'sim sim^T' and the vectors 'sim obs' of a set
+    of least-square problems.
+    """
+    sim = asarray(sim, dtype = 'd')
+    obs = asarray(obs, dtype = 'd')
+    if mask is not None:
+        sim = sim * mask[:, newaxis, :]
+        obs = obs * mask
+    A = matmul(sim, sim.transpose(0, 2, 1))
+    b = matmul(sim, obs[:, :, newaxis])[:, :, 0]
+    return A, b
+
+
+def w_least_squares_batch(sim, obs, mask = None, penalization = None):
+    """
+    Solves a set of least-square problems at once. For each problem p, it
+    minimizes "penalization * alpha_p^2 + (sim[p]^T alpha_p - obs[p])^2". The
+    Gram matrices are stacked and the normal equations are solved together.
+    Problems with fewer observations than simulations (without
+    penalization), or with singular Gram matrices, are solved one by one
+    with 'w_least_squares'.
+
+    @type sim: 3D-array
+    @param sim: The simulated concentrations (problems x simulations x
+    concentrations).
+    @type obs: 2D-array
+    @param obs: The observations (problems x concentrations).
+    @type mask: 2D-array of Boolean, or None
+    @param mask: The concentrations to be taken into account (problems x
+    concentrations). If None, all concentrations are used.
+    @type penalization: float or None
+    @param penalization: The penalization on the 2-norm of the weights.
+
+    @rtype: 2D-array
+    @return: The coefficients of the linear combinations (problems x
+    simulations).
+    """
+    A, b = _gram_batch(sim, obs, mask)
+    Nproblem, Nsim = b.shape
+    if penalization is not None:
+        A += penalization * identity(Nsim, dtype = 'd')
+        regular = ones(Nproblem, dtype = 'bool')
+    elif mask is None:
+        regular = ones(Nproblem, dtype = 'bool') * (obs.shape[1] >= Nsim)
+    else:
+        regular = mask.sum(1) >= Nsim
+
+    weight = zeros((Nproblem, Nsim), dtype = 'd')
+    if regular.any():
+        try:
+            weight[regular] = linalg.solve(A[regular],
+                                           b[regular][:, :, newaxis])[:, :, 0]
+        except linalg.LinAlgError:
+            regular[:] = False
+    for p in where(~regular)[0]:
+        if mask is None:
+            selection = slice(None)
+        else:
+            selection = mask[p]
+        s = asarray(sim[p], dtype = 'd')[:, selection]
+        o = asarray(obs[p], dtype = 'd')[selection]
+        if penalization is None:
+            weight[p] = w_least_squares(s, o)
+        else:
+            weight[p] = w_penalized_least_squares(s, o, penalization)
+    return weight
+
+
+def w_least_squares_simplex_batch(sim, obs, mask = None, weight = None):
+    """
+    Computes, for a set of problems, the optimal combination weights in the
+    least-square sense, with weights in the simplex of probability
+    distributions. The Gram matrices are computed at once, and each problem
+    is warm-started with the solution of the previous problem.
+
+    @type sim: 3D-array
+    @param sim: The simulated concentrations (problems x simulations x
+    concentrations).
+    @type obs: 2D-array
+    @param obs: The observations (problems x concentrations).
+    @type mask: 2D-array of Boolean, or None
+    @param mask: The concentrations to be taken into account (problems x
+    concentrations). If None, all concentrations are used.
+    @type weight: 1D-array or None
+    @param weight: An initial guess for the weights of the first problem, or
+    None.
+
+    @rtype: 2D-array
+    @return: The coefficients of the linear combinations (problems x
+    simulations).
+    """
+    A, b = _gram_batch(sim, obs, mask)
+    out = empty(b.shape, dtype = 'd')
+    for p in range(len(b)):
+        weight = simplex_quadratic(A[p], b[p], weight)
+        out[p] = weight
+    return out
 
 
 def m_least_squares(sim, obs):
@@ -356,7 +555,7 @@ def m_mean(sim):
     @rtype: 1D-array
     @return: The mean of the simulations.
     """
-    return array(scipy.stats.stats.mean(sim, 0))
+    return asarray(sim, dtype = 'd').mean(0)
 
 
 def m_median(sim):
@@ -370,7 +569,92 @@ def m_median(sim):
     @rtype: 1D-array
     @return: The median of the simulations.
     """
-    return array(scipy.stats.stats.median(sim, 0))
+    return m_quantile(sim, 0.5)
+
+
+def m_quantile(sim, quantile):
+    """
+    Returns a quantile of an ensemble. The quantile is linearly interpolated
+    between the two closest members, so that the median of an even number of
+    members is the mean of the two middle members. The members are partially
+    sorted, which is faster than a full sort.
+
+    @type sim: array
+    @param sim: The simulated concentrations are an array whose first
+    dimension is indexed by the simulations, e.g., a 2D-array (simulation x
+    concentrations).
+    @type quantile: float
+    @param quantile: The quantile, in [0, 1].
+
+    @rtype: array
+    @return: The quantile of the simulations, with the shape of 'sim' except
+    for its first dimension.
+    """
+    if quantile < 0. or quantile > 1.:
+        raise Exception("The quantile must be in [0, 1].")
+    sim = asarray(sim, dtype = 'd')
+    position = quantile * (len(sim) - 1)
+    lower = int(floor(position))
+    upper = int(ceil(position))
+    sim = partition(sim, [lower, upper], axis = 0)
+    return sim[lower] + (position - lower) * (sim[upper] - sim[lower])
+
+
+def m_trimmed_mean(sim, proportion):
+    """
+    Returns the trimmed mean of an ensemble, that is, the mean of the members
+    left once the lowest and the highest values have been discarded.
+
+    @type sim: array
+    @param sim: The simulated concentrations are an array whose first
+    dimension is indexed by the simulations, e.g., a 2D-array (simulation x
+    concentrations).
+    @type proportion: float
+    @param proportion: The proportion of members discarded at each end, in
+    [0, 0.5[. The number of discarded members is rounded down.
+
+    @rtype: array
+    @return: The trimmed mean of the simulations, with the shape of 'sim'
+    except for its first dimension.
+    """
+    if proportion < 0. or proportion >= 0.5:
+        raise Exception("The trimmed proportion must be in [0, 0.5[.")
+    sim = asarray(sim, dtype = 'd')
+    Ntrim = int(proportion * len(sim))
+    if Ntrim == 0:
+        return sim.mean(0)
+    sim = partition(sim, [Ntrim, len(sim) - Ntrim - 1], axis = 0)
+    return sim[Ntrim:len(sim) - Ntrim].mean(0)
+
+
+def _concatenate_stations(dates, sim):
+    """
+    Concatenates the dates and the simulated concentrations of all stations.
+
+    @rtype: (1D-array, 2D-array, list of slice)
+    @return: The keys of the dates (see 'observation.dates_to_keys'), the
+    simulated concentrations (simulations x concentrations) and the slices
+    that select the data of each station.
+    """
+    length = [len(x) for x in dates]
+    position = concatenate(([0], cumsum(length)))
+    station_slice = [slice(position[i], position[i + 1])
+                     for i in range(len(length))]
+    station_dates = observation.dates_to_keys([x for y in dates for x in y])
+    data = zeros((len(sim), position[-1]), dtype = 'd')
+    for isim in range(len(sim)):
+        for istation in range(len(length)):
+            data[isim, station_slice[istation]] = sim[isim][istation]
+    return station_dates, data, station_slice
+
+
+def _get_date(dates, station_slice, i):
+    """
+    Returns the date at index 'i' of the concatenated dates of all stations.
+    """
+    for istation in range(len(station_slice)):
+        if station_slice[istation].start <= i < station_slice[istation].stop:
+            return dates[istation][i - station_slice[istation].start]
 
 
 def combine_step(dates, sim, coeff_dates, coeff_step, restricted = False):
@@ -413,35 +697,26 @@ def combine_step(dates, sim, coeff_dates, coeff_step, restricted = False):
 
     Nsim = len(sim)
     Nstations = len(sim[0])
-    Ndates = len(coeff_dates)
 
-    output_sim = [[] for i in range(Nstations)]
-    if restricted:
-        output_date = [[] for i in range(Nstations)]
+    # All stations are processed at once.
+    station_dates, data, station_slice = _concatenate_stations(dates, sim)
+    index = observation.match_dates(station_dates,
+                                    observation.dates_to_keys(coeff_dates))
+    found = index >= 0
+    if not restricted and not found.all():
+        raise Exception("Unable to find coefficients for date " \
+              + str(_get_date(dates, station_slice, argmin(found))) + ".")
 
     # Combining.
-    for istation in range(Nstations):
-        icoeff = 0
-        for idate in range(len(dates[istation])):
-            # Corresponding index in 'coeff_dates' and 'coeff_step'.
-            while icoeff < Ndates \
-                      and coeff_dates[icoeff] != dates[istation][idate]:
-                icoeff += 1
-            if icoeff == Ndates:
-                if not restricted:
-                    raise Exception("Unable to find coefficients for date " \
-                          + str(dates[istation][idate]) + ".")
-                icoeff = 0
-            else:
-                # Concentrations of the ensemble.
-                data = array([sim[i][istation][idate] for i in range(Nsim)])
-                # Combination.
-                output_sim[istation].append((coeff_step[icoeff] * data).sum())
-                if restricted:
-                    output_date[istation].append(dates[istation][idate])
-        output_sim[istation] = array(output_sim[istation])
+    coeff_step = asarray(coeff_step, dtype = 'd').reshape(-1, Nsim)
+    combined = zeros(len(index), dtype = 'd')
+    combined[found] = einsum("ti,it->t", coeff_step[index[found]],
+                             data[:, found])
 
+    output_sim = [combined[x][found[x]] for x in station_slice]
     if restricted:
+        output_date = [[dates[i][j] for j in where(found[station_slice[i]])[0]]
+                       for i in range(Nstations)]
         return output_date, output_sim
     else:
         return output_sim
@@ -486,50 +761,30 @@ def combine_step_unbiased(dates, sim, obs, coeff_dates, coeff_step):
         dates = (dates, )
 
     Nsim = len(sim)
-    Nstations = len(sim[0])
     Ndates = len(coeff_dates)
 
-    # Initializes the ensemble.
-    output_sim = [[] for i in range(Nstations)]
+    # All stations are processed at once.
+    station_dates, data, station_slice = _concatenate_stations(dates, sim)
+    obs = concatenate([asarray(x, dtype = 'd') for x in obs])
+    index = observation.match_dates(station_dates,
+                                    observation.dates_to_keys(coeff_dates))
+    found = index >= 0
+    index = index[found]
 
-    # Time indices for all stations.
-    date_index = [0 for i in range(Nstations)]
+    # Means over the stations at every step.
+    count = maximum(bincount(index, minlength = Ndates), 1)
+    obs_mean = bincount(index, obs[found], minlength = Ndates) / count
+    sim_mean = array([bincount(index, x[found], minlength = Ndates)
+                      for x in data]) / count
 
     # Combining.
-    for idate in range(len(coeff_dates)):
-        # New indices.
-        for i in range(Nstations):
-            while date_index[i] < len(dates[i]) \
-                      and dates[i][date_index[i]] < coeff_dates[idate]:
-                date_index[i] += 1
-        # Computing the means for the current step.
-        obs_mean = []
-        sim_mean = [[] for j in range(Nsim)]
-        for i in range(Nstations):
-            if date_index[i] < len(dates[i]) \
-                   and dates[i][date_index[i]] == coeff_dates[idate]:
-                obs_mean.append(obs[i][date_index[i]])
-                for j in range(Nsim):
-                    sim_mean[j].append(sim[j][i][date_index[i]])
-        if len(obs_mean) == 0:   # Empty step.
-            continue
-        obs_mean = array(obs_mean).mean()
-        for j in range(Nsim):
-            sim_mean[j] = array(sim_mean[j]).mean()
-        # Computes the ensemble value.
-        for i in range(Nstations):
-            if date_index[i] < len(dates[i]) \
-                   and dates[i][date_index[i]] == coeff_dates[idate]:
-                ens = obs_mean
-                for j in range(Nsim):
-                    ens += coeff_step[idate][j] * (sim[j][i][date_index[i]]
-                                                   - sim_mean[j])
-                output_sim[i].append(ens)
+    coeff_step = asarray(coeff_step, dtype = 'd').reshape(-1, Nsim)
+    combined = zeros(len(found), dtype = 'd')
+    combined[found] = obs_mean[index] \
+                      + einsum("ti,it->t", coeff_step[index],
+                               data[:, found] - sim_mean[:, index])
 
-    for istation in range(Nstations):
-        output_sim[istation] = array(output_sim[istation])
-
-    return output_sim
+    return [combined[x][found[x]] for x in station_slice]
 
 
 def combine_station_step(dates, sim, coeff_dates, coeff, restricted = False):
@@ -575,26 +830,24 @@ def combine_station_step(dates, sim, coeff_dates, coeff, restricted = False):
     Nsim = len(sim)
     Nstations = len(sim[0])
 
-    output_sim = [[] for i in range(Nstations)]
-    if restricted:
-        output_date = [[] for i in range(Nstations)]
-
+    output_sim = []
+    output_date = []
     for istation in range(Nstations):
-        matching_dates = [x for x in dates[istation]
-                          if x in coeff_dates[istation]]
-        if not matching_dates == coeff_dates and not restricted:
+        index = observation.match_dates(dates[istation],
+                                        coeff_dates[istation])
+        found = index >= 0
+        if not restricted and not found.all():
             raise Exception("Unable to match all dates, please activate" \
                   + " 'restricted' option.")
-        for good_date in matching_dates:
-            idate = dates[istation].index(good_date)
-            icoeff = coeff_dates[istation].index(good_date)
-            data = array([sim[i][istation][idate] for i in range(Nsim)])
-            output_sim[istation].append((coeff[istation][icoeff]
-                                         * data).sum())
+        data = array([asarray(sim[i][istation], dtype = 'd')[found]
+                      for i in range(Nsim)]).reshape(Nsim, -1)
+        coeff_station = asarray(coeff[istation], dtype = 'd')
+        output_sim.append(einsum("ti,it->t",
+                                 coeff_station.reshape(-1, Nsim)[index[found]],
+                                 data))
         if restricted:
-            output_date[istation] = matching_dates[:]
-
-        output_sim[istation] = array(output_sim[istation])
+            output_date.append([dates[istation][j]
+                                for j in where(found)[0]])
 
     if restricted:
         return output_date, output_sim
@@ -637,27 +890,14 @@ def remove_bias_step(dates, sim, bias_dates, bias_step):
         dates = (dates, )
 
     Nsim = len(sim)
-    Nstations = len(sim[0])
-    Ndates = len(bias_dates)
 
-    output_sim = [[[] for i in range(Nstations)] for j in range(Nsim)]
+    # All stations are processed at once.
+    station_dates, data, station_slice = _concatenate_stations(dates, sim)
+    index = observation.match_dates(station_dates,
+                                    observation.dates_to_keys(bias_dates))
+    if (index < 0).any():
+        raise Exception("Unable to find coefficients for date " \
+              + str(_get_date(dates, station_slice, argmin(index))) + ".")
 
-    for istation in range(Nstations):
-        ibias = 0
-        for idate in range(len(dates[istation])):
-            # Corresponding index in 'bias_dates' and 'bias_step'.
-            while ibias < Ndates \
-                      and bias_dates[ibias] != dates[istation][idate]:
-                ibias += 1
-            if ibias == Ndates:
-                raise Exception("Unable to find coefficients for date " \
-                      + str(dates[istation][idate]) + ".")
-            for isim in range(Nsim):
-                value = sim[isim][istation][idate] - bias_step[ibias]
-                output_sim[isim][istation].append(value)
-
-    for isim in range(Nsim):
-        for istation in range(Nstations):
-            output_sim[isim][istation] = array(output_sim[isim][istation])
-
-    return output_sim
+    data = data - asarray(bias_step, dtype = 'd')[index]
+    return [[data[isim, x] for x in station_slice] for isim in range(Nsim)]
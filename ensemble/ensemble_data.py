@@ -323,11 +323,8 @@ class EnsembleData:
             if len(date) != len(self.date):
                 raise Exception("Inconsistent dates.")
             for istation in range(len(date)):
-                if len(date[istation]) != len(self.date[istation]):
+                if list(date[istation]) != list(self.date[istation]):
                     raise Exception("Inconsistent dates.")
-                for idate in range(len(date[istation])):
-                    if date[istation][idate] != self.date[istation][idate]:
-                        raise Exception("Inconsistent dates.")
 
         if duplicate:
             add_sim = [x.copy() for x in sim]
@@ -508,33 +505,27 @@ def merge(date, data, date_update, data_update):
     """
     Nstation = len(data)
 
-    output_date = [[] for i in range(Nstation)]
-    output_data = [[] for i in range(Nstation)]
-
+    output_date = []
+    output_data = []
     for istation in range(Nstation):
-        i = 0
-        i_update = 0
-        while i < len(date[istation]) \
-                  and i_update < len(date_update[istation]):
-            if date[istation][i] < date_update[istation][i_update]:
-                output_date[istation].append(date[istation][i])
-                output_data[istation].append(data[istation][i])
-                i += 1
-            else:
-                output_date[istation].append(date_update[istation][i_update])
-                output_data[istation].append(data_update[istation][i_update])
-                if date[istation][i] == date_update[istation][i_update]:
-                    i += 1
-                i_update += 1
-        if i == len(date[istation]):
-            if i_update != len(date_update[istation]):
-                output_date[istation] += date_update[istation][i_update:]
-                output_data[istation] += data_update[istation][i_update:]
-        else:
-            output_date[istation] += date[istation][i:]
-            output_data[istation] += data[istation][i:]
-
-    return output_date, [array(x) for x in output_data]
+        if list(date[istation]) == list(date_update[istation]):
+            output_date.append(list(date_update[istation]))
+            output_data.append(array(data_update[istation], dtype = 'd'))
+            continue
+        # Insertion of the updated data after the base data, so that it is
+        # selected when a date is found in both data sets. The dates are then
+        # made of two sorted runs, which are merged in linear time.
+        value = dict(zip(date[istation],
+                         asarray(data[istation], dtype = 'd').tolist()))
+        value.update(zip(date_update[istation],
+                         asarray(data_update[istation],
+                                 dtype = 'd').tolist()))
+        station_date = sorted(value)
+        output_date.append(station_date)
+        output_data.append(fromiter(map(value.__getitem__, station_date),
+                                    dtype = 'd', count = len(station_date)))
+
+    return output_date, output_data
 
 
 def add_model(ref, model, ens):
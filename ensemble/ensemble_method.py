@@ -29,18 +29,155 @@ sys.path.insert(0, atmopy_path)
 from atmopy import talos, observation, stat
 sys.path.pop(0)
 
-import atmopy.ensemble.combine
+from atmopy.ensemble import combine
 
 from numpy import *
 import datetime
+import multiprocessing
+import pickle
 import scipy
 
 
+#################
+# WEIGHTHISTORY #
+#################
+
+
+class WeightHistory:
+    """
+    Stores the weight vectors computed at successive steps in a preallocated
+    array, filled up to a cursor. The rows already written are accessed as
+    views, without copy. If the array is full, its capacity is doubled, so
+    that the number of steps need not be known in advance.
+    """
+
+
+    def __init__(self, N, capacity = 0):
+        """
+        @type N: integer
+        @param N: The length of the weight vectors.
+        @type capacity: integer
+        @param capacity: The initial number of steps that may be stored.
+        """
+        self.data = empty((capacity, N), 'd')
+        self.Nstep = 0
+
+
+    def __len__(self):
+        return self.Nstep
+
+
+    def __getitem__(self, index):
+        return self.data[:self.Nstep][index]
+
+
+    def __getstate__(self):
+        # Only the rows already written are saved.
+        return {"data": self.data[:self.Nstep], "Nstep": self.Nstep}
+
+
+    def Reserve(self, capacity):
+        """
+        Enlarges the array so that it may store 'capacity' steps.
+
+        @type capacity: integer
+        @param capacity: The number of steps that may be stored.
+        """
+        if capacity > len(self.data):
+            data = empty((capacity, self.data.shape[1]), 'd')
+            data[:self.Nstep] = self.data[:self.Nstep]
+            self.data = data
+
+
+    def Append(self, weight):
+        """
+        Stores the weights of a new step.
+
+        @type weight: 1D array
+        @param weight: The weights.
+        """
+        if self.Nstep == len(self.data):
+            self.Reserve(2 * self.Nstep + 1)
+        self.data[self.Nstep] = weight
+        self.Nstep += 1
+
+
+    def GetArray(self):
+        """
+        Returns the weights of all steps.
+
+        @rtype: 2D array
+        @return: The weights (steps x models), as a view of the stored array.
+        """
+        return self.data[:self.Nstep]
+
+
+def weight_array(weight):
+    """
+    Converts weights to an array.
+
+    @type weight: WeightHistory, list of 1D array, or array
+    @param weight: The weights at successive steps.
+
+    @rtype: 2D array
+    @return: The weights (steps x models). A history is not copied.
+    """
+    if isinstance(weight, WeightHistory):
+        return weight.GetArray()
+    return array(weight)
+
+
 ##################
 # ENSEMBLEMETHOD #
 ##################
 
 
+# The method processed in parallel, inherited by forked processes.
+_parallel_method = None
+
+
+def _process_station(argument):
+    """
+    Computes the weights at one station in a forked process (see
+    'EnsembleMethod.ProcessParallel').
+
+    @type argument: (integer, integer, integer)
+    @param argument: The station index, the index of the first step and the
+    initial number of learning steps.
+
+    @rtype: dict
+    @return: The state of the method once the station is processed (see
+    'EnsembleMethod.GetState'), including the weights, the extended weights
+    and the dates of the weights at the station.
+    """
+    method = _parallel_method
+    method.station, starting_date, Nlearning = argument
+    method.prt = lambda x: None
+    method.ProcessStation(starting_date, Nlearning)
+    return method.GetState()
+
+
+def select_along_axis(select, measure, axis):
+    """
+    Applies a selection function along an axis of an array of measures.
+
+    @type select: callable object
+    @param select: function that returns the index of the best measure in a
+    list, e.g., 'argmin' or 'argmax'.
+    @type measure: array
+    @param measure: The measures.
+    @type axis: integer
+    @param axis: The axis along which the best measures are selected.
+
+    @rtype: array of integers
+    @return: The indices of the best measures, with the shape of 'measure'
+    except for the dimension 'axis'.
+    """
+    if select is argmin or select is argmax:
+        return select(measure, axis)
+    return apply_along_axis(select, axis, measure)
+
+
 class EnsembleMethod:
     """
     This class is the base class to all methods whose aim is to combine or
@@ -78,7 +215,7 @@ class EnsembleMethod:
     def __init__(self, ens, configuration_file = None, process = True,
                  statistics = True, Nskip = 0, Nlearning = 0,
                  option = "global", extended = False,
-                 verbose = False, U = 1.):
+                 verbose = False, U = 1., Nprocess = 1):
         """
         Attributes are initialized, ensemble combination may be computed and
         associated statistics may be computed.
@@ -110,6 +247,9 @@ class EnsembleMethod:
         @param extended: Use of extended weights.
         @type U: float
         @param U: coefficient in the 'extended' activation.
+        @type Nprocess: integer
+        @param Nprocess: The number of processes among which the stations
+        are distributed, with option 'station'.
         """
         self.ens = ens
         self.Nsim = self.ens.Nsim
@@ -118,17 +258,28 @@ class EnsembleMethod:
         self.all_dates = []
         self.extended = extended
         self.U = U
+        self.Nprocess = Nprocess
+        # Learning data possibly shared with other instances.
+        self.learning_data = None
+        # Is the method fed step by step (see 'Step')?
+        self.online = False
+        # Checkpoints (see 'Process').
+        self.checkpoint_file = None
+        self.Ncheckpoint = 240
 
         self.Nlearning = Nlearning
         self.Nskip = Nskip
 
+        # Weights at each step, in histories filled by 'AcquireWeight'.
         if self.option == "global" or self.option == "step":
-            self.weight = []
-            self.weight_ext = []
+            self.weight = WeightHistory(self.Nsim)
+            self.weight_ext = WeightHistory(2 * self.Nsim)
             self.weight_date = []
         elif self.option == "station":
-            self.weight = [[] for x in range(self.ens.Nstation)]
-            self.weight_ext = [[] for x in range(self.ens.Nstation)]
+            self.weight = [WeightHistory(self.Nsim)
+                           for x in range(self.ens.Nstation)]
+            self.weight_ext = [WeightHistory(2 * self.Nsim)
+                               for x in range(self.ens.Nstation)]
             self.weight_date = [[] for x in range(self.ens.Nstation)]
         else:
             raise Exception("Unknown option: \"" + self.option + "\".")
@@ -218,8 +369,8 @@ class EnsembleMethod:
 
     def UpdateWeight(self, s, o):
         """
-        Adds the weights for the current step in the list 'weight'
-        (attribute).
+        Adds the weights for the current step in the history 'weight'
+        (attribute), with 'AcquireWeight'.
 
         @type s: 2D array
         @param s: The simulated concentrations indexed by the model and the
@@ -227,37 +378,64 @@ class EnsembleMethod:
         @type o: 1D array
         @param o: The observations.
         """
-        self.weight.append(ones(shape = (self.Nsim,), dtype = 'd')
+        self.AcquireWeight(ones(shape = (self.Nsim,), dtype = 'd')
                            / float(self.Nsim))
 
 
-    def InitialList(self, value):
+    def GetNslot(self):
         """
-        Returns a list filled with 'value'. The length of the list is either 1
-        (if the ensemble deals with peak concentrations) or 24 (if the
-        ensemble deals with hourly concentrations).
+        Returns the number of slots in which the state of a learning method
+        is stored: 1 if the ensemble deals with peak concentrations, or 24
+        (one per hour) if the ensemble deals with hourly concentrations.
 
-        @type value: scalar, list or array
-        @param value: The value with which the output list is filled.
-
-        @rtype: list of floats, list of lists or list of arrays.
-        @return: A list filled with 1 copy or 24 distinct copies of 'value'.
+        @rtype: integer
+        @return: The number of slots.
         """
         if self.ens.config.concentrations == "peak":
-            length = 1
+            return 1
         elif self.ens.config.concentrations == "hourly":
-            length = 24
+            return 24
         else:
             raise Exception("Unsupported concentration type: \"" \
                   + self.ens.config.concentrations + "\".")
 
-        value_type = type(value)
-        if value_type in [int, float]:
-            return [value for i in range(length)]
-        elif value_type == list:
-            return [value[:] for i in range(length)]
-        else:
-            return [value.copy() for i in range(length)]
+
+    def GetSlot(self):
+        """
+        Returns the slot of the current step (see 'GetNslot'): 0 for peak
+        concentrations, or the hour of the current date for hourly
+        concentrations.
+
+        @rtype: integer
+        @return: The index of the slot.
+        """
+        if self.ens.config.concentrations == "peak":
+            return 0
+        return self.GetDate().hour
+
+
+    def InitialList(self, value):
+        """
+        Returns the initial state of a quantity for all slots (see
+        'GetNslot'). A scalar or an array is copied in a single array whose
+        first dimension is indexed by the slots, so that the state of a slot
+        is accessed (and updated in place) by direct indexing. The array has
+        the type of 'value': an integer gives an integer array (e.g., for
+        counters), so real quantities should be given as floats. A list,
+        whose length may vary during the computations, is copied in a list.
+
+        @type value: scalar, list or array
+        @param value: The value with which the output is filled.
+
+        @rtype: array, or list of lists
+        @return: An array (slots x shape of 'value') filled with 'value', or
+        a list of 1 or 24 distinct copies of the list 'value'.
+        """
+        Nslot = self.GetNslot()
+        if isinstance(value, list):
+            return [value[:] for i in range(Nslot)]
+        value = asarray(value)
+        return repeat(value[newaxis], Nslot, 0)
 
 
     def GetInitialWeight(self):
@@ -276,25 +454,27 @@ class EnsembleMethod:
             return self.initial_weight
 
 
-    def __keep_date(self, x):
+    def GetDate(self):
         """
-        Checks whether an observation at date 'x' is in the learning
-        period.
+        Returns the date of the weights being computed, that is, the date of
+        step 'self.step'.
 
-        @type x: datetime
-        @param x: Date to be tested.
+        @rtype: datetime
+        @return: The date of the current step.
         """
-        hour = self.ens.all_dates[self.step].hour
-        return x.hour == hour
+        if self.online:
+            return self.online_date
+        else:
+            return self.ens.all_dates[self.step]
 
 
-    def GetLearningDates(self):
+    def GetLearningSteps(self):
         """
-        Returns the simulated dates that are in the learning period. It
-        manages peak and hourly observations.
+        Returns the indices (in 'ens.all_dates') of the simulated dates that
+        are in the learning period. It manages peak and hourly observations.
 
-        @rtype: list of datetime
-        @return: The simulated dates that are in the learning period.
+        @rtype: 1D array of integers
+        @return: The indices of the dates in the learning period.
         """
         Nlearning = self.Nlearning
         # Update of self.Nlearning.
@@ -302,12 +482,28 @@ class EnsembleMethod:
             self.Nlearning = min(Nlearning + 1, self.Nlearning_max)
 
         if Nlearning == 0:
-            return self.ens.all_dates[self.step]
+            return array([self.step])
         elif self.ens.config.concentrations == "peak":
-            return self.ens.all_dates[(self.step - Nlearning):self.step]
+            steps = arange(self.step - Nlearning, self.step)
         elif self.ens.config.concentrations == "hourly":
-            return filter(self.__keep_date,
-                          self.ens.all_dates[:self.step])[-Nlearning:]
+            # Hourly dates are contiguous: the previous dates at the same hour
+            # are 24, 48, ... steps before.
+            steps = arange(self.step - 24 * Nlearning, self.step, 24)
+        return steps[steps >= 0]
+
+
+    def GetLearningDates(self):
+        """
+        Returns the simulated dates that are in the learning period. It
+        manages peak and hourly observations.
+
+        @rtype: list of datetime
+        @return: The simulated dates that are in the learning period.
+        """
+        if self.Nlearning == 0:
+            self.GetLearningSteps()
+            return self.ens.all_dates[self.step]
+        return [self.ens.all_dates[i] for i in self.GetLearningSteps()]
 
 
     def GetPreviousWeight(self):
@@ -316,38 +512,23 @@ class EnsembleMethod:
         hourly, and following the mode option (global, step or station).
 
         @rtype: 1D array
-        @return: The previous weight vector.
+        @return: The previous weight vector. It is a view of the weight
+        history, which should not be modified.
         """
         if self.option == "global" or self.option == "step":
-            if self.ens.config.concentrations == "peak":
-                if self.weight == []:
-                    return self.GetInitialWeight()
-                elif self.extended:
-                    return self.weight_ext[-1]
-                else:
-                    return self.weight[-1]
-            elif self.ens.config.concentrations == "hourly":
-                if len(self.weight) < 24:
-                    return self.GetInitialWeight()
-                elif self.extended:
-                    return self.weight_ext[-24]
-                else:
-                    return self.weight[-24]
+            weight, weight_ext = self.weight, self.weight_ext
         elif self.option == "station":
-            if self.ens.config.concentrations == "peak":
-                if self.weight[self.station] == []:
-                    return self.GetInitialWeight()
-                elif self.extended:
-                    return self.weight_ext[self.station][-1]
-                else:
-                    return self.weight[self.station][-1]
-            elif self.ens.config.concentrations == "hourly":
-                if len(self.weight[self.station]) < 24:
-                    return self.GetInitialWeight()
-                elif self.extended:
-                    return self.weight_ext[self.station][-24]
-                else:
-                    return self.weight[self.station][-24]
+            weight = self.weight[self.station]
+            weight_ext = self.weight_ext[self.station]
+        # The previous weights are those of the previous step at the same
+        # hour.
+        Nslot = self.GetNslot()
+        if len(weight) < Nslot:
+            return self.GetInitialWeight()
+        elif self.extended:
+            return weight_ext[-Nslot]
+        else:
+            return weight[-Nslot]
 
 
     def CollectData(self, period):
@@ -381,6 +562,61 @@ class EnsembleMethod:
         return s, o
 
 
+    def InitLearningData(self):
+        """
+        Gathers all simulated data and observations in dense arrays indexed
+        by the dates of 'ens.all_dates' (see 'combine.collect_dense'), so that
+        the learning data of any step is extracted by 'CollectSteps' without
+        searching the dates. If attribute 'learning_data' is not None, it
+        should contain these arrays, and they are not computed again.
+        """
+        if self.learning_data is None:
+            data = combine.collect_dense(self.ens.sim, self.ens.obs,
+                                         self.ens.date, self.ens.all_dates)
+        else:
+            data = self.learning_data
+        self.learning_sim, self.learning_obs, self.learning_mask = data
+
+
+    def CollectSteps(self, steps):
+        """
+        Gets the data at given steps with the right format according to the
+        'extended' option. It returns the same data as 'CollectData', but
+        relies on the arrays built by 'InitLearningData'.
+
+        @type steps: 1D array of integers
+        @param steps: The (sorted) indices of the selected dates in
+        'ens.all_dates'.
+
+        @rtype: [2D array, 1D array]
+        @return: The simulated data and the observed data.
+        """
+        if self.online:
+            # The learning arrays are circular buffers.
+            steps = steps % len(self.learning_sim)
+        if self.option == "global" or self.option == "step":
+            sim = self.learning_sim[steps]
+            obs = self.learning_obs[steps]
+            mask = self.learning_mask[steps]
+        elif self.option == "station":
+            sim = self.learning_sim[steps, :, self.station:self.station + 1]
+            obs = self.learning_obs[steps, self.station:self.station + 1]
+            mask = self.learning_mask[steps, self.station:self.station + 1]
+
+        # The data is ordered by station, then by date.
+        mask = mask.T
+        s1 = sim.transpose((1, 2, 0))[:, mask]
+        o = obs.T[mask]
+        if self.extended:
+            s = zeros([self.Nsim * 2 , s1.shape[1]], 'd')
+            s[:self.Nsim] = self.U * s1
+            s[self.Nsim:] = -self.U * s1
+        else:
+            s = s1
+
+        return s, o
+
+
     def AcquireWeight(self, weight):
         """
         Stores the weights according to the activation of 'extended' option.
@@ -391,26 +627,229 @@ class EnsembleMethod:
         """
         if self.option == "global" or self.option == "step":
             if self.extended:
-                self.weight_ext.append(weight)
+                self.weight_ext.Append(weight)
                 reduced_weight = self.U * (weight[:self.Nsim]
                                            - weight[self.Nsim:])
-                self.weight.append(reduced_weight)
+                self.weight.Append(reduced_weight)
             else:
-                self.weight.append(weight)
+                self.weight.Append(weight)
         elif self.option == "station":
             if self.extended:
-                self.weight_ext[self.station].append(weight)
+                self.weight_ext[self.station].Append(weight)
                 reduced_weight = self.U * (weight[:self.Nsim]
                                            - weight[self.Nsim:])
-                self.weight[self.station].append(reduced_weight)
+                self.weight[self.station].Append(reduced_weight)
             else:
-                self.weight[self.station].append(weight)
+                self.weight[self.station].Append(weight)
 
 
-    def Process(self):
+    def ProcessStation(self, starting_date, Nlearning, resume = False):
         """
-        Computes the weights and the resulting combination.
+        Computes the weights for all steps, either for all stations
+        (options "global" and "step") or for the station 'self.station'
+        (option "station").
+
+        @type starting_date: integer
+        @param starting_date: The index of the first step.
+        @type Nlearning: integer
+        @param Nlearning: The number of learning steps at the first step.
+        @type resume: Boolean
+        @param resume: If True, the computations are resumed from the state
+        loaded from a checkpoint (see 'LoadState'), at step 'next_step'.
+        """
+        if resume:
+            first_step = self.next_step
+        else:
+            first_step = starting_date
+            self.Nlearning = Nlearning
+            self.Init()
+        # The weights of all steps are allocated at once.
+        if self.option == "global" or self.option == "step":
+            history = [self.weight, self.weight_ext]
+        elif self.option == "station":
+            history = [self.weight[self.station],
+                       self.weight_ext[self.station]]
+        history[0].Reserve(len(self.ens.all_dates) - starting_date)
+        if self.extended:
+            history[1].Reserve(len(self.ens.all_dates) - starting_date)
+        for self.step in range(first_step, len(self.ens.all_dates)):
+            if self.option in ["step", "global"]:
+                self.prt("Number of processed steps: " + str(self.step)
+                         + "/"
+                         + str(len(self.ens.all_dates) - starting_date))
+            s, o = self.CollectSteps(self.GetLearningSteps())
+            # Stores the effective date of weights.
+            if self.option == "global" or self.option == "step":
+                self.weight_date.append(self.ens.all_dates[self.step])
+            elif self.option == "station":
+                tmp = self.ens.all_dates[self.step]
+                self.weight_date[self.station].append(tmp)
+
+            if o.shape != (0,):
+                self.UpdateWeight(s, o)
+            else:
+                # If there is no observation, previous weights are used.
+                self.AcquireWeight(self.GetPreviousWeight().copy())
+
+            if self.checkpoint_file is not None \
+                   and (self.step + 1 - starting_date) % self.Ncheckpoint == 0:
+                self.next_step = self.step + 1
+                self.SaveState(self.checkpoint_file)
+
+
+    def GetState(self):
+        """
+        Returns the state of the method (weights computed so far, tools of
+        the learning algorithm, current station and step, ...). The ensemble,
+        the configuration and the learning data (except in online mode) are
+        not included.
+
+        @rtype: dict
+        @return: The attributes of the method that make up its state.
+        """
+        excluded = ["ens", "config", "prt", "learning_data"]
+        if not self.online:
+            excluded += ["learning_sim", "learning_obs", "learning_mask"]
+        return dict([(k, v) for k, v in self.__dict__.items()
+                     if k not in excluded])
+
+
+    def GetFingerprint(self):
+        """
+        Returns a description of the method and of its ensemble, so that a
+        state saved by 'SaveState' is only loaded into the same computation.
+        It is meant to be called before the computations start.
+
+        @rtype: dict
+        @return: The class of the method, its parameters (the attributes that
+        are numbers, strings or functions, except those that only control
+        the execution), the number of dates, the number of simulations and
+        the number of stations.
+        """
+        excluded = ["verbose", "Nprocess", "online", "checkpoint_file",
+                    "Ncheckpoint", "fingerprint", "station", "step",
+                    "next_step"]
+        parameter = {}
+        for k, v in self.__dict__.items():
+            if k in excluded:
+                continue
+            if v is None or isscalar(v):
+                parameter[k] = v
+            elif callable(v) and hasattr(v, "__name__"):
+                parameter[k] = v.__name__
+        return {"class": self.__class__.__name__,
+                "parameter": parameter,
+                "Ndate": len(self.ens.all_dates),
+                "Nsim": self.Nsim,
+                "Nstation": self.ens.Nstation}
+
+
+    def SaveState(self, filename):
+        """
+        Saves the state of the method (see 'GetState') in a file.
+
+        @type filename: string
+        @param filename: The file in which the state is saved.
+        """
+        state = self.GetState()
+        # The file is replaced only once the new state is fully written.
+        f = open(filename + ".tmp", "wb")
+        pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+        f.close()
+        os.replace(filename + ".tmp", filename)
+
+
+    def LoadState(self, filename):
+        """
+        Loads the state of the method saved by 'SaveState'. The state must
+        have been saved by the same method, with the same parameters and the
+        same ensemble (see 'GetFingerprint').
+
+        @type filename: string
+        @param filename: The file in which the state was saved.
+        """
+        f = open(filename, "rb")
+        state = pickle.load(f)
+        f.close()
+        if "fingerprint" in dir(self):
+            fingerprint = self.fingerprint
+        else:
+            fingerprint = self.GetFingerprint()
+        if state.get("fingerprint") != fingerprint:
+            raise Exception("The state saved in \"" + filename + "\" was "
+                            + "computed by another method, with other "
+                            + "parameters or with another ensemble.")
+        self.__dict__.update(state)
+
+
+    def ProcessParallel(self, starting_date, Nlearning, Nprocess):
+        """
+        Computes the weights at all stations (option "station") with a pool
+        of processes. The processes are forked, so that they share the
+        ensemble data with the current process. Each station is processed
+        exactly as in 'ProcessStation', so the weights are the same as in
+        serial mode. The other attributes are those left by the last station,
+        also as in serial mode.
+
+        @type starting_date: integer
+        @param starting_date: The index of the first step.
+        @type Nlearning: integer
+        @param Nlearning: The number of learning steps at the first step.
+        @type Nprocess: integer
+        @param Nprocess: The number of processes.
+        """
+        global _parallel_method
+        _parallel_method = self
+        pool = multiprocessing.get_context("fork").Pool(Nprocess)
+        try:
+            result = pool.map(_process_station,
+                              [(i, starting_date, Nlearning)
+                               for i in range(self.ens.Nstation)],
+                              chunksize = 1)
+        finally:
+            pool.close()
+            pool.join()
+            _parallel_method = None
+        for station in range(self.ens.Nstation):
+            self.weight[station] = result[station]["weight"][station]
+            self.weight_ext[station] = result[station]["weight_ext"][station]
+            self.weight_date[station] \
+                = result[station]["weight_date"][station]
+        # The other attributes (tools, bias, current step, ...) are left as
+        # they are after the last station, as in serial mode.
+        state = result[-1]
+        for name in ["weight", "weight_ext", "weight_date"]:
+            del state[name]
+        self.__dict__.update(state)
+
+
+    def Process(self, Nprocess = None, checkpoint_file = None,
+                Ncheckpoint = None):
         """
+        Computes the weights and the resulting combination.
+
+        @type Nprocess: integer
+        @param Nprocess: The number of processes among which the stations are
+        distributed, with option "station". If None, 'self.Nprocess' is used.
+        @type checkpoint_file: string
+        @param checkpoint_file: If not None, the state of the method is saved
+        in this file every 'Ncheckpoint' steps. If the file exists when
+        'Process' is called, the computations are resumed from the saved
+        state, provided it was saved by the same computation (see
+        'LoadState'). The file is removed once all weights are computed.
+        Checkpoints are not available in parallel mode.
+        @type Ncheckpoint: integer
+        @param Ncheckpoint: The number of steps between two checkpoints. If
+        None, 'self.Ncheckpoint' is used.
+        """
+        if Nprocess is None:
+            Nprocess = self.Nprocess
+        if Ncheckpoint is not None:
+            self.Ncheckpoint = Ncheckpoint
+        self.checkpoint_file = checkpoint_file
+        self.online = False
+        self.fingerprint = self.GetFingerprint()
+
         # Number of cycles of UpdateWeight in global/step or station mode.
         if self.option == "global" or self.option == "step":
             Ncycle = 1
@@ -422,43 +861,50 @@ class EnsembleMethod:
         elif self.ens.config.concentrations == "hourly":
             starting_date = 24 * self.Nskip
 
-        for self.station in range(Ncycle):
-            if self.option == "station":
-                self.prt("Number of processed stations: " + str(self.station)
-                         + "/" + str(Ncycle))
-
-            self.Init()
-            for self.step in range(starting_date, len(self.ens.all_dates)):
-                if self.option in ["step", "global"]:
-                    self.prt("Number of processed steps: " + str(self.step)
-                             + "/"
-                             + str(len(self.ens.all_dates) - starting_date))
-                s, o = self.CollectData(self.GetLearningDates())
-                # Stores the effective date of weights.
-                if self.option == "global" or self.option == "step":
-                    self.weight_date.append(self.ens.all_dates[self.step])
-                elif self.option == "station":
-                    tmp = self.ens.all_dates[self.step]
-                    self.weight_date[self.station].append(tmp)
-
-                if o.shape != (0,):
-                    self.UpdateWeight(s, o)
-                else:
-                    # If there is no observation, previous weights are used.
-                    self.AcquireWeight(self.GetPreviousWeight().copy())
+        self.InitLearningData()
+        Nlearning = self.Nlearning
+        resume = checkpoint_file is not None \
+                 and os.path.isfile(checkpoint_file)
+        if resume:
+            self.LoadState(checkpoint_file)
+            first_station = self.station
+        else:
+            first_station = 0
+        if self.option == "station" and Nprocess > 1 and Ncycle > 1 \
+               and checkpoint_file is None \
+               and "fork" in multiprocessing.get_all_start_methods():
+            self.ProcessParallel(starting_date, Nlearning, Nprocess)
+        else:
+            for self.station in range(first_station, Ncycle):
+                if self.option == "station":
+                    self.prt("Number of processed stations: "
+                             + str(self.station) + "/" + str(Ncycle))
+                self.ProcessStation(starting_date, Nlearning,
+                                    resume and self.station == first_station)
+        if checkpoint_file is not None and os.path.isfile(checkpoint_file):
+            os.remove(checkpoint_file)
         if self.verbose:
             self.prt.Clear()
 
         # Processed dates.
         self.all_dates = self.ens.all_dates[starting_date:]
 
-        # Conversion to arrays.
+        self.Combine()
+
+
+    def Combine(self):
+        """
+        Combines the models with the weights computed by 'Process' (in
+        attributes 'weight' and 'weight_date'), and restricts the
+        observations to the dates of the combination.
+        """
+        # Conversion to arrays, without copy.
         if self.option == "global" or self.option == "step":
-            self.weight = array(self.weight)
-            self.weight_ext = array(self.weight_ext)
+            self.weight = weight_array(self.weight)
+            self.weight_ext = weight_array(self.weight_ext)
         elif self.option == "station":
-            self.weight = [array(x) for x in self.weight]
-            self.weight_ext = [array(x) for x in self.weight_ext]
+            self.weight = [weight_array(x) for x in self.weight]
+            self.weight_ext = [weight_array(x) for x in self.weight_ext]
 
         # Combining predictions.
         if self.option == "global" or self.option == "step":
@@ -487,6 +933,90 @@ class EnsembleMethod:
         self.CheckCompatibility(self.date, self.obs)
 
 
+    def InitOnline(self):
+        """
+        Initializes the online mode, in which the method is fed one step at
+        a time by 'Step'. Previous weights are discarded. Only the data
+        needed by the learning period is kept in memory. The ensemble 'ens'
+        only provides the configuration and the number of stations.
+        """
+        if self.option == "station":
+            raise Exception("The online mode is not available with option "
+                            + "\"station\".")
+        if self.ens.config.concentrations == "peak":
+            self.online_delta = datetime.timedelta(1)
+            Nhistory = 1
+        elif self.ens.config.concentrations == "hourly":
+            self.online_delta = datetime.timedelta(0, 3600)
+            Nhistory = 24
+        Nlearning = self.Nlearning
+        if "Nlearning_max" in dir(self):
+            Nlearning = self.Nlearning_max
+        # Circular buffers of the learning data.
+        Nhistory = Nhistory * Nlearning + 1
+        self.learning_sim = zeros((Nhistory, self.Nsim, self.ens.Nstation),
+                                  'd')
+        self.learning_obs = zeros((Nhistory, self.ens.Nstation), 'd')
+        self.learning_mask = zeros((Nhistory, self.ens.Nstation), 'bool')
+
+        self.weight = WeightHistory(self.Nsim)
+        self.weight_ext = WeightHistory(2 * self.Nsim)
+        self.weight_date = []
+        self.online = True
+        self.online_date = None
+        self.step = -1
+        self.Init()
+
+
+    def Step(self, date, sim, obs):
+        """
+        Feeds the method with the data of a new step and computes the weights
+        for the next step (online mode). The weights are appended to the
+        history 'weight' (attribute). 'InitOnline' is called at the first
+        step.
+
+        @type date: datetime
+        @param date: The date of the new data. Dates must be consecutive (one
+        hour or one day apart): missing data is set to NaN.
+        @type sim: 2D array
+        @param sim: The simulated concentrations at 'date', indexed by the
+        model and the station.
+        @type obs: 1D array
+        @param obs: The observations at 'date', indexed by the station.
+        Missing observations are set to NaN.
+
+        @rtype: 1D array
+        @return: The weights for the next step.
+        """
+        if not self.online:
+            self.InitOnline()
+        elif date != self.online_date:
+            raise Exception("Expected data at " + str(self.online_date)
+                            + ", but got data at " + str(date) + ".")
+        sim = asarray(sim, 'd')
+        obs = asarray(obs, 'd')
+        mask = isfinite(obs) & isfinite(sim).all(0)
+
+        self.step += 1
+        index = self.step % len(self.learning_sim)
+        self.learning_sim[index] = where(mask, sim, 0.)
+        self.learning_obs[index] = where(mask, obs, 0.)
+        self.learning_mask[index] = mask
+
+        # Moves to the next step, for which no data is available yet.
+        self.step += 1
+        self.online_date = date + self.online_delta
+        self.learning_mask[self.step % len(self.learning_sim)] = False
+        s, o = self.CollectSteps(self.GetLearningSteps())
+        self.weight_date.append(self.online_date)
+        if o.shape != (0,):
+            self.UpdateWeight(s, o)
+        else:
+            self.AcquireWeight(self.GetPreviousWeight().copy())
+        self.step -= 1
+        return self.weight[-1]
+
+
     def ComputeStatistics(self, period = None):
         """
         Computes global statistics.
@@ -652,17 +1182,20 @@ class BestModel(EnsembleMethod):
             self.sim = self.ens.sim[i]
 
         elif self.option == "station":
-            self.sim = []
-            for n in range(self.ens.Nstation):
-                sim_stat = compute_stat(self.ens.sim, self.ens.obs,
-                                        (self.measure,),
-                                        dates = self.ens.date,
-                                        period = self.ens.all_dates[Nskip:],
-                                        stations = self.ens.station,
-                                        stations_out = [self.ens.station[n]],
-                                        cutoff = self.config.cutoff)
-                i = select(sim_stat[self.measure])
-                self.sim.append(self.ens.sim[i][n])
+            # The measure is computed for all models and stations at once.
+            sim, obs, mask = combine.collect_dense(self.ens.sim, self.ens.obs,
+                                                   self.ens.date,
+                                                   self.ens.all_dates[Nskip:])
+            sim_stat = stat.measure_registry \
+                       .ComputeGrouped(self.measure, transpose(sim, (1, 0, 2)),
+                                       obs, mask, self.config.cutoff)
+            isim = select_along_axis(select, sim_stat, 0)
+            self.sim = [self.ens.sim[isim[n]][n]
+                        for n in range(self.ens.Nstation)]
+
+        else:
+            raise Exception("Option \"" + self.option + "\" is not "
+                            + "supported. See 'BestModelRolling'.")
 
         self.date = self.ens.date
         self.obs = self.ens.obs
@@ -715,19 +1248,11 @@ class EnsembleMean(EnsembleMethod):
 
 
     def GetTools(self):
-        if self.ens.config.concentrations == "peak":
-            return self.instantaneous_bias[0]
-        elif self.ens.config.concentrations == "hourly":
-            hour = self.ens.all_dates[self.step].hour
-            return self.instantaneous_bias[hour]
+        return self.instantaneous_bias[self.GetSlot()]
 
 
     def UpdateTools(self, ibias_liste):
-        if self.ens.config.concentrations == "peak":
-            self.instantaneous_bias[0] = ibias_liste
-        elif self.ens.config.concentrations == "hourly":
-            hour = self.ens.all_dates[self.step].hour
-            self.instantaneous_bias[hour] = ibias_liste
+        self.instantaneous_bias[self.GetSlot()] = ibias_liste
 
 
     def UpdateWeight(self, s, o):
@@ -742,30 +1267,37 @@ class EnsembleMean(EnsembleMethod):
         self.AcquireWeight(weight)
 
 
-##################
-# ENSEMBLEMEDIAN #
-##################
+####################
+# ENSEMBLEQUANTILE #
+####################
 
 
-class EnsembleMedian(EnsembleMethod):
+class EnsembleQuantile(EnsembleMethod):
     """
-    Computes the ensemble median. If there is an even number of models, the
-    mean of the two middle models is used.
+    Computes a quantile of the ensemble, e.g., its median, or its trimmed
+    mean. Quantiles are linearly interpolated between the two closest models.
     """
 
 
     def __init__(self, ens, configuration_file = None, process = True,
-                 statistics = True, bias_removal = False, Nbias = None,
-                 verbose = False):
+                 statistics = True, quantile = 0.5, trim = None,
+                 bias_removal = False, Nbias = None, verbose = False):
         """
         See documentation of 'EnsembleMethod.__init__' for explanations about
         arguments.
 
+        @type quantile: float
+        @param quantile: The quantile, in [0, 1].
+        @type trim: float
+        @param trim: If not None, the trimmed mean is computed instead of the
+        quantile: this proportion of models is discarded at each end.
         @type bias_removal: Boolean
         @param bias_removal: Should bias be removed?
         @type Nbias: integer
         @param Nbias: Number of previous steps used to compute the bias.
         """
+        self.quantile = quantile
+        self.trim = trim
         self.bias_removal = bias_removal
         if self.bias_removal and (Nbias ==None):
             raise Exception("You have to give an integer value to 'Nbias'.")
@@ -777,50 +1309,99 @@ class EnsembleMedian(EnsembleMethod):
 
 
     def Process(self):
-        self.sim = []
-        self.date = []
         self.all_dates = self.ens.all_dates[self.Nskip:]
 
-        restrict = observation.restrict_to_period
-        # Building 'sim'.
-        for istation in range(self.ens.Nstation):
-            sim_station = []
-            for i in range(self.Nsim):
-                date_rest, sim_rest = \
-                           restrict(self.ens.date[istation],
-                                    self.ens.sim[i][istation],
-                                    self.ens.all_dates[self.Nskip:])
-                sim_station.append(sim_rest)
-            self.date.append(date_rest)
-            self.sim.append(combine.m_median(array(sim_station)))
-
-        # Building 'obs'.
-        self.obs = []
-        for i in range(self.ens.Nstation):
-            self.obs.append(restrict(self.ens.date[i], self.ens.obs[i],
-                                     self.all_dates)[1])
+        # All stations and dates are processed at once.
+        sim, obs, mask = combine.collect_dense(self.ens.sim, self.ens.obs,
+                                               self.ens.date, self.all_dates)
+        sim = transpose(sim, (1, 0, 2))
+        if self.trim is None:
+            sim = combine.m_quantile(sim, self.quantile)
+        else:
+            sim = combine.m_trimmed_mean(sim, self.trim)
 
         # Removes the bias.
         if self.bias_removal:
-            self.bias = [0]
-            self.instantaneous_bias = self.InitialList([])
-            for self.step in range(len(self.all_dates)):
-                period = self.all_dates[self.step]
-                hour = self.all_dates[self.step].hour
-                s, o = combine.collect_dates(self.sim, self.obs,
-                                             dates = self.date,
-                                             period = period)
-
-                if self.ens.config.concentrations == "peak":
-                    ibias = self.instantaneous_bias[0]
-                elif self.ens.config.concentrations == "hourly":
-                    ibias = self.instantaneous_bias[hour]
-
-                l = len(ibias)
-                ibias.append((s - o).mean())
-                self.bias.append(mean(ibias[-min(self.Nbias, l):]))
-            self.sim = combine.remove_bias_step\
-                       (self.date, self.sim, self.all_dates, self.bias)[0]
+            self.bias = [0] + list(self.ComputeBias(sim, obs, mask))
+            sim = sim - array(self.bias[:-1])[:, newaxis]
+
+        self.sim = []
+        self.obs = []
+        self.date = []
+        for istation in range(self.ens.Nstation):
+            index = flatnonzero(mask[:, istation])
+            self.date.append([self.all_dates[i] for i in index])
+            self.sim.append(sim[index, istation])
+            self.obs.append(obs[index, istation])
+
+
+    def ComputeBias(self, sim, obs, mask):
+        """
+        Computes the bias after each step. The bias is the running mean, over
+        the last 'Nbias' steps associated with the same hour (for hourly
+        concentrations), of the mean error at all stations.
+
+        @type sim: 2D-array
+        @param sim: The combined concentrations (dates x stations).
+        @type obs: 2D-array
+        @param obs: The observations (dates x stations).
+        @type mask: 2D-array
+        @param mask: The mask (dates x stations) which is True where data is
+        available.
+
+        @rtype: 1D-array
+        @return: The bias computed after each step.
+        """
+        with errstate(invalid = "ignore", divide = "ignore"):
+            error = where(mask, sim - obs, 0.).sum(1) / mask.sum(1)
+        if self.ens.config.concentrations == "hourly":
+            slot = array([x.hour for x in self.all_dates], dtype = 'int')
+        else:
+            slot = zeros(len(self.all_dates), dtype = 'int')
+
+        bias = empty(len(error), dtype = 'd')
+        for i in unique(slot):
+            index = flatnonzero(slot == i)
+            slot_error = error[index]
+            # Steps without any observation are excluded through the
+            # number of missing errors in each window.
+            missing = isnan(slot_error)
+            total = concatenate(([0.], cumsum(where(missing, 0.,
+                                                    slot_error))))
+            Nmissing = concatenate(([0], cumsum(missing)))
+            step = arange(len(index))
+            start = maximum(0, step + 1 - self.Nbias)
+            slot_bias = (total[step + 1] - total[start]) \
+                        / (step + 1 - start)
+            slot_bias[Nmissing[step + 1] > Nmissing[start]] = nan
+            bias[index] = slot_bias
+        return bias
+
+
+class EnsembleMedian(EnsembleQuantile):
+    """
+    Computes the ensemble median. If there is an even number of models, the
+    mean of the two middle models is used.
+    """
+
+
+    def __init__(self, ens, configuration_file = None, process = True,
+                 statistics = True, bias_removal = False, Nbias = None,
+                 verbose = False):
+        """
+        See documentation of 'EnsembleMethod.__init__' for explanations about
+        arguments.
+
+        @type bias_removal: Boolean
+        @param bias_removal: Should bias be removed?
+        @type Nbias: integer
+        @param Nbias: Number of previous steps used to compute the bias.
+        """
+        EnsembleQuantile.__init__(self, ens,
+                                  configuration_file = configuration_file,
+                                  process = process, statistics = statistics,
+                                  quantile = 0.5, bias_removal = bias_removal,
+                                  Nbias = Nbias, verbose = verbose)
 
 
 #######
@@ -875,37 +1456,26 @@ class ELS(EnsembleMethod):
 
         self.all_dates = self.ens.all_dates[self.Nskip:]
 
+        # The least-square problems (one per station with option "station")
+        # are stacked: problems x simulations x dates.
+        sim, obs, mask = combine.collect_dense(self.ens.sim, self.ens.obs,
+                                               self.ens.date, self.all_dates)
+        sim = sim.transpose(2, 1, 0)
+        obs = obs.T
+        mask = mask.T
         if self.option in ["global", "step"]:
-            Nloop = 1
-        elif self.option == "station":
-            Nloop = self.ens.Nstation
+            sim = sim.transpose(1, 0, 2).reshape(1, self.Nsim, -1)
+            obs = obs.reshape(1, -1)
+            mask = mask.reshape(1, -1)
 
-        if self.constraint is None and self.penalization is None:
-            combine_method = combine.w_least_squares
-        elif self.constraint is None: # With penalization
-            combine_method = combine.w_penalized_least_squares
+        if self.constraint is None:
+            self.weight = combine.w_least_squares_batch(
+                sim, obs, mask, penalization = self.penalization)
         else:
-            combine_method = combine.w_least_squares_simplex
-
-        for i in range(Nloop):
-            if self.option in ["global", "step"]:
-                stations_out = self.ens.station
-            elif self.option == "station":
-                stations_out = [self.ens.station[i]]
-
-            s, o = combine.collect(self.ens.sim, self.ens.obs,
-                                   dates = self.ens.date,
-                                   period = self.all_dates,
-                                   stations = self.ens.station,
-                                   stations_out = stations_out)
-            if self.constraint is None and self.penalization == None:
-                self.weight.append(combine_method(s, o))
-            elif self.constraint is None: # With penalization
-                self.weight.append(combine_method(s, o, self.penalization))
-            else:
-                self.weight.append(combine_method(s, o))
-        # Reshapes to ease computations.
-        self.weight = map(lambda x: x.reshape(x.size, 1), self.weight)
+            self.weight = combine.w_least_squares_simplex_batch(
+                sim, obs, mask)
+        # Reshapes to ease computations (problems x simulations x 1).
+        self.weight = self.weight[:, :, newaxis]
 
         self.sim = []
         for station in range(self.ens.Nstation):
@@ -988,7 +1558,8 @@ class ELSdN(EnsembleMethod):
 
     def __init__(self, ens, configuration_file = None, process = True,
                  statistics = True, Nskip = 1, Nlearning = 1,
-                 Nlearning_min = None, option = "step", verbose = False):
+                 Nlearning_min = None, option = "step", verbose = False,
+                 Nprocess = 1):
         """
         See documentation of 'EnsembleMethod.__init__' for explanations about
         arguments not described below.
@@ -1005,7 +1576,8 @@ class ELSdN(EnsembleMethod):
                                 configuration_file = configuration_file,
                                 process = process, statistics = statistics,
                                 Nskip = Nskip, Nlearning = Nlearning_min,
-                                option = option, verbose = verbose)
+                                option = option, verbose = verbose,
+                                Nprocess = Nprocess)
 
 
     def Init(self):
@@ -1064,7 +1636,6 @@ class BestModelStep(EnsembleMethod):
 
     def Init(self):
         self.initial_weight = ones(self.Nsim, dtype = 'd') / float(self.Nsim)
-        self.weight = []
         if self.bias_removal:
             self.bias = []
         self.all_dates = []
@@ -1074,19 +1645,43 @@ class BestModelStep(EnsembleMethod):
         weight = zeros(shape = (self.Nsim, ), dtype = 'd')
         if self.bias_removal:
             s_mean = 0.
-        measures = [getattr(stat, self.measure)(x, o) for x in s]
-        indices = range(self.Nsim)
+        measures = list(stat.measure_registry.Compute(self.measure, s, o,
+                                                      self.config.cutoff))
+        indices = list(range(self.Nsim))
         for i in range(self.Nmodel):
             index = self.select(measures)
             weight[indices[index]] = 1. / float(self.Nmodel)
             if self.bias_removal:
-                s_mean += s.mean() / float(self.Nmodel)
+                s_mean += s[indices[index]].mean() / float(self.Nmodel)
             measures.pop(index)
             indices.pop(index)
-        self.weight.append(weight)
+        if self.bias_removal:
+            self.AcquireWeight(weight, s_mean - o.mean())
+        else:
+            self.AcquireWeight(weight)
+
 
+    def AcquireWeight(self, weight, bias = None):
+        """
+        Adds the weights and the bias for the current step, so that a bias
+        is available at every step of the combination.
+
+        @type weight: 1D array
+        @param weight: The weights.
+        @type bias: float
+        @param bias: The bias. If it is None (at steps without observations,
+        where the previous weights are used), the previous bias at the same
+        hour is used, or 0 if there is none.
+        """
+        EnsembleMethod.AcquireWeight(self, weight)
         if self.bias_removal:
-            self.bias.append(s_mean - o.mean())
+            if bias is None:
+                Nslot = self.GetNslot()
+                if len(self.bias) < Nslot:
+                    bias = 0.
+                else:
+                    bias = self.bias[-Nslot]
+            self.bias.append(bias)
 
 
 ########################
@@ -1123,19 +1718,137 @@ class BestModelStepStation(EnsembleMethod):
 
     def Process(self):
         self.Init()
+        self.all_dates = self.ens.all_dates[:]
+
+        # The best models are selected at all steps and stations at once.
+        sim, obs, mask = combine.collect_dense(self.ens.sim, self.ens.obs,
+                                               self.ens.date, self.all_dates)
+        isim = abs(sim - obs[:, newaxis]).argmin(1)
+        best = take_along_axis(sim, isim[:, newaxis], 1)[:, 0]
+        for istation in range(self.ens.Nstation):
+            index = flatnonzero(mask[:, istation])
+            self.date[istation] = [self.all_dates[i] for i in index]
+            self.isim[istation] = isim[index, istation].tolist()
+            self.sim[istation] = best[index, istation]
+            self.obs[istation] = obs[index, istation]
+
+
+####################
+# BESTMODELROLLING #
+####################
+
 
-        # Dates.
-        for self.step in range(len(self.ens.all_dates)):
-            self.all_dates.append(self.ens.all_dates[self.step])
-        # Simulated data and observations.
+class BestModelRolling(EnsembleMethod):
+    """
+    This method selects, at each step, the best model over the learning
+    period, that is, over the previous 'Nlearning' steps (at the same hour
+    for hourly concentrations). With option 'step', a single model is
+    selected for all stations, as in 'BestModelStep'. With option 'station',
+    a model is selected for each station.
+    """
+
+
+    def __init__(self, ens, configuration_file = None, process = True,
+                 statistics = True, Nskip = 1, Nlearning = 1,
+                 measure = "rmse", select = argmin, option = "step",
+                 verbose = False):
+        """
+        See documentation of 'EnsembleMethod.__init__' for explanations about
+        arguments not described below.
+
+        @type measure: string
+        @param measure: The measure according to which the model is the best.
+        @type select: callable object
+        @param select: function that returns the index of the best measure in
+        a list. For example, it should return the index of the lowest number
+        if the measure is RMSE, but the index of the closest number to one if
+        the measure is correlation.
+        """
+        if option not in ["step", "station"]:
+            raise Exception("Unknown option: \"" + option + "\".")
+        if Nlearning < 1:
+            raise Exception("At least one learning step is required.")
+        self.measure = measure
+        self.select = select
+        EnsembleMethod.__init__(self, ens,
+                                configuration_file = configuration_file,
+                                process = process, statistics = statistics,
+                                Nskip = Nskip, Nlearning = Nlearning,
+                                option = option, verbose = verbose)
+
+
+    def ComputeScore(self, sim, obs, mask, starting_date):
+        """
+        Computes the measures of all models over the learning period of each
+        step.
+
+        @type sim: 3D-array
+        @param sim: The simulated concentrations (dates x simulations x
+        stations).
+        @type obs: 2D-array
+        @param obs: The observations (dates x stations).
+        @type mask: 2D-array
+        @param mask: The mask (dates x stations) which is True where data is
+        available.
+        @type starting_date: integer
+        @param starting_date: The index of the first processed step.
+
+        @rtype: 3D-array
+        @return: The measures (steps x simulations x stations) with option
+        'station', or (steps x simulations x 1) with option 'step'. They are
+        NaN when no observation is available in the learning period.
+        """
+        if self.ens.config.concentrations == "peak":
+            stride = 1
+        elif self.ens.config.concentrations == "hourly":
+            stride = 24
+        sim = transpose(sim, (1, 0, 2))
+        if self.option == "step":
+            Ngroup = 1
+        else:
+            Ngroup = self.ens.Nstation
+        compute = stat.measure_registry.ComputeGrouped
+
+        score = empty((len(obs) - starting_date, self.Nsim, Ngroup), 'd')
+        for step in range(starting_date, len(obs)):
+            steps = arange(step - stride * self.Nlearning, step, stride)
+            steps = steps[steps >= 0]
+            s, o, m = sim[:, steps], obs[steps], mask[steps]
+            if self.option == "step":
+                s = s.reshape(self.Nsim, -1, 1)
+                o = o.reshape(-1, 1)
+                m = m.reshape(-1, 1)
+            score[step - starting_date] = compute(self.measure, s, o, m,
+                                                  self.config.cutoff)
+        return score
+
+
+    def Process(self):
+        if self.ens.config.concentrations == "peak":
+            starting_date = self.Nskip
+        elif self.ens.config.concentrations == "hourly":
+            starting_date = 24 * self.Nskip
+        self.all_dates = self.ens.all_dates[starting_date:]
+
+        sim, obs, mask = combine.collect_dense(self.ens.sim, self.ens.obs,
+                                               self.ens.date,
+                                               self.ens.all_dates)
+        self.score = self.ComputeScore(sim, obs, mask, starting_date)
+        # If no observation is available in the learning period, the
+        # measures are NaN and the first model is selected.
+        self.isim = select_along_axis(self.select, self.score, 1)
+        if self.option == "step":
+            self.isim = self.isim.repeat(self.ens.Nstation, 1)
+
+        sim = sim[starting_date:]
+        obs = obs[starting_date:]
+        mask = mask[starting_date:]
+        best = take_along_axis(sim, self.isim[:, newaxis], 1)[:, 0]
+        self.date = []
+        self.sim = []
+        self.obs = []
         for istation in range(self.ens.Nstation):
-            for step in range(len(self.ens.obs[istation])):
-                self.date[istation].append(self.ens.date[istation][step])
-                obs = self.ens.obs[istation][step]
-                self.obs[istation].append(obs)
-                i = array([abs(x[istation][step] - obs)
-                           for x in self.ens.sim]).argmin()
-                self.isim[istation].append(i)
-                self.sim[istation].append(self.ens.sim[i][istation][step])
-            self.sim[istation] = array(self.sim[istation])
-            self.obs[istation] = array(self.obs[istation])
+            index = flatnonzero(mask[:, istation])
+            self.date.append([self.all_dates[i] for i in index])
+            self.sim.append(best[index, istation])
+            self.obs.append(obs[index, istation])
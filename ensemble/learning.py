@@ -28,6 +28,43 @@ from atmopy.ensemble.ensemble_method import *
 sys.path.pop(0)
 
 
+######################
+# LOG-DOMAIN WEIGHTS #
+######################
+
+
+def log_normalize(log_weight):
+    """
+    Normalizes log-weights so that their exponentials sum to one. The
+    normalization constant is computed with the log-sum-exp trick, so that
+    neither overflow nor underflow occurs, whatever the magnitude of the
+    log-weights.
+
+    @type log_weight: 1D array
+    @param log_weight: The log-weights, up to an additive constant.
+
+    @rtype: 1D array
+    @return: The normalized log-weights, in double precision.
+    """
+    log_weight = asarray(log_weight, 'd')
+    M = log_weight.max()
+    return log_weight - (M + log(exp(log_weight - M).sum()))
+
+
+def exp_normalize(log_weight):
+    """
+    Computes the weights associated with log-weights.
+
+    @type log_weight: 1D array
+    @param log_weight: The log-weights, up to an additive constant.
+
+    @rtype: 1D array
+    @return: The weights, which sum to one.
+    """
+    weight = exp(asarray(log_weight, 'd') - log_weight.max())
+    return weight / weight.sum()
+
+
 ##################################
 # EXPONENTIALLY WEIGHTED AVERAGE #
 ##################################
@@ -36,40 +73,58 @@ sys.path.pop(0)
 class ExponentiallyWeightedAverage(EnsembleMethod):
     """
     This class implements the exponentially weighted average algorithm
-    (Cesa-Bianchi & Lugosi, 2006, p. 45).
+    (Cesa-Bianchi & Lugosi, 2006, p. 45). The weights are updated in the
+    logarithmic domain.
     """
 
 
     def __init__(self, ens, configuration_file = None, process = True,
                  statistics = True, Nskip = 1, Nlearning = 1, learning_rate =
-                 3.e-6, option = "step", verbose = False):
+                 3.e-6, option = "step", dtype = 'd', verbose = False,
+                 Nprocess = 1):
         """
         See documentation of 'EnsembleMethod.__init__' for explanations about
         arguments.
 
         @type learning_rate: float
         @param learning_rate: Learning rate.
+        @type dtype: string
+        @param dtype: The type in which the log-weights are stored ('d', or
+        'f' to save memory).
         """
         self.learning_rate = learning_rate
+        self.dtype = dtype
         EnsembleMethod.__init__(self, ens,
                                 configuration_file = configuration_file,
                                 process = process, statistics = statistics,
                                 Nskip = Nskip, Nlearning = Nlearning,
-                                option = option, verbose = verbose)
+                                option = option, verbose = verbose,
+                                Nprocess = Nprocess)
 
 
     def Init(self):
         self.initial_weight = ones(self.Nsim, 'd') / float(self.Nsim)
+        self.log_weight = self.InitialList(log(self.GetInitialWeight())
+                                           .astype(self.dtype))
+
+
+    def GetTools(self):
+        return self.log_weight[self.GetSlot()]
+
+
+    def UpdateTools(self, log_weight):
+        log_weight = log_weight.astype(self.dtype)
+        self.log_weight[self.GetSlot()] = log_weight
 
 
     def UpdateWeight(self, s, o):
-        previous_weight = self.GetPreviousWeight()
+        log_weight = self.GetTools()
 
         loss = sum((s - o) ** 2, 1)
-        weight = previous_weight * exp(-self.learning_rate * loss)
-        weight /= weight.sum()
+        log_weight = log_normalize(log_weight - self.learning_rate * loss)
 
-        self.AcquireWeight(weight)
+        self.UpdateTools(log_weight)
+        self.AcquireWeight(exp_normalize(log_weight))
 
 
 ##########################
@@ -80,42 +135,59 @@ class ExponentiallyWeightedAverage(EnsembleMethod):
 class ExponentiatedGradient(EnsembleMethod):
     """
     This class implements the exponentiated gradient algorithm (Cesa-Bianchi,
-    1999; Cesa-Bianchi & Lugosi, 2006, p. 23).
+    1999; Cesa-Bianchi & Lugosi, 2006, p. 23). The weights are updated in the
+    logarithmic domain.
     """
 
 
     def __init__(self, ens, configuration_file = None, process = True,
                  statistics = True, extended = False, U = 1., Nskip = 1,
                  Nlearning = 1, learning_rate = 2.e-5, option = "step",
-                 verbose = False):
+                 dtype = 'd', verbose = False, Nprocess = 1):
         """
         See documentation of 'EnsembleMethod.__init__' for explanations about
         arguments.
 
         @type learning_rate: float
         @param learning_rate: Learning rate.
+        @type dtype: string
+        @param dtype: The type in which the log-weights are stored ('d', or
+        'f' to save memory).
         """
         self.learning_rate = learning_rate
+        self.dtype = dtype
         EnsembleMethod.__init__(self, ens,
                                 configuration_file = configuration_file,
                                 process = process, statistics = statistics,
                                 Nskip = Nskip, Nlearning = Nlearning,
                                 option = option, extended = extended,
-                                verbose = verbose, U = U)
+                                verbose = verbose, U = U, Nprocess = Nprocess)
 
 
     def Init(self):
         self.initial_weight = ones((self.Nsim), 'd') / float(self.Nsim)
+        self.log_weight = self.InitialList(log(self.GetInitialWeight())
+                                           .astype(self.dtype))
+
+
+    def GetTools(self):
+        return self.log_weight[self.GetSlot()]
+
+
+    def UpdateTools(self, log_weight):
+        log_weight = log_weight.astype(self.dtype)
+        self.log_weight[self.GetSlot()] = log_weight
 
 
     def UpdateWeight(self, s, o):
         previous_weight = self.GetPreviousWeight()
+        log_weight = self.GetTools()
 
         loss = 2. * sum((dot(previous_weight, s) - o) * s, 1)
-        weight = previous_weight * exp(-self.learning_rate * loss)
-        weight /= weight.sum()
+        log_weight = log_normalize(log_weight - self.learning_rate * loss)
 
-        self.AcquireWeight(weight)
+        self.UpdateTools(log_weight)
+        self.AcquireWeight(exp_normalize(log_weight))
 
 
 ######################################
@@ -133,7 +205,7 @@ class ExponentiatedGradientWindow(ExponentiatedGradient):
     def __init__(self, ens, configuration_file = None, process = True,
                  statistics = True, extended = False, U = 1., Nskip = 1,
                  Nlearning = 1, learning_rate = 2.e-5, Nkeep = 20,
-                 option = "step", verbose = False):
+                 option = "step", dtype = 'd', verbose = False, Nprocess = 1):
         """
         See documentation of 'ExponentiatedGradient.__init__' for explanations
         about arguments.
@@ -147,52 +219,72 @@ class ExponentiatedGradientWindow(ExponentiatedGradient):
                                        statistics = statistics, Nskip = Nskip,
                                        Nlearning = Nlearning, extended =
                                        extended, U = U, option = option,
-                                       learning_rate = learning_rate, verbose
-                                       = verbose)
+                                       learning_rate = learning_rate, dtype =
+                                       dtype, verbose = verbose,
+                                       Nprocess = Nprocess)
 
 
     def Init(self):
         self.initial_weight = ones((self.Nsim), 'd') / float(self.Nsim)
-        self.kept_weight = self.InitialList([])
+        N = len(self.GetInitialWeight())
+        # Ring buffer of the scaled losses of the last 'Nkeep' steps. The
+        # loss of step 'Nstep' is stored at 'Nstep % Nkeep'.
+        self.kept_loss = self.InitialList(zeros((self.Nkeep, N), self.dtype))
+        # Sum of the scaled losses over the window.
+        self.loss_sum = self.InitialList(zeros(N, 'd'))
+        self.Nstep = self.InitialList(0)
 
 
     def GetTools(self):
-        if self.ens.config.concentrations == "peak":
-            return self.kept_weight[0]
-        elif self.ens.config.concentrations == "hourly":
-            hour = self.ens.all_dates[self.step].hour
-            return self.kept_weight[hour]
-
-
-    def UpdateTools(self, kept_weight):
-        if self.ens.config.concentrations == "peak":
-            self.kept_weight[0] = kept_weight
-        elif self.ens.config.concentrations == "hourly":
-            hour = self.ens.all_dates[self.step].hour
-            self.kept_weight[hour] = kept_weight
-
-
-    def Upkeep(self, kept_weight, previous_weight, loss):
-        if len(kept_weight) < self.Nkeep:
-            kept_weight.append(exp(-self.learning_rate * loss))
-            weight = previous_weight * exp(-self.learning_rate * loss)
-        elif len(kept_weight) == self.Nkeep:
-            kept_weight.append(exp(-self.learning_rate * loss))
-            old_confidence = kept_weight.pop(0)
-            weight = previous_weight * exp(-self.learning_rate * loss) \
-                     / old_confidence
-        weight /= weight.sum()
-        return weight, kept_weight
+        slot = self.GetSlot()
+        return self.kept_loss[slot], self.loss_sum[slot], self.Nstep[slot]
+
+
+    def UpdateTools(self, kept_loss, loss_sum, Nstep):
+        slot = self.GetSlot()
+        self.kept_loss[slot] = kept_loss
+        self.loss_sum[slot] = loss_sum
+        self.Nstep[slot] = Nstep
+
+
+    def Upkeep(self, kept_loss, loss_sum, Nstep, loss):
+        """
+        Replaces the oldest loss of the window with the latest loss, and
+        computes the weights. The log-weights are the opposite of the sum of
+        the scaled losses in the window (up to an additive constant).
+
+        @type kept_loss: 2D array
+        @param kept_loss: The ring buffer of the scaled losses.
+        @type loss_sum: 1D array
+        @param loss_sum: The sum of the scaled losses in the window.
+        @type Nstep: integer
+        @param Nstep: The number of losses added so far.
+        @type loss: 1D array
+        @param loss: The latest loss.
+
+        @rtype: (1D array, 1D array, integer)
+        @return: The weights, the updated sum and number of losses.
+        """
+        i = Nstep % self.Nkeep
+        loss_sum -= kept_loss[i]
+        kept_loss[i] = self.learning_rate * loss
+        loss_sum += kept_loss[i]
+        Nstep += 1
+        if i == self.Nkeep - 1:
+            # Avoids the accumulation of round-off errors.
+            loss_sum = kept_loss.sum(0, dtype = 'd')
+        return exp_normalize(- loss_sum), loss_sum, Nstep
 
 
     def UpdateWeight(self, s, o):
         previous_weight = self.GetPreviousWeight()
-        kept_weight = self.GetTools()
+        kept_loss, loss_sum, Nstep = self.GetTools()
 
         loss = 2. * sum((dot(previous_weight, s) - o) * s, 1)
-        weight, kept_weight = self.Upkeep(kept_weight, previous_weight, loss)
+        weight, loss_sum, Nstep = self.Upkeep(kept_loss, loss_sum, Nstep,
+                                              loss)
 
-        self.UpdateTools(kept_weight)
+        self.UpdateTools(kept_loss, loss_sum, Nstep)
         self.AcquireWeight(weight)
 
 
@@ -204,14 +296,16 @@ class ExponentiatedGradientWindow(ExponentiatedGradient):
 class ExponentiatedGradientDiscounted(EnsembleMethod):
     """
     This class implements the exponentiated gradient algorithm with discount
-    losses (Mallet, Mauricette, and Stoltz, 2007).
+    losses (Mallet, Mauricette, and Stoltz, 2007). The weights are computed in
+    the logarithmic domain.
     """
 
 
     def __init__(self, ens, configuration_file = None, process = True,
                  statistics = True, extended = False, U = 1., Nskip = 1,
                  Nlearning = 1, learning_rate = 1.2e-4, forget_rate = 1.,
-                 p1 = 0.5, p2 = 1., option = "step", verbose = False):
+                 p1 = 0.5, p2 = 1., option = "step", dtype = 'd',
+                 verbose = False, Nprocess = 1):
         """
         See documentation of 'EnsembleMethod.__init__' for explanations about
         arguments.
@@ -224,17 +318,21 @@ class ExponentiatedGradientDiscounted(EnsembleMethod):
         @param p1: Power of the learning rate.
         @type p2: float
         @param p2: Power of the forget rate.
+        @type dtype: string
+        @param dtype: The type in which the past losses are stored ('d', or
+        'f' to save memory).
         """
         self.learning_rate = learning_rate
         self.forget_rate = forget_rate
         self.p1 = p1
         self.p2 = p2
+        self.dtype = dtype
         EnsembleMethod.__init__(self, ens,
                                 configuration_file = configuration_file,
                                 process = process, statistics = statistics,
                                 Nskip = Nskip, Nlearning = Nlearning,
                                 option = option, extended = extended,
-                                verbose = verbose, U = U)
+                                verbose = verbose, U = U, Nprocess = Nprocess)
 
 
     def Init(self):
@@ -243,19 +341,11 @@ class ExponentiatedGradientDiscounted(EnsembleMethod):
 
 
     def GetTools(self):
-        if self.ens.config.concentrations == "peak":
-            return self.confidence[0]
-        elif self.ens.config.concentrations == "hourly":
-            hour = self.ens.all_dates[self.step].hour
-            return self.confidence[hour]
+        return self.confidence[self.GetSlot()]
 
 
     def UpdateTools(self, confidence):
-        if self.ens.config.concentrations == "peak":
-            self.confidence[0] = confidence
-        elif self.ens.config.concentrations == "hourly":
-            hour = self.ens.all_dates[self.step].hour
-            self.confidence[hour] = confidence
+        self.confidence[self.GetSlot()] = confidence
 
 
     def UpdateWeight(self, s, o):
@@ -263,17 +353,15 @@ class ExponentiatedGradientDiscounted(EnsembleMethod):
         confidence = self.GetTools()
 
         loss = 2. * sum((dot(previous_weight, s) - o) * s, 1)
-        confidence.append(loss)
+        confidence.append(loss.astype(self.dtype))
         T = len(confidence)
-        weight = ones(len(previous_weight), 'd')
-        for i in range(T):
-            weight *= exp(-self.learning_rate * confidence[i]
-                           / T ** self.p1 * (1 + self.forget_rate
-                                             / (T - i) ** self.p2))
-            weight /= weight.sum()
+        discount = self.learning_rate / T ** self.p1 \
+                   * (1. + self.forget_rate
+                      / arange(T, 0, -1, dtype = 'd') ** self.p2)
+        log_weight = - dot(discount, array(confidence, 'd'))
 
         self.UpdateTools(confidence)
-        self.AcquireWeight(weight)
+        self.AcquireWeight(exp_normalize(log_weight))
 
 
 ###################################
@@ -291,7 +379,7 @@ class ExponentiatedGradientAdaptive(ExponentiatedGradientDiscounted):
     def __init__(self, ens, configuration_file = None, process = True,
                  statistics = True, extended = False, U = 1., Nskip = 1,
                  Nlearning = 1, a = 100., b = 1.,
-                 option = "step", verbose = False):
+                 option = "step", dtype = 'd', verbose = False, Nprocess = 1):
         """
         See documentation of 'EnsembleMethod.__init__' for explanations about
         arguments.
@@ -300,6 +388,9 @@ class ExponentiatedGradientAdaptive(ExponentiatedGradientDiscounted):
         @param a: A parameter to compute the learning rate.
         @type b: float
         @param b: Another parameter to compute the learning rate.
+        @type dtype: string
+        @param dtype: The type in which the cumulative losses are stored ('d',
+        or 'f' to save memory).
         """
         self.a = a
         self.b = b
@@ -309,41 +400,35 @@ class ExponentiatedGradientAdaptive(ExponentiatedGradientDiscounted):
                                                  statistics, Nskip = Nskip,
                                                  Nlearning = Nlearning,
                                                  extended = extended, option =
-                                                 option, verbose = verbose, U
-                                                 = U)
+                                                 option, dtype = dtype,
+                                                 verbose = verbose, U = U,
+                                                 Nprocess = Nprocess)
 
 
     def Init(self):
         self.factor = sqrt(2. * sqrt(2.) - 1.) / (exp(1.) - 2.)
         self.initial_weight = ones(self.Nsim,'d') / float(self.Nsim)
-        self.confidence = self.InitialList([])
+        # Since the learning rate applies to all past losses, only their sum
+        # is needed.
+        self.confidence = self.InitialList(zeros(len(self.GetInitialWeight()),
+                                                 self.dtype))
         self.variance = self.InitialList(0.)
         self.bound = self.InitialList(0.)
         self.learning_rate = self.InitialList(1.)
 
 
     def GetTools(self):
-        if self.ens.config.concentrations == "peak":
-            return self.confidence[0], self.variance[0], self.bound[0], \
-                   self.learning_rate[0]
-        elif self.ens.config.concentrations == "hourly":
-            hour = self.ens.all_dates[self.step].hour
-            return self.confidence[hour], self.variance[hour], \
-                   self.bound[hour], self.learning_rate[hour]
+        slot = self.GetSlot()
+        return self.confidence[slot], self.variance[slot], \
+               self.bound[slot], self.learning_rate[slot]
 
 
     def UpdateTools(self, confidence, variance, bound, learning_rate):
-        if self.ens.config.concentrations == "peak":
-            self.confidence[0] = confidence
-            self.variance[0] = variance
-            self.bound[0] = bound
-            self.learning_rate[0] = learning_rate
-        elif self.ens.config.concentrations == "hourly":
-            hour = self.ens.all_dates[self.step].hour
-            self.confidence[hour] = confidence
-            self.variance[hour] = variance
-            self.bound[hour] = bound
-            self.learning_rate[hour] = learning_rate
+        slot = self.GetSlot()
+        self.confidence[slot] = confidence
+        self.variance[slot] = variance
+        self.bound[slot] = bound
+        self.learning_rate[slot] = learning_rate
 
 
     def UpdateWeight(self, s, o):
@@ -354,16 +439,12 @@ class ExponentiatedGradientAdaptive(ExponentiatedGradientDiscounted):
 
         # Adds the variance of the gradient-loss term.
         variance += inner(previous_weight, (loss - mean_loss) ** 2)
-        bound = max(bound, abs(loss).max())
-        learning_rate = min(self.a / bound,
-                            self.factor * self.b
-                            * sqrt(log(self.Nsim) / variance))
-        confidence.append(loss)
-        T = len(confidence)
-        weight = ones(len(previous_weight), 'd')
-        for i in range(T):
-            weight *= exp(-learning_rate * confidence[i])
-            weight /= weight.sum()
+        bound = maximum(bound, abs(loss).max())
+        learning_rate = minimum(self.a / bound,
+                                self.factor * self.b
+                                * sqrt(log(self.Nsim) / variance))
+        confidence = (confidence + loss).astype(self.dtype)
+        weight = exp_normalize(- learning_rate * confidence)
 
         self.UpdateTools(confidence, variance, bound, learning_rate)
         self.AcquireWeight(weight)
@@ -384,7 +465,7 @@ class Prod(ExponentiatedGradient):
     def __init__(self, ens, configuration_file = None, process = True,
                  statistics = True, extended = False, U = 1., Nskip = 1,
                  Nlearning = 1, learning_rate = 5.5e-7,
-                 option = "step", verbose = False):
+                 option = "step", verbose = False, Nprocess = 1):
 
         """
         See documentation of 'EnsembleMethod.__init__' for explanations about
@@ -399,7 +480,7 @@ class Prod(ExponentiatedGradient):
                                        Nlearning = Nlearning, extended =
                                        extended, U = U, option = option,
                                        learning_rate = learning_rate, verbose
-                                       = verbose)
+                                       = verbose, Nprocess = Nprocess)
 
 
     def UpdateWeight(self, s, o):
@@ -428,7 +509,7 @@ class GradientDescent(EnsembleMethod):
     def __init__(self, ens, configuration_file = None, process = True,
                  statistics = True, Nskip = 1, Nlearning = 1,
                  learning_rate = 4.5e-9, lamb = 1.,
-                 option = "step", verbose = False):
+                 option = "step", verbose = False, Nprocess = 1):
         """
         See documentation of 'EnsembleMethod.__init__' for explanations about
         arguments.
@@ -444,7 +525,8 @@ class GradientDescent(EnsembleMethod):
                                 configuration_file = configuration_file,
                                 process = process, statistics = statistics,
                                 Nskip = Nskip, Nlearning = Nlearning,
-                                option = option, verbose = verbose)
+                                option = option, verbose = verbose,
+                                Nprocess = Nprocess)
 
 
     def Init(self):
@@ -469,31 +551,44 @@ class GradientDescent(EnsembleMethod):
 def projection_simplex(v):
     """
     Projection of the vector onto the simplex of probability distributions.
+    The projection is exact and computed in O(N log N) (see
+    'projection_simplex_batch').
 
     @type v: array
     @param v: array.
     """
-    v = -v
-    li = argsort(v)
-    v.sort()
-    v = -v
-    vc = 0.
-    m = 1
-    while vc <= 1. and m < len(v):
-        vc += m * (v[m-1] - v[m])
-        m += 1
-    m -= 1
-    z = v[:m]
-    la = 1. / m * (1 - sum(z))
-    z = z + la
-    z = concatenate([z, zeros(len(v) - m)], 0)
-    Inv = [list(li).index(j) for j in range(len(v))]
-    return z[Inv]
+    return projection_simplex_batch(asarray(v)[newaxis, :])[0]
+
+
+def projection_simplex_batch(V):
+    """
+    Projection of several vectors onto the simplex of probability
+    distributions. For each vector, the components are sorted in decreasing
+    order u_1 >= ... >= u_N; the support of the projection has rho elements,
+    where rho is the largest k such that u_k > (u_1 + ... + u_k - 1) / k, and
+    the projection is max(v - theta, 0) with theta = (u_1 + ... + u_rho - 1) /
+    rho (Held et al., 1974; Duchi et al., 2008).
+
+    @type V: 2D array
+    @param V: The vectors to be projected (one vector per row).
+
+    @rtype: 2D array
+    @return: The projections (one vector per row).
+    """
+    V = asarray(V, 'd')
+    N = V.shape[1]
+    U = -sort(-V, 1)
+    cumulative = cumsum(U, 1) - 1.
+    rho = (U * arange(1, N + 1) > cumulative).sum(1)
+    theta = cumulative[arange(V.shape[0]), rho - 1] / rho
+    return maximum(V - theta[:, newaxis], 0.)
 
 
 def projection_cubic(v, r):
     """
-    Projection of the vector onto the cube of radius r.
+    Projection of the vector onto the cube of radius r. Since the projection
+    is computed component by component, 'v' may also contain several vectors
+    (one per row).
 
     @type v: array
     @param v: array.
@@ -519,6 +614,24 @@ def projection_L2(v, r):
         return v
 
 
+def projection_L2_batch(V, r):
+    """
+    Projection of several vectors onto the ball of radius r.
+
+    @type V: 2D array
+    @param V: The vectors to be projected (one vector per row).
+    @type r: float or 1D array
+    @param r: radius of the ball, possibly one radius per vector.
+
+    @rtype: 2D array
+    @return: The projections (one vector per row).
+    """
+    V = asarray(V, 'd')
+    Norm = sqrt((V * V).sum(1))
+    scale = minimum(1., r / maximum(Norm, finfo('d').tiny))
+    return V * scale[:, newaxis]
+
+
 class Zink(EnsembleMethod):
     """
     This class implements the greedy projection gradient algorithm (Zinkevich,
@@ -530,7 +643,7 @@ class Zink(EnsembleMethod):
                  statistics = True, extended = False, U = 1., Nskip = 1,
                  Nlearning = 1, learning_rate = 1.e-6, radius = 1.,
                  projection_function = projection_simplex,
-                 option = "step", verbose = False):
+                 option = "step", verbose = False, Nprocess = 1):
         """
         See documentation of 'EnsembleMethod.__init__' for explanations about
         arguments.
@@ -550,23 +663,26 @@ class Zink(EnsembleMethod):
                                 process = process, statistics = statistics,
                                 Nskip = Nskip, Nlearning = Nlearning,
                                 option = option, extended = extended,
-                                verbose = verbose, U = U)
+                                verbose = verbose, U = U, Nprocess = Nprocess)
 
 
     def Init(self):
+        import inspect
         self.initial_weight = ones((self.Nsim), 'd') / float(self.Nsim)
         if not(self.projection_function == projection_simplex) \
                and self.extended:
             raise Exception(\
                   "'extended' option only allowed with projection_simplex.")
+        # The projection takes the vector only (simplex), or also a radius.
+        self.Nprojection_argument \
+            = len(inspect.signature(self.projection_function).parameters)
 
 
     def UpdateWeight(self, s, o):
-        import inspect
         previous_weight = self.GetPreviousWeight()
         loss = 2. * sum((dot(previous_weight, s) - o) * s, 1)
 
-        if len(inspect.getargspec(self.projection_function)[0]) == 1:
+        if self.Nprojection_argument == 1:
             weight = self.projection_function(previous_weight
                                               - self.learning_rate * loss)
         else:
@@ -582,6 +698,36 @@ class Zink(EnsembleMethod):
 ####################
 
 
+def inverse_update(Ainv, X, A = None, sign = 1.):
+    """
+    Computes the inverse of A + sign X X^T from the inverse of A, with the
+    Woodbury formula. The cost is O(N^2 k) for a matrix A of size N x N and k
+    columns in X. If k >= N and the updated matrix is provided, the inverse is
+    computed from the Cholesky factorization of the updated matrix instead.
+
+    @type Ainv: 2D array
+    @param Ainv: The inverse of the symmetric positive definite matrix A.
+    @type X: 2D array
+    @param X: The update (N x k).
+    @type A: 2D array
+    @param A: The updated matrix A + sign X X^T, or None.
+    @type sign: float
+    @param sign: 1. for an update, -1. for a downdate.
+
+    @rtype: 2D array
+    @return: The inverse of A + sign X X^T.
+    """
+    N, k = X.shape
+    if k == 0:
+        return Ainv
+    if A is not None and k >= N:
+        return scipy.linalg.cho_solve(scipy.linalg.cho_factor(A),
+                                      identity(N))
+    AX = dot(Ainv, X)
+    C = sign * identity(k) + dot(X.T, AX)
+    return Ainv - dot(AX, scipy.linalg.solve(C, AX.T, assume_a = "sym"))
+
+
 class RidgeRegression(EnsembleMethod):
     """
     This class implements a modified ridge-regression algorithm
@@ -591,7 +737,8 @@ class RidgeRegression(EnsembleMethod):
 
     def __init__(self, ens, configuration_file = None, process = True,
                  statistics = True, Nskip = 1, Nlearning = 1,
-                 penalization = 1., option = "step", verbose = False):
+                 penalization = 1., option = "step", verbose = False,
+                 Nprocess = 1):
         """
         See documentation of 'EnsembleMethod.__init__' for explanations about
         arguments.
@@ -604,44 +751,40 @@ class RidgeRegression(EnsembleMethod):
                                 configuration_file = configuration_file,
                                 process = process, statistics = statistics,
                                 Nskip = Nskip, Nlearning = Nlearning,
-                                option = option, verbose = verbose)
+                                option = option, verbose = verbose,
+                                Nprocess = Nprocess)
 
 
     def Init(self):
         self.initial_weight = zeros(self.Nsim)
         self.A = self.InitialList(self.penalization * identity(self.Nsim))
+        # Inverses of 'A'.
+        self.Ainv = self.InitialList(identity(self.Nsim)
+                                     / self.penalization)
 
 
     def GetTools(self):
-        if self.ens.config.concentrations == "peak":
-            return self.A[0]
-        elif self.ens.config.concentrations == "hourly":
-            hour = self.ens.all_dates[self.step].hour
-            return self.A[hour]
+        slot = self.GetSlot()
+        return self.A[slot], self.Ainv[slot]
 
 
-    def UpdateTools(self, A):
-        if self.ens.config.concentrations == "peak":
-            self.A[0] = A
-        elif self.ens.config.concentrations == "hourly":
-            hour = self.ens.all_dates[self.step].hour
-            self.A[hour] = A
+    def UpdateTools(self, A, Ainv):
+        slot = self.GetSlot()
+        self.A[slot] = A
+        self.Ainv[slot] = Ainv
 
 
     def UpdateWeight(self, s, o):
         previous_weight = self.GetPreviousWeight()
-        A = self.GetTools()
-
-        Nobs = len(o)
-        bt = zeros(self.Nsim)
-        for i in range(Nobs):
-            x_it = s[:, i]
-            A += outer(x_it, x_it)
-            bt += (inner(x_it, previous_weight) - o[i]) * x_it
+        A, Ainv = self.GetTools()
+
+        A += dot(s, s.T)
+        Ainv = inverse_update(Ainv, s, A)
+        bt = dot(s, dot(previous_weight, s) - o)
         # Warning: A grows quickly (but linearly).
-        weight = previous_weight - dot(scipy.linalg.pinv2(A), bt)
+        weight = previous_weight - dot(Ainv, bt)
 
-        self.UpdateTools(A)
+        self.UpdateTools(A, Ainv)
         self.AcquireWeight(weight)
 
 
@@ -659,7 +802,8 @@ class RidgeRegressionModified(RidgeRegression):
 
     def __init__(self, ens, configuration_file = None, process = True,
                  statistics = True, Nskip = 0, Nlearning = 0,
-                 penalization = 1.e6, option = "step", verbose = False):
+                 penalization = 1.e6, option = "step", verbose = False,
+                 Nprocess = 1):
         """
         See documentation of 'EnsembleMethod.__init__' for explanations about
         arguments.
@@ -672,47 +816,41 @@ class RidgeRegressionModified(RidgeRegression):
                                  process = process, statistics = statistics,
                                  Nskip = Nskip, Nlearning = Nlearning,
                                  option = option, penalization = penalization,
-                                 verbose = verbose)
+                                 verbose = verbose, Nprocess = Nprocess)
 
 
     def Init(self):
         self.initial_weight = zeros(self.Nsim, 'd')
         self.A = self.InitialList(self.penalization * identity(self.Nsim))
         self.b = self.InitialList(zeros(self.Nsim, 'd'))
+        # Inverses of 'A'.
+        self.Ainv = self.InitialList(identity(self.Nsim)
+                                     / self.penalization)
 
 
     def GetTools(self):
-        if self.ens.config.concentrations == "peak":
-            return self.A[0], self.b[0]
-        elif self.ens.config.concentrations == "hourly":
-            hour = self.ens.all_dates[self.step].hour
-            return self.A[hour], self.b[hour]
+        slot = self.GetSlot()
+        return self.A[slot], self.b[slot], self.Ainv[slot]
 
 
-    def UpdateTools(self, A, b):
-        if self.ens.config.concentrations == "peak":
-            self.A[0] = A
-            self.b[0] = b
-        elif self.ens.config.concentrations == "hourly":
-            hour = self.ens.all_dates[self.step].hour
-            self.A[hour] = A
-            self.b[hour] = b
+    def UpdateTools(self, A, b, Ainv):
+        slot = self.GetSlot()
+        self.A[slot] = A
+        self.b[slot] = b
+        self.Ainv[slot] = Ainv
 
 
     def UpdateWeight(self, s, o):
-        prev_weight = self.GetPreviousWeight()
-        A, b = self.GetTools()
+        A, b, Ainv = self.GetTools()
 
-        index = range(len(o))
-        tmp_mat = [outer(s[:, i], s[:, i]) for i in index]
-        A += reduce(add, tmp_mat)
+        A += dot(s, s.T)
+        Ainv = inverse_update(Ainv, s, A)
 
-        weight = dot(scipy.linalg.pinv2(A), b)
+        weight = dot(Ainv, b)
         # 'b' is updated after forecast.
-        b += reduce(add, map(multiply,
-                             [s[:,i] for i in index], o))
+        b += dot(s, o)
 
-        self.UpdateTools(A, b)
+        self.UpdateTools(A, b, Ainv)
         self.AcquireWeight(weight)
 
 
@@ -731,7 +869,7 @@ class RidgeRegressionDiscounted(RidgeRegressionModified):
     def __init__(self, ens, configuration_file = None, process = True,
                  statistics = True, Nskip = 1, Nlearning = 1,
                  option = "step", penalization = 1000.,
-                 forget_rate = 100., p1 = 2., verbose = False):
+                 forget_rate = 100., p1 = 2., verbose = False, Nprocess = 1):
         """
         See documentation of 'EnsembleMethod.__init__' for explanations about
         arguments.
@@ -750,7 +888,8 @@ class RidgeRegressionDiscounted(RidgeRegressionModified):
                                          process, statistics = statistics,
                                          Nskip = Nskip, Nlearning = Nlearning,
                                          penalization = penalization, option =
-                                         option, verbose = verbose)
+                                         option, verbose = verbose,
+                                         Nprocess = Nprocess)
 
 
     def Init(self):
@@ -759,22 +898,34 @@ class RidgeRegressionDiscounted(RidgeRegressionModified):
         self.b = self.InitialList([zeros(self.Nsim)])
 
 
+    def GetTools(self):
+        slot = self.GetSlot()
+        return self.A[slot], self.b[slot]
+
+
+    def UpdateTools(self, A, b):
+        slot = self.GetSlot()
+        self.A[slot] = A
+        self.b[slot] = b
+
+
     def UpdateWeight(self, s, o):
-        previous_weight = self.GetPreviousWeight()
         At, b = self.GetTools()
 
-        tmp_mat = [outer(s[:, i], s[:, i]) for i in range(len(o))]
-        tmp_b = reduce(add, map(multiply, o, [s[:,i] for i in range(len(o))]))
-        At.append(reduce(add, tmp_mat))
-        b.append(tmp_b)
+        At.append(dot(s, s.T))
+        b.append(dot(s, o))
 
+        # Since all past terms are discounted differently at every step, the
+        # matrix cannot be updated and is factorized at every step.
         T = len(At)
-        forget = [(self.forget_rate / ((T - i) ** self.p1) + 1.)
-                  for i in range(T)]
-        A = reduce(add, map(multiply, At, forget))
-        bt = reduce(add, map(multiply, b, forget))
+        forget = self.forget_rate / (T - arange(T)) ** self.p1 + 1.
+        A = tensordot(forget, At, 1)
+        bt = dot(forget, b)
         A += self.penalization * identity(self.Nsim)
-        weight = dot(scipy.linalg.pinv2(A), bt)
+        try:
+            weight = scipy.linalg.cho_solve(scipy.linalg.cho_factor(A), bt)
+        except scipy.linalg.LinAlgError:
+            weight = dot(scipy.linalg.pinv(A), bt)
 
         self.UpdateTools(At, b)
         self.AcquireWeight(weight)
@@ -795,7 +946,7 @@ class RidgeRegressionWindow(RidgeRegressionModified):
     def __init__(self, ens, configuration_file = None, process = True,
                  statistics = True, Nskip = 1, Nlearning = 1,
                  penalization = 100., Nkeep = 45, option = "step",
-                 verbose = False):
+                 verbose = False, Nprocess = 1):
         """
         See documentation of 'EnsembleMethod.__init__' for explanations about
         arguments.
@@ -809,49 +960,86 @@ class RidgeRegressionWindow(RidgeRegressionModified):
                                          process, statistics = statistics,
                                          Nskip = Nskip, Nlearning = Nlearning,
                                          option = option, verbose = verbose,
-                                         penalization = penalization)
+                                         penalization = penalization,
+                                         Nprocess = Nprocess)
 
 
     def Init(self):
         self.initial_weight = zeros(self.Nsim)
-        self.A = self.InitialList([])
-        self.b = self.InitialList([])
-
-
-    def Upkeep(self, A, At, b, bt):
-        if len(A) < self.Nkeep:
-            A.append(At.copy())
-            b.append(bt.copy())
-        elif len(A) == self.Nkeep:
-            A.append(At.copy())
-            b.append(bt.copy())
-            del A[0]
-            del b[0]
-        else:
-            raise Exception("Length of 'A' strictly greater than 'Nkeep'!")
-        return A, b
+        # Ring buffers of the last 'Nkeep' steps: simulated data, s s^T and
+        # s o. The data of step 'Nstep' is stored at 'Nstep % Nkeep'.
+        self.X = self.InitialList([None] * self.Nkeep)
+        self.A = self.InitialList(zeros((self.Nkeep, self.Nsim, self.Nsim),
+                                        'd'))
+        self.b = self.InitialList(zeros((self.Nkeep, self.Nsim), 'd'))
+        # Running sums over the window.
+        self.A_sum = self.InitialList(zeros((self.Nsim, self.Nsim), 'd'))
+        self.b_sum = self.InitialList(zeros(self.Nsim, 'd'))
+        # Inverses of the penalized sum of s s^T over the window.
+        self.Ainv = self.InitialList(identity(self.Nsim)
+                                     / self.penalization)
+        self.Nstep = self.InitialList(0)
+        # Number of updates since the last full computation of 'Ainv'.
+        self.Nupdate = self.InitialList(0)
+
+
+    def GetTools(self):
+        slot = self.GetSlot()
+        return self.X[slot], self.A[slot], self.b[slot], self.A_sum[slot], \
+               self.b_sum[slot], self.Ainv[slot], self.Nstep[slot], \
+               self.Nupdate[slot]
+
+
+    def UpdateTools(self, X, A, b, A_sum, b_sum, Ainv, Nstep, Nupdate):
+        slot = self.GetSlot()
+        self.X[slot] = X
+        self.A[slot] = A
+        self.b[slot] = b
+        self.A_sum[slot] = A_sum
+        self.b_sum[slot] = b_sum
+        self.Ainv[slot] = Ainv
+        self.Nstep[slot] = Nstep
+        self.Nupdate[slot] = Nupdate
 
 
     def UpdateWeight(self, s, o):
-        period = self.GetLearningDates()
-        s, o = self.CollectData(period)
-        A, b = self.GetTools()
-
-        Nobs = len(o)
-        At = zeros([self.Nsim, self.Nsim], 'd')
-        bt = zeros(self.Nsim, 'd')
-        for i in range(Nobs):
-            x_it = s[:, i]
-            At += outer(x_it, x_it)
-            bt += o[i] * x_it
-
-        A, b = self.Upkeep(A, At, b, bt)
-        Atmp = reduce(add, A)
-        btmp = reduce(add, b)
-        Atmp += self.penalization * identity(self.Nsim)
-        weight = dot(scipy.linalg.pinv2(Atmp), btmp)
-
-        self.UpdateTools(A, b)
+        X, A, b, A_sum, b_sum, Ainv, Nstep, Nupdate = self.GetTools()
+
+        # Replaces the oldest step of the window.
+        i = Nstep % self.Nkeep
+        if Nstep >= self.Nkeep:
+            removed = X[i]
+            A_sum -= A[i]
+            b_sum -= b[i]
+        else:
+            removed = zeros((self.Nsim, 0), 'd')
+        X[i] = s
+        A[i] = dot(s, s.T)
+        b[i] = dot(s, o)
+        A_sum += A[i]
+        b_sum += b[i]
+        Nstep += 1
+
+        # The penalization is applied to the sum over the window only. It is
+        # never added to the matrices stored in the window.
+        Nupdate += 1
+        if Nupdate >= self.Nkeep:
+            # The sums are recomputed to avoid the accumulation of round-off
+            # errors due to the subtractions.
+            A_sum = A.sum(0)
+            b_sum = b.sum(0)
+        if Nupdate >= self.Nkeep \
+               or s.shape[1] + removed.shape[1] >= self.Nsim:
+            Ainv = scipy.linalg.cho_solve(scipy.linalg.cho_factor(
+                A_sum + self.penalization * identity(self.Nsim)),
+                                          identity(self.Nsim))
+            Nupdate = 0
+        else:
+            Ainv = inverse_update(Ainv, s)
+            Ainv = inverse_update(Ainv, removed, sign = -1.)
+        weight = dot(Ainv, b_sum)
+
+        self.UpdateTools(X, A, b, A_sum, b_sum, Ainv, Nstep, Nupdate)
         self.AcquireWeight(weight)
 
 
@@ -860,36 +1048,93 @@ class RidgeRegressionWindow(RidgeRegressionModified):
 ###########
 
 
-def uniform_simplex(N):
+def uniform_simplex(N, Npoint = None):
     """
     Simulation of a uniform probability on the simplex.
 
     @type N: integer
     @param N: The number of dimensions.
-    @rtype: 1D array
-    @return: An element of the simplex, randomly generated.
+    @type Npoint: integer or None
+    @param Npoint: The number of elements to be generated, or None for a
+    single element.
+    @rtype: 1D array or 2D array
+    @return: An element of the simplex, randomly generated, or 'Npoint'
+    elements (one per row).
     """
-    P = []
-    list = [0., 1.]
-    for i in range(N - 1):
-        list.append(random.uniform(0, 1))
-    list = sort(list)
-    for i in range(N):
-        P.append(list[i+1] - list[i])
-    return array(P)
+    if Npoint is None:
+        return uniform_simplex(N, 1)[0]
+    P = zeros((Npoint, N + 1), 'd')
+    P[:, 1:N] = sort(random.uniform(0, 1, (Npoint, N - 1)), 1)
+    P[:, N] = 1.
+    return diff(P, axis = 1)
+
+
+def halton(Npoint, Ndim, start = 1):
+    """
+    Generates points of the Halton low-discrepancy sequence in the unit
+    hypercube. Coordinate d is the radical inverse of the point index in the
+    base given by the d-th prime number.
+
+    @type Npoint: integer
+    @param Npoint: The number of points.
+    @type Ndim: integer
+    @param Ndim: The number of dimensions.
+    @type start: integer
+    @param start: The index of the first point. The point of index 0 is the
+    origin.
+    @rtype: 2D array
+    @return: The points (one per row), in ]0, 1[ if 'start' > 0.
+    """
+    prime = []
+    p = 2
+    while len(prime) < Ndim:
+        if all([p % q != 0 for q in prime]):
+            prime.append(p)
+        p += 1
+    P = zeros((Npoint, Ndim), 'd')
+    for d in range(Ndim):
+        index = arange(start, start + Npoint)
+        scale = 1. / prime[d]
+        while (index > 0).any():
+            P[:, d] += (index % prime[d]) * scale
+            index //= prime[d]
+            scale /= prime[d]
+    return P
+
+
+def halton_simplex(N, Npoint, start = 1):
+    """
+    Generates points on the simplex from the Halton sequence. The points of
+    the unit hypercube are mapped to the simplex by normalizing their
+    exponential spacings -log(u), which turns a uniform distribution on the
+    hypercube into a uniform distribution on the simplex.
+
+    @type N: integer
+    @param N: The number of dimensions.
+    @type Npoint: integer
+    @param Npoint: The number of points.
+    @type start: integer
+    @param start: The index of the first point in the Halton sequence.
+    @rtype: 2D array
+    @return: The points of the simplex (one per row).
+    """
+    P = - log(halton(Npoint, N, start))
+    return P / P.sum(1)[:, newaxis]
 
 
 class Mixture(EnsembleMethod):
     """
     This class implements the exponentially weighted average mixture algorithm
-    (Cesa-Bianchi & Lugosi, 2006, p. 48).
+    (Cesa-Bianchi & Lugosi, 2006, p. 48). The confidence in the quadrature
+    points is updated in the logarithmic domain.
     """
 
 
     def __init__(self, ens, configuration_file = None, process = True,
                  statistics = True, extended = False, U = 1., Nskip = 1,
                  Nlearning = 1, learning_rate = 1.e-4, Napprox = 5000,
-                 option = "step", verbose = False):
+                 sampling = "uniform", option = "step", dtype = 'd',
+                 verbose = False, Nprocess = 1):
         """
         See documentation of 'EnsembleMethod.__init__' for explanations about
         arguments.
@@ -899,58 +1144,61 @@ class Mixture(EnsembleMethod):
         @type Napprox: integer
         @param Napprox: Number of points to approximate the integral over the
         simplex with a trivial quadrature formula.
+        @type sampling: string
+        @param sampling: The generation of the quadrature points: "uniform"
+        for random points, or "halton" for the low-discrepancy Halton
+        sequence, which usually requires fewer points for the same accuracy.
+        @type dtype: string
+        @param dtype: The type in which the quadrature points and the
+        log-confidence are stored ('d', or 'f' to save memory).
         """
         self.Napprox = Napprox
+        self.sampling = sampling
         self.learning_rate = learning_rate
+        self.dtype = dtype
         EnsembleMethod.__init__(self, ens,
                                 configuration_file = configuration_file,
                                 process = process, statistics = statistics,
                                 Nskip = Nskip, Nlearning = Nlearning,
                                 option = option, extended = extended,
-                                verbose = verbose, U = U)
+                                verbose = verbose, U = U, Nprocess = Nprocess)
 
 
     def Init(self):
         self.initial_weight = ones(self.Nsim, 'd') / float(self.Nsim)
-        self.confidence = self.InitialList(ones(self.Napprox, 'd')
-                                           / float(self.Napprox))
-        if self.extended:
-            self.interpolweights = zeros([2 * self.Nsim, self.Napprox])
-            # Keeps the points of quadrature in the simplex.
-            for i in range(self.Napprox):
-                self.interpolweights[:, i] = uniform_simplex(2 * self.Nsim)
+        self.confidence = self.InitialList(zeros(self.Napprox, self.dtype)
+                                           - log(self.Napprox))
+        N = len(self.GetInitialWeight())
+        # Keeps the points of quadrature in the simplex (one per column).
+        if self.sampling == "uniform":
+            points = uniform_simplex(N, self.Napprox)
+        elif self.sampling == "halton":
+            points = halton_simplex(N, self.Napprox)
         else:
-            self.interpolweights = zeros([self.Nsim, self.Napprox])
-            # Keeps the points of quadrature in the simplex.
-            for i in range(self.Napprox):
-                self.interpolweights[:, i] = uniform_simplex(self.Nsim)
+            raise Exception("Unknown sampling \"" + self.sampling + "\".")
+        self.interpolweights = points.T.astype(self.dtype)
 
 
     def GetTools(self):
-        if self.ens.config.concentrations == "peak":
-            return self.confidence[0]
-        elif self.ens.config.concentrations == "hourly":
-            hour = self.ens.all_dates[self.step].hour
-            return self.confidence[hour]
+        return self.confidence[self.GetSlot()]
 
 
     def UpdateTools(self, confidence):
-        if self.ens.config.concentrations == "peak":
-            self.confidence[0] = confidence
-        elif self.ens.config.concentrations == "hourly":
-            hour = self.ens.all_dates[self.step].hour
-            self.confidence[hour] = confidence
+        confidence = confidence.astype(self.dtype)
+        self.confidence[self.GetSlot()] = confidence
 
 
     def UpdateWeight(self, s, o):
+        # Logarithm of the confidence.
         confidence = self.GetTools()
 
-        for i in range(self.Napprox):
-            loss = exp(-self.learning_rate
-                       * sum((dot(self.interpolweights[:, i], s) - o) ** 2))
-            confidence[i] *= loss
-        confidence /= confidence.sum()
-        weight = sum(confidence * self.interpolweights, 1)
+        # The square errors of all quadrature points w are computed at once,
+        # as w^T s s^T w - 2 w^T s o + o^T o.
+        X = self.interpolweights
+        loss = (dot(dot(s, s.T), X) * X).sum(0) - 2. * dot(dot(s, o), X) \
+               + dot(o, o)
+        confidence = log_normalize(confidence - self.learning_rate * loss)
+        weight = dot(X, exp(confidence))
 
         self.UpdateTools(confidence)
         self.AcquireWeight(weight)
@@ -970,7 +1218,7 @@ class Polynomial(EnsembleMethod):
 
     def __init__(self, ens, configuration_file = None, process = True,
                  statistics = True, Nskip = 1, Nlearning = 1, power = 2.,
-                 option = "step", verbose = False):
+                 option = "step", verbose = False, Nprocess = 1):
         """
         See documentation of 'EnsembleMethod.__init__' for explanations about
         arguments.
@@ -984,7 +1232,7 @@ class Polynomial(EnsembleMethod):
                                 configuration_file, process = process,
                                 statistics = statistics, Nskip = Nskip,
                                 Nlearning = Nlearning, option = option,
-                                verbose = verbose)
+                                verbose = verbose, Nprocess = Nprocess)
 
 
     def Init(self):
@@ -993,19 +1241,11 @@ class Polynomial(EnsembleMethod):
 
 
     def GetTools(self):
-        if self.ens.config.concentrations == "peak":
-            return self.regret[0]
-        elif self.ens.config.concentrations == "hourly":
-            hour = self.ens.all_dates[self.step].hour
-            return self.regret[hour]
+        return self.regret[self.GetSlot()]
 
 
     def UpdateTools(self, regret):
-        if self.ens.config.concentrations == "peak":
-            self.regret[0] = regret
-        elif self.ens.config.concentrations == "hourly":
-            hour = self.ens.all_dates[self.step].hour
-            self.regret[hour] = regret
+        self.regret[self.GetSlot()] = regret
 
 
     def UpdateWeight(self, s, o):
@@ -1040,7 +1280,7 @@ class PolynomialGradient(Polynomial):
     def __init__(self, ens, configuration_file = None, process = True,
                  statistics = True, extended = False, U = 1., Nskip = 1,
                  Nlearning = 1, power = 14., option = "step",
-                 verbose = False):
+                 verbose = False, Nprocess = 1):
         """
         See documentation of 'EnsembleMethod.__init__' for explanations about
         arguments.
@@ -1055,7 +1295,7 @@ class PolynomialGradient(Polynomial):
                                 statistics = statistics, Nskip = Nskip,
                                 Nlearning = Nlearning, option = option,
                                 extended = extended,
-                                verbose = verbose, U = U)
+                                verbose = verbose, U = U, Nprocess = Nprocess)
 
 
     def Init(self):
@@ -1091,14 +1331,15 @@ class PolynomialGradient(Polynomial):
 class FixedShare(EnsembleMethod):
     """
     This class implements the fixed-share algorithm
-    (Cesa-Bianchi & Lugosi, 2006, Section 5.2).
+    (Cesa-Bianchi & Lugosi, 2006, Section 5.2). The confidence is updated in
+    the logarithmic domain.
     """
 
 
     def __init__(self, ens, configuration_file = None, process = True,
                  statistics = True, Nskip = 1, Nlearning = 1,
                  learning_rate = 1.5e-5, shift = 5.e-2,
-                 option = "step", verbose = False):
+                 option = "step", dtype = 'd', verbose = False, Nprocess = 1):
         """
         See documentation of 'EnsembleMethod.__init__' for explanations about
         arguments.
@@ -1107,46 +1348,64 @@ class FixedShare(EnsembleMethod):
         @param learning_rate: Learning rate.
         @type shift: float
         @param shift: Probability to change the leading method.
+        @type dtype: string
+        @param dtype: The type in which the log-confidence is stored ('d', or
+        'f' to save memory).
         """
         self.learning_rate = learning_rate
         self.shift = shift
+        self.dtype = dtype
         EnsembleMethod.__init__(self, ens,
                                 configuration_file = configuration_file,
                                 process = process, statistics = statistics,
                                 Nskip = Nskip, Nlearning = Nlearning,
-                                option = option, verbose = verbose)
+                                option = option, verbose = verbose,
+                                Nprocess = Nprocess)
 
 
     def Init(self):
         self.initial_weight = ones(self.Nsim,'d') / float(self.Nsim)
-        self.confidence = self.InitialList(ones(self.Nsim, 'd')
-                                           / float(self.Nsim))
+        self.confidence = self.InitialList(zeros(self.Nsim, self.dtype)
+                                           - log(self.Nsim))
 
 
     def GetTools(self):
-        if self.ens.config.concentrations == "peak":
-            return self.confidence[0]
-        elif self.ens.config.concentrations == "hourly":
-            hour = self.ens.all_dates[self.step].hour
-            return self.confidence[hour]
+        return self.confidence[self.GetSlot()]
 
 
     def UpdateTools(self, confidence):
-        if self.ens.config.concentrations == "peak":
-            self.confidence[0] = confidence
-        elif self.ens.config.concentrations == "hourly":
-            hour = self.ens.all_dates[self.step].hour
-            self.confidence[hour] = confidence
+        confidence = confidence.astype(self.dtype)
+        self.confidence[self.GetSlot()] = confidence
+
+
+    def Share(self, confidence, loss):
+        """
+        Updates the confidence with the latest loss, and shares it among the
+        models. The updated confidence is scaled so that it sums to one before
+        the sharing, which can neither overflow nor underflow.
+
+        @type confidence: 1D array
+        @param confidence: The logarithm of the confidence.
+        @type loss: 1D array
+        @param loss: The latest loss.
+
+        @rtype: (1D array, 1D array)
+        @return: The logarithm of the updated (normalized) confidence, and
+        the weights.
+        """
+        weight_tmp = exp_normalize(confidence - self.learning_rate * loss)
+        confidence = self.shift * sum(weight_tmp) / float(self.Nsim) \
+                     + (1. - self.shift) * weight_tmp
+        weight = confidence / confidence.sum()
+        with errstate(divide = "ignore"):
+            return log(weight), weight
 
 
     def UpdateWeight(self, s, o):
         confidence = self.GetTools()
 
         loss = sum((s - o) ** 2, 1)
-        weight_tmp = confidence * exp(-self.learning_rate * loss)
-        confidence = self.shift * sum(weight_tmp) / float(self.Nsim) \
-                     + (1. - self.shift) * weight_tmp
-        weight = confidence / confidence.sum()
+        confidence, weight = self.Share(confidence, loss)
 
         self.UpdateTools(confidence)
         self.AcquireWeight(weight)
@@ -1167,7 +1426,7 @@ class FixedShareGradient(FixedShare):
     def __init__(self, ens, configuration_file = None, process = True,
                  statistics = True, extended = False, U = 1., Nskip = 1,
                  Nlearning = 1, learning_rate = 2.5e-5, shift = 2.e-2,
-                 option = "step", verbose = False):
+                 option = "step", dtype = 'd', verbose = False, Nprocess = 1):
         """
         See documentation of 'EnsembleMethod.__init__' for explanations about
         arguments.
@@ -1176,15 +1435,19 @@ class FixedShareGradient(FixedShare):
         @param learning_rate: Learning rate.
         @type shift: float
         @param shift: Probability to change the leading method.
+        @type dtype: string
+        @param dtype: The type in which the log-confidence is stored ('d', or
+        'f' to save memory).
         """
         self.learning_rate = learning_rate
         self.shift = shift
+        self.dtype = dtype
         EnsembleMethod.__init__(self, ens,
                                 configuration_file = configuration_file,
                                 process = process, statistics = statistics,
                                 Nskip = Nskip, Nlearning = Nlearning,
                                 option = option, extended = extended,
-                                U = U, verbose = verbose)
+                                U = U, verbose = verbose, Nprocess = Nprocess)
 
 
     def Init(self):
@@ -1192,11 +1455,12 @@ class FixedShareGradient(FixedShare):
         # Advice: modify the initial confidence to an a priori
         # measure (p. 102).
         if self.extended:
-            self.confidence = self.InitialList(ones(2 * self.Nsim, 'd')
-                                               / float(2 * self.Nsim))
+            self.confidence = self.InitialList(zeros(2 * self.Nsim,
+                                                     self.dtype)
+                                               - log(2 * self.Nsim))
         else:
-            self.confidence = self.InitialList(ones(self.Nsim, 'd')
-                                               / float(self.Nsim))
+            self.confidence = self.InitialList(zeros(self.Nsim, self.dtype)
+                                               - log(self.Nsim))
 
 
     def UpdateWeight(self, s, o):
@@ -1204,10 +1468,7 @@ class FixedShareGradient(FixedShare):
         confidence = self.GetTools()
 
         loss = 2. * sum((dot(previous_weight, s) - o) * s, 1)
-        weight_tmp = confidence * exp(-self.learning_rate * loss)
-        confidence = self.shift * sum(weight_tmp) / float(self.Nsim) \
-                     + (1. - self.shift) * weight_tmp
-        weight = confidence / confidence.sum()
+        confidence, weight = self.Share(confidence, loss)
 
         self.UpdateTools(confidence)
         self.AcquireWeight(weight)
@@ -1228,7 +1489,7 @@ class VariableShareGradient(FixedShareGradient):
     def __init__(self, ens, configuration_file = None, process = True,
                  statistics = True, extended = False, U = 1., Nskip = 1,
                  Nlearning = 1, learning_rate = 1., shift = 5.e-2,
-                 option = "step", verbose = False):
+                 option = "step", dtype = 'd', verbose = False, Nprocess = 1):
         """
         See documentation of 'EnsembleMethod.__init__' for explanations about
         arguments.
@@ -1237,6 +1498,9 @@ class VariableShareGradient(FixedShareGradient):
         @param learning_rate: Learning rate.
         @type shift: float
         @param shift: Probability to change the leading method.
+        @type dtype: string
+        @param dtype: The type in which the log-confidence is stored ('d', or
+        'f' to save memory).
         """
         FixedShareGradient.__init__(self, ens,
                                     configuration_file = configuration_file,
@@ -1247,7 +1511,38 @@ class VariableShareGradient(FixedShareGradient):
                                     extended = extended,
                                     learning_rate = learning_rate,
                                     shift = shift, option = option, U = U,
-                                    verbose = verbose)
+                                    dtype = dtype, verbose = verbose,
+                                    Nprocess = Nprocess)
+
+
+    def Share(self, confidence, loss):
+        """
+        Updates the confidence with the latest loss, and shares it among the
+        models according to their losses. The updated confidence is scaled so
+        that it sums to one before the sharing, which can neither overflow nor
+        underflow.
+
+        @type confidence: 1D array
+        @param confidence: The logarithm of the confidence.
+        @type loss: 1D array
+        @param loss: The latest loss.
+
+        @rtype: (1D array, 1D array)
+        @return: The logarithm of the updated (normalized) confidence, and
+        the weights.
+        """
+        # N : number of models, even in extended mode.
+        N = len(loss)
+        weight_tmp = exp_normalize(confidence - self.learning_rate * loss)
+        # Sharing matrix: (1 - shift) ** loss[j] on the diagonal, and
+        # (1 - (1 - shift) ** loss[j]) / (N - 1) elsewhere in column j.
+        kept = (1. - self.shift) ** loss
+        shared = (1. - kept) * weight_tmp
+        confidence = kept * weight_tmp + (shared.sum() - shared) / float(N - 1)
+        weight = maximum(confidence, 0.)
+        weight /= weight.sum()
+        with errstate(divide = "ignore"):
+            return log(weight), weight
 
 
     def UpdateWeight(self, s, o):
@@ -1256,19 +1551,7 @@ class VariableShareGradient(FixedShareGradient):
 
         # Loss normalized by L.
         loss = 2. * sum((dot(previous_weight, s) - o) * s, 1) / 1.e6
-        # N : number of models, even in extended mode.
-        N = s.shape[0]
-        weight_tmp = confidence * exp(-self.learning_rate * loss)
-        A = zeros([N, N] , 'd')
-        for j in range(N):
-            for i in range(N):
-                if i == j:
-                    A[i, j] = (1. - self.shift) ** loss[j]
-                else:
-                    A[i, j] = (1. - (1. - self.shift) ** loss[j]) \
-                              / float(N - 1)
-        confidence = dot(A, weight_tmp)
-        weight = confidence / confidence.sum()
+        confidence, weight = self.Share(confidence, loss)
 
         self.UpdateTools(confidence)
         self.AcquireWeight(weight)
@@ -1279,6 +1562,67 @@ class VariableShareGradient(FixedShareGradient):
 ######################
 
 
+def projection_simplex_A(A, y, x = None, precision = 1.e-10,
+                         Niteration_max = 1000):
+    """
+    Projection on the simplex under the distance defined by A: it minimizes
+    (x - y)^T A (x - y) over the simplex of probability distributions, with
+    an accelerated projected gradient method (FISTA). The momentum is
+    restarted whenever the objective increases.
+
+    @type A: 2D array
+    @param A: A symmetric positive semi-definite matrix.
+    @type y: 1D array
+    @param y: The vector to be projected.
+    @type x: 1D array
+    @param x: The starting point (warm start), or None to start from the
+    Euclidean projection of 'y'.
+    @type precision: float
+    @param precision: The iterations stop when the norm of the gradient
+    mapping, x - P(x - A (x - y) / L) where P is the projection onto the
+    simplex and L the step constant, is less than 'precision'. It vanishes
+    only at the solution.
+    @type Niteration_max: integer
+    @param Niteration_max: The maximum number of iterations.
+
+    @rtype: (1D array, integer)
+    @return: The projection and the number of iterations.
+    """
+    y = asarray(y, 'd')
+    # Upper bound of the Lipschitz constant of the gradient.
+    L = sqrt((A * A).sum())
+    if x is None or L == 0.:
+        x = projection_simplex(y.copy())
+    if L == 0.:
+        return x, 0
+    x = asarray(x, 'd')
+    gradient = dot(A, x - y)
+    objective = dot(x - y, gradient)
+    z = x
+    t = 1.
+    for i in range(Niteration_max):
+        # Two successive iterates may be equal (e.g., at a vertex) far from
+        # the solution, so the criterion relies on the gradient mapping.
+        residual = x - projection_simplex(x - gradient / L)
+        if sqrt(dot(residual, residual)) <= precision:
+            return x, i
+        x_new = projection_simplex(z - dot(A, z - y) / L)
+        gradient_new = dot(A, x_new - y)
+        objective_new = dot(x_new - y, gradient_new)
+        if objective_new > objective and t > 1.:
+            # The momentum is restarted: the next step is a plain projected
+            # gradient step from 'x', which decreases the objective (up to
+            # round-off errors, hence it is always accepted).
+            z = x
+            t = 1.
+            continue
+        t_new = (1. + sqrt(1. + 4. * t * t)) / 2.
+        z = x_new + (t - 1.) / t_new * (x_new - x)
+        x, t = x_new, t_new
+        gradient, objective = gradient_new, objective_new
+    return x, Niteration_max
+
+
 def projASimplex(A, y):
     """
     Projection on the simplex under A^-1 distance.
@@ -1288,23 +1632,17 @@ def projASimplex(A, y):
     @type y : array
     @param y: vector to project.
     """
-    s = array(zeros(len(y)),  'f')
-    x = array(y)
-    # Precision.
-    prec =  1.e-4
-    while (sum(s - x > prec) >  0) or (sum(x - s > prec) >  0):
-       x = s
-       grad = dot(A, s - y)
-       rho = sum(grad * grad) / dot(transpose(grad), dot(A, grad))
-       uu = s - rho * grad
-       s = projection_simplex(uu)
-    return s
+    return projection_simplex_A(A, y)[0]
 
 
 class OnlineNewtonStep(EnsembleMethod):
     """
     This class implements the ONS algorithm (see Hazan, Kalai, Kale, and
     Agarwal, 2006).
+
+    After 'Process', attribute 'projection_iterations' contains the number
+    of iterations of the projection at each step (of the last station, with
+    option 'station').
     """
 
 
@@ -1312,7 +1650,8 @@ class OnlineNewtonStep(EnsembleMethod):
                  process = True, verbose = False,
                  statistics = True, Nskip = 1, Nlearning = 1,
                  beta = 6.e-7, option = "step", mix = 0.2,
-                 extended = False, U = 1.):
+                 extended = False, U = 1., epsilon = 1.e-6,
+                 Niteration_max = 1000, Nprocess = 1):
         """
         See documentation of 'EnsembleMethod.__init__' for explanations about
         arguments.
@@ -1322,15 +1661,27 @@ class OnlineNewtonStep(EnsembleMethod):
         @type mix: float
         @param mix: A parameter in [0, 1] to mix the weight with the uniform
         probability.
+        @type epsilon: float
+        @param epsilon: The initial matrix is 'epsilon' times the identity.
+        If 'epsilon' is positive, the inverse matrix is updated at each step
+        in O(N^2). If 'epsilon' is zero, a pseudo-inverse is computed at each
+        step, in O(N^3). Since the vector to which the inverse is applied
+        lies in the range of the matrix, a small 'epsilon' gives the same
+        weights as the pseudo-inverse.
+        @type Niteration_max: integer
+        @param Niteration_max: The maximum number of iterations in the
+        projection onto the simplex.
         """
         self.beta = beta
         self.mix = mix
+        self.epsilon = epsilon
+        self.Niteration_max = Niteration_max
         EnsembleMethod.__init__(self, ens,
                                 configuration_file = configuration_file,
                                 process = process, statistics = statistics,
                                 Nskip = Nskip, Nlearning = Nlearning,
                                 option = option, verbose = verbose, extended =
-                                extended, U = U)
+                                extended, U = U, Nprocess = Nprocess)
 
 
     def Init(self):
@@ -1339,43 +1690,49 @@ class OnlineNewtonStep(EnsembleMethod):
             N = 2 * self.Nsim
         else:
             N = self.Nsim
-        self.A = self.InitialList(zeros([N, N], 'd'))
+        self.A = self.InitialList(self.epsilon * identity(N))
         self.b = self.InitialList(zeros(N, 'd'))
+        if self.epsilon > 0.:
+            self.Ainv = self.InitialList(identity(N) / self.epsilon)
+        else:
+            self.Ainv = self.InitialList(zeros([N, N], 'd'))
         self.uniform = ones(N, 'd') / float(N)
+        self.projection_iterations = []
 
 
     def GetTools(self):
-        if self.ens.config.concentrations == "peak":
-            return self.A[0], self.b[0]
-        elif self.ens.config.concentrations == "hourly":
-            hour = self.ens.all_dates[self.step].hour
-            return self.A[hour], self.b[hour]
+        slot = self.GetSlot()
+        return self.A[slot], self.b[slot], self.Ainv[slot]
 
 
-    def UpdateTools(self, At, bt):
-        if self.ens.config.concentrations == "peak":
-            self.A[0] = At
-            self.b[0] = bt
-        elif self.ens.config.concentrations == "hourly":
-            hour = self.ens.all_dates[self.step].hour
-            self.A[hour] = At
-            self.b[hour] = bt
+    def UpdateTools(self, At, bt, Ainv):
+        slot = self.GetSlot()
+        self.A[slot] = At
+        self.b[slot] = bt
+        self.Ainv[slot] = Ainv
 
 
     def UpdateWeight(self, s, o):
         previous_weight = self.GetPreviousWeight()
-        At, bt = self.GetTools()
+        At, bt, Ainv = self.GetTools()
 
         forecast = dot(previous_weight, s)
-        loss = 2. * sum((forecast - o) * s, 1)
+        loss = 2. * dot(s, forecast - o)
         At += outer(loss, loss)
-        bt += dot(outer(loss, loss), previous_weight) \
-                  - transpose(loss) / self.beta
-        weight = (1. - self.mix) \
-                 * projASimplex(At, dot(scipy.linalg.pinv2(At), bt)) \
-                 + self.mix * self.uniform
-
-        self.UpdateTools(At, bt)
+        bt += loss * dot(loss, previous_weight) - loss / self.beta
+        if self.epsilon > 0.:
+            Ainv = inverse_update(Ainv, loss[:, newaxis])
+        else:
+            Ainv = scipy.linalg.pinv(At)
+        projection, Niteration \
+                    = projection_simplex_A(At, dot(Ainv, bt),
+                                           previous_weight,
+                                           Niteration_max
+                                           = self.Niteration_max)
+        self.projection_iterations.append(Niteration)
+        weight = (1. - self.mix) * projection + self.mix * self.uniform
+
+        self.UpdateTools(At, bt, Ainv)
         self.AcquireWeight(weight)
 
 
@@ -1427,11 +1784,103 @@ def fixed_point2(Q, prec, w):
         MC = dot(M, wN)
         # Quick multiplication.
         R = dot(R, R)
-        S = max(abs(max(MC)), abs(min(MC)))
+        S = abs(MC).max()
         weight = wN
     return weight
 
 
+def fixed_point_power(Q, prec, w, Niteration_max = 100000):
+    """
+    Computes the stationary distribution of the Markov chain with transition
+    rates Q[i, j] from i to j (i != j), by power iteration. It solves M w = 0
+    where M = Q^T - diag(sum(Q, 1)). Every iteration costs O(N^2).
+
+    @type Q: square array
+    @param Q: The transition rates, with a null diagonal.
+    @type prec: float
+    @param prec: The iterations stop when all components of M w are below
+    'prec' (in absolute value).
+    @type w: array (vector)
+    @param w: The starting vector.
+    @type Niteration_max: integer
+    @param Niteration_max: The maximum number of iterations. An exception is
+    raised if the precision is not reached after 'Niteration_max'
+    iterations.
+
+    @rtype: array (vector)
+    @return: The stationary distribution.
+    """
+    out_rate = Q.sum(1)
+    rate = out_rate.max()
+    if not rate > 0.:
+        return w
+    weight = w / w.sum()
+    for i in range(Niteration_max):
+        MC = dot(weight, Q) - out_rate * weight
+        # The comparison also stops the iterations if 'MC' is not finite.
+        if not abs(MC).max() > prec:
+            break
+        # Lazy uniformization: w <- (I + M / (2 rate)) w. Every state keeps
+        # at least half of its weight, so that the chain is aperiodic and
+        # the iterations converge.
+        weight = weight + MC / (2. * rate)
+    else:
+        raise Exception("The stationary distribution was not found with "
+                        + "precision " + str(prec) + " after "
+                        + str(Niteration_max) + " iterations.")
+    return weight
+
+
+def fixed_point_solve(Q, prec, w):
+    """
+    Computes the stationary distribution of the Markov chain with transition
+    rates Q[i, j] from i to j (i != j), with a linear solve. It solves M w = 0
+    with sum(w) = 1, where M = Q^T - diag(sum(Q, 1)). If the system is
+    singular (the chain is reducible), 'fixed_point_power' is used.
+
+    @type Q: square array
+    @param Q: The transition rates, with a null diagonal.
+    @type prec: float
+    @param prec: The precision of 'fixed_point_power', if needed.
+    @type w: array (vector)
+    @param w: The starting vector for 'fixed_point_power'.
+
+    @rtype: array (vector)
+    @return: The stationary distribution.
+    """
+    N = Q.shape[0]
+    M = transpose(Q) - diag(Q.sum(1))
+    # One equation is redundant: it is replaced with the normalization.
+    M[-1] = 1.
+    rhs = zeros(N, 'd')
+    rhs[-1] = 1.
+    try:
+        weight = scipy.linalg.solve(M, rhs)
+    except (scipy.linalg.LinAlgError, ValueError):
+        return fixed_point_power(Q, prec, w)
+    if not isfinite(weight).all() or (weight < -prec).any():
+        return fixed_point_power(Q, prec, w)
+    return maximum(weight, 0.)
+
+
+def internal_loss(loss, weight):
+    """
+    Computes the losses of the weight vectors in which the weight of model i
+    is moved to model j, for all couples (i, j).
+
+    @type loss: 1D array
+    @param loss: The losses of the models.
+    @type weight: 1D array
+    @param weight: The weights of the models.
+
+    @rtype: 2D array
+    @return: The loss associated with each couple (i, j). The diagonal
+    contains the loss of 'weight'.
+    """
+    return dot(weight, loss) \
+           + weight[:, newaxis] * (loss[newaxis, :] - loss[:, newaxis])
+
+
 class InternalMethod(EnsembleMethod):
     """
     This class implements the template for internal computation of weights
@@ -1442,7 +1891,7 @@ class InternalMethod(EnsembleMethod):
     def __init__(self, ens, configuration_file = None, process = True,
                  statistics = True, extended = False, U = 1., Nskip = 1,
                  Nlearning = 1, option = "step", precision = 1.e-10, verbose =
-                 False, fixed_point_method = fixed_point2):
+                 False, fixed_point_method = fixed_point_solve, Nprocess = 1):
         """
         See documentation of 'EnsembleMethod.__init__' for explanations about
         arguments.
@@ -1454,7 +1903,7 @@ class InternalMethod(EnsembleMethod):
                                 process = process, statistics = statistics,
                                 Nskip = Nskip, Nlearning = Nlearning,
                                 option = option, extended = extended,
-                                U = U, verbose = verbose)
+                                U = U, verbose = verbose, Nprocess = Nprocess)
 
 
     def Init(self):
@@ -1469,19 +1918,11 @@ class InternalMethod(EnsembleMethod):
 
 
     def GetTools(self):
-        if self.ens.config.concentrations == "peak":
-            return self.Q[0]
-        elif self.ens.config.concentrations == "hourly":
-            hour = self.ens.all_dates[self.step].hour
-            return self.Q[hour]
+        return self.Q[self.GetSlot()]
 
 
     def UpdateTools(self, Q):
-        if self.ens.config.concentrations == "peak":
-            self.Q[0] = Q
-        elif self.ens.config.concentrations == "hourly":
-            hour = self.ens.all_dates[self.step].hour
-            self.Q[hour] = Q
+        self.Q[self.GetSlot()] = Q
 
 
     def compute_proba_on_couples(self, Q, loss, prev_weight):
@@ -1493,13 +1934,8 @@ class InternalMethod(EnsembleMethod):
         @type loss: array
         @type prev_weight: array
         """
-        N = Q.shape[0]
         # Probability on couples (i, j) with i != j.
-        for i in range(N):
-            for j in range(N):
-                p_ij = dot( i2j(N, i,j), prev_weight)
-                lossij = 2. * dot( p_ij, loss )
-                Q[i,j] = self.__core_calculus( Q[i,j], lossij)
+        Q[:] = self.__core_calculus(Q, 2. * internal_loss(loss, prev_weight))
         Q /= Q.sum()
         return Q
 
@@ -1546,7 +1982,7 @@ class InternalZink(InternalMethod):
                  Nlearning = 1, learning_rate = 1.e-6,
                  projection_function = projection_simplex, option = "step",
                  precision = 1.e-10, verbose = False, fixed_point_method =
-                 fixed_point2):
+                 fixed_point_solve, Nprocess = 1):
         """
         See documentation of 'EnsembleMethod.__init__' for explanations about
         arguments.
@@ -1565,7 +2001,8 @@ class InternalZink(InternalMethod):
                                 option = option, extended = extended,
                                 U = U, precision = precision,
                                 verbose = verbose,
-                                fixed_point_method = fixed_point_method)
+                                fixed_point_method = fixed_point_method,
+                                Nprocess = Nprocess)
 
 
     def mat2vec(self, matrix):
@@ -1576,11 +2013,7 @@ class InternalZink(InternalMethod):
         @rtype: 1D array
         """
         N = matrix.shape[0]
-        out = matrix.reshape((N * N,))
-        out = list(out)
-        for i in range(N - 1 , -1, -1):
-            del out[i * (N + 1)]
-        return array(out)
+        return matrix[~identity(N, 'bool')]
 
 
     def vec2mat(self, vec, N):
@@ -1592,24 +2025,14 @@ class InternalZink(InternalMethod):
         @type N: int
         @rtype: 2D array
         """
-        out = list(vec)
-        for i in range(N):
-            out.insert(i * (N + 1), 0.)
-        out = array(out)
-        out = out.reshape((N,N))
+        out = zeros((N, N), 'd')
+        out[~identity(N, 'bool')] = vec
         return out
 
 
     def compute_proba_on_couples(self, Q, loss, prev_weight):
         N = Q.shape[0]
-        internal_loss = zeros([N, N], 'd')
-        for i in range(N):
-            for j in range(N):
-                p_ij = dot(i2j(N, i,j), prev_weight)
-                lossij = dot(p_ij, loss)
-                internal_loss[i, j] = lossij
-
-        Q -= self.learning_rate * internal_loss
+        Q -= self.learning_rate * internal_loss(loss, prev_weight)
         V = self.mat2vec(Q)
         proj_V = self.projection_function(V)
         Q = self.vec2mat(proj_V, N)
@@ -1632,7 +2055,8 @@ class InternalPolynomialGradient(InternalMethod):
     def __init__(self, ens, configuration_file = None, process = True,
                  statistics = True, extended = False, U = 1., Nskip = 1,
                  Nlearning = 1, power = 2., option = "step", precision =
-                 1.e-10, verbose = False, fixed_point_method = fixed_point2):
+                 1.e-10, verbose = False,
+                 fixed_point_method = fixed_point_solve, Nprocess = 1):
 
         """
         See documentation of 'EnsembleMethod.__init__' for explanations about
@@ -1646,7 +2070,8 @@ class InternalPolynomialGradient(InternalMethod):
                                 option = option, extended = extended,
                                 U = U, precision = precision,
                                 verbose = verbose,
-                                fixed_point_method = fixed_point_method)
+                                fixed_point_method = fixed_point_method,
+                                Nprocess = Nprocess)
 
 
     def compute_proba_on_couples(self, Q, gradloss, prev_weight):
@@ -1659,12 +2084,9 @@ class InternalPolynomialGradient(InternalMethod):
 
         @rtype: array, array
         """
-        N = Q.shape[0]
         # regret on couples (i<>j)
-        for i in range(N):
-            for j in range(N):
-                p_ij = prev_weight[i] * (gradloss[i] - gradloss[j])
-                Q[i,j] += p_ij
+        Q += prev_weight[:, newaxis] \
+             * (gradloss[:, newaxis] - gradloss[newaxis, :])
         M = ((Q + abs(Q)) / 2) ** (self.power - 1)
         M /= M.sum()
         return M, Q
@@ -1699,8 +2121,8 @@ class InternalExponentiatedGradientDiscounted(InternalMethod):
                  statistics = True, extended = False, U = 1., Nskip = 1,
                  Nlearning = 1, learning_rate = 1.2e-4, forget_rate = 1.,
                  p1 = 0.5, p2 = 1., option = "step", precision = 1.e-10,
-                 fixed_point_method = fixed_point2,
-                 verbose = False):
+                 fixed_point_method = fixed_point_solve,
+                 verbose = False, Nprocess = 1):
         """
         See documentation of 'EnsembleMethod.__init__' for explanations about
         arguments.
@@ -1725,7 +2147,8 @@ class InternalExponentiatedGradientDiscounted(InternalMethod):
                                 option = option, extended = extended,
                                 U = U, precision = precision,
                                 verbose = verbose,
-                                fixed_point_method = fixed_point_method)
+                                fixed_point_method = fixed_point_method,
+                                Nprocess = Nprocess)
 
 
     def Init(self):
@@ -1734,19 +2157,11 @@ class InternalExponentiatedGradientDiscounted(InternalMethod):
 
 
     def GetTools(self):
-        if self.ens.config.concentrations == "peak":
-            return self.confidence[0]
-        elif self.ens.config.concentrations == "hourly":
-            hour = self.ens.all_dates[self.step].hour
-            return self.confidence[hour]
+        return self.confidence[self.GetSlot()]
 
 
     def UpdateTools(self, confidence):
-        if self.ens.config.concentrations == "peak":
-            self.confidence[0] = confidence
-        elif self.ens.config.concentrations == "hourly":
-            hour = self.ens.all_dates[self.step].hour
-            self.confidence[hour] = confidence
+        self.confidence[self.GetSlot()] = confidence
 
 
     def compute_proba_on_couples(self, confidence):
@@ -1756,33 +2171,28 @@ class InternalExponentiatedGradientDiscounted(InternalMethod):
         @type confidence: list of array
         @rtype: array
         """
+        if self.ens.config.concentrations == "hourly":
+            raise Exception("hourly mode not available")
         if self.extended:
             N = 2 * self.Nsim
-            if self.ens.config.concentrations == "peak":
-                weight_list = self.weight_ext[:]
-            elif self.ens.config.concentrations == "hourly":
-                raise Exception("hourly mode not available")
-            weight_list.insert(0, self.GetInitialWeight().copy())
+            history = self.weight_ext
         else:
             N = self.Nsim
-            if self.ens.config.concentrations == "peak":
-                weight_list = self.weight[:]
-            elif self.ens.config.concentrations == "hourly":
-                raise Exception("hourly mode not available")
-            weight_list.insert(0, self.GetInitialWeight().copy())
+            history = self.weight
 
         T = len(confidence)
-        Q = ones([N, N], 'd') - identity(N)
-
-        for t in range(T):
-            for i in range(N):
-                for j in range(N):
-                    Q[i,j] *= exp( self.learning_rate / (T ** self.p1)
-                                  * weight_list[t][i]
-                                  * (confidence[t][i] - confidence[t][j])
-                                  * (1 + self.forget_rate
-                                     / ((T - t) ** self.p2)))
-            Q /= Q.sum()
+        # The products of exponentials are computed in log domain. The
+        # initial weights are followed by the weights of the previous steps.
+        rate = self.learning_rate / (T ** self.p1) \
+               * (1. + self.forget_rate / (T - arange(T)) ** self.p2)
+        weight_rate = rate[:, newaxis] \
+                      * concatenate((self.GetInitialWeight()[newaxis],
+                                     history[:T - 1]))
+        confidence = array(confidence)
+        log_Q = (weight_rate * confidence).sum(0)[:, newaxis] \
+                - dot(weight_rate.T, confidence)
+        log_Q[identity(N, 'bool')] = -inf
+        Q = exp(log_Q - log_Q.max())
         Q /= Q.sum()
         return Q
 
@@ -1815,7 +2225,7 @@ class DynamicLinearRegression(EnsembleMethod):
 
     def __init__(self, ens, configuration_file = None, process = True,
                  statistics = True, Nskip = 1, Nlearning = 1,
-                 verbose = False, delta = 1., s = 1.):
+                 verbose = False, delta = 1., s = 1., Nprocess = 1):
         """
         See documentation of 'EnsembleMethod.__init__' for explanations about
         arguments. Initial vector of forecast should be put in argument
@@ -1829,7 +2239,8 @@ class DynamicLinearRegression(EnsembleMethod):
                                 configuration_file = configuration_file,
                                 process = process, statistics = statistics,
                                 Nskip = Nskip, Nlearning = Nlearning,
-                                option = "station", verbose = verbose)
+                                option = "station", verbose = verbose,
+                                Nprocess = Nprocess)
 
 
     def Init(self):
@@ -1837,63 +2248,184 @@ class DynamicLinearRegression(EnsembleMethod):
         self.R = self.InitialList(identity(self.Nsim, 'd'))
         self.C = self.InitialList(identity(self.Nsim, 'd'))
         self.W = self.InitialList(zeros([self.Nsim, self.Nsim], 'd'))
-        self.e = self.InitialList(zeros(self.Nsim, 'd'))
+        self.e = self.InitialList(0.)
         self.Q = self.InitialList(1.)
-        self.s = self.InitialList(self.s_tmp)
-        self.d = self.InitialList(1.)
+        # The variance is a float, even if 's' was given as an integer.
+        self.s = self.InitialList(float(self.s_tmp))
+        # 'd' is the sum of the squared scaled errors, initialized so that
+        # the variance estimate d / n is 's' with one degree of freedom.
+        self.d = self.InitialList(float(self.s_tmp))
         self.n = self.InitialList(1)
 
 
     def UpdateTools(self, R, Q, C, W, e, s, d, n):
-        if self.ens.config.concentrations == "peak":
-            self.R[0] = R
-            self.Q[0] = Q
-            self.C[0] = C
-            self.W[0] = W
-            self.e[0] = e
-            self.s[0] = s
-            self.d[0] = d
-            self.n[0] = n
-        elif self.ens.config.concentrations == "hourly":
-            hour = self.ens.all_dates[self.step].hour
-            self.R[hour] = R
-            self.Q[hour] = Q
-            self.C[hour] = C
-            self.W[hour] = W
-            self.e[hour] = e
-            self.s[hour] = s
-            self.d[hour] = d
-            self.n[hour] = n
+        slot = self.GetSlot()
+        self.R[slot] = R
+        self.Q[slot] = Q
+        self.C[slot] = C
+        self.W[slot] = W
+        self.e[slot] = e
+        self.s[slot] = s
+        self.d[slot] = d
+        self.n[slot] = n
 
 
     def GetTools(self):
-        if self.ens.config.concentrations == "peak":
-            return self.R[0], self.Q[0], self.C[0], self.W[0], self.e[0],\
-                   self.s[0], self.d[0], self.n[0]
-        elif self.ens.config.concentrations == "hourly":
-            hour = self.ens.all_dates[self.step].hour
-            return self.R[hour], self.Q[hour], self.C[hour], self.W[hour],\
-                   self.e[hour], self.s[hour], self.d[hour], self.n[hour]
+        slot = self.GetSlot()
+        return self.R[slot], self.Q[slot], self.C[slot], self.W[slot],\
+               self.e[slot], self.s[slot], self.d[slot], self.n[slot]
 
 
     def UpdateWeight(self, sim, obs):
-        # R, C, W  variables are variance matrix. Q is a [1, 1]-array.
+        # R, C, W  variables are variance matrix. Q, e, s and d are scalars:
+        # the observation is the latest one of the learning period.
         prev_weight = self.GetPreviousWeight()
         R, Q, C, W, e, s, d, n = self.GetTools()
+        sim = sim[:, -1]
+        obs = obs[-1]
 
         n += 1
         # With known update of W, we would have R = C + W
         # Here, we use a discount factor 'delta'.
         R = C / self.delta
         W = R * (1 - self.delta)
-        Q = dot(sim.transpose(), dot(C, sim)) + s
-        e = (obs - dot(prev_weight, sim))
-        d += s * (e ** 2) / Q[0]
-        C = ((d / float(n)) / s) * (R - Q * outer(prev_weight, prev_weight))
+        Rsim = dot(R, sim)
+        Q = dot(sim, Rsim) + s
+        e = obs - dot(prev_weight, sim)
+        A = Rsim / Q
+        d += s * (e ** 2) / Q
+        C = ((d / float(n)) / s) * (R - Q * outer(A, A))
         s = (d / float(n))
-        A = dot(R, sim) / Q[0]
 
-        weight = prev_weight + e * A.reshape(self.Nsim,)
+        weight = prev_weight + e * A
 
         self.UpdateTools( R, Q, C, W, e, s, d, n)
         self.AcquireWeight(weight)
+
+
+################################
+# DYNAMICLINEARREGRESSIONBATCH #
+################################
+
+
+class DynamicLinearRegressionBatch(EnsembleMethod):
+    """
+    This class implements the Dynamic Linear Regression algorithm
+    (West and Harrison 1989) with a discount factor and an unknown
+    observational variance. The weights are the state of a Kalman filter per
+    station and per hour (for hourly concentrations). The filters of all
+    stations and all hours are advanced at once, one day after the other,
+    and the covariance matrices are updated in Joseph form. The weights are
+    those of 'DynamicLinearRegression', up to round-off errors.
+    """
+
+
+    def __init__(self, ens, configuration_file = None, process = True,
+                 statistics = True, Nskip = 1, verbose = False, delta = 1.,
+                 s = 1.):
+        """
+        See documentation of 'EnsembleMethod.__init__' for explanations about
+        arguments.
+
+        @type delta: float
+        @param delta: The discount factor, in ]0, 1]. The prior covariance
+        is the previous posterior covariance divided by 'delta'.
+        @type s: float
+        @param s: The initial estimate of the observational variance.
+        """
+        self.delta = delta
+        self.s_tmp = s
+        EnsembleMethod.__init__(self, ens,
+                                configuration_file = configuration_file,
+                                process = process, statistics = statistics,
+                                Nskip = Nskip, Nlearning = 1,
+                                option = "station", verbose = verbose)
+
+
+    def Init(self):
+        """
+        Initializes the states of the filters, indexed by the hour (for
+        hourly concentrations) and the station.
+        """
+        shape = (self.GetNslot(), self.ens.Nstation)
+        self.m = zeros(shape + (self.Nsim, ), 'd')
+        self.C = zeros(shape + (self.Nsim, self.Nsim), 'd')
+        self.C[...] = identity(self.Nsim, 'd')
+        self.S = self.s_tmp * ones(shape, 'd')
+        self.n = ones(shape, 'd')
+        self.d = self.S * self.n
+
+
+    def UpdateState(self, sim, obs, mask):
+        """
+        Updates the states of the filters with the observations of one day.
+
+        @type sim: 3D-array
+        @param sim: The simulated concentrations (slots x simulations x
+        stations).
+        @type obs: 2D-array
+        @param obs: The observations (slots x stations).
+        @type mask: 2D-array
+        @param mask: The mask (slots x stations) which is True where an
+        observation is available. The other filters are left unchanged.
+        """
+        slot, station = nonzero(mask)
+        if len(slot) == 0:
+            return
+        F = sim[slot, :, station]
+        y = obs[slot, station]
+        m = self.m[slot, station]
+        S = self.S[slot, station]
+
+        R = self.C[slot, station] / self.delta
+        RF = einsum("bij,bj->bi", R, F)
+        Q = einsum("bi,bi->b", F, RF) + S
+        e = y - einsum("bi,bi->b", F, m)
+        A = RF / Q[:, newaxis]
+
+        n = self.n[slot, station] + 1.
+        d = self.d[slot, station] + S * e ** 2 / Q
+        S_new = d / n
+
+        # Joseph form: (I - A F^T) R (I - A F^T)^T + S A A^T.
+        L = identity(self.Nsim) - A[:, :, newaxis] * F[:, newaxis, :]
+        C = matmul(matmul(L, R), L.transpose((0, 2, 1))) \
+            + S[:, newaxis, newaxis] * A[:, :, newaxis] * A[:, newaxis, :]
+        C = 0.5 * (C + C.transpose((0, 2, 1)))
+
+        self.m[slot, station] = m + A * e[:, newaxis]
+        self.C[slot, station] = (S_new / S)[:, newaxis, newaxis] * C
+        self.S[slot, station] = S_new
+        self.n[slot, station] = n
+        self.d[slot, station] = d
+
+
+    def Process(self):
+        Nslot = self.GetNslot()
+        starting_date = Nslot * self.Nskip
+        Ndate = len(self.ens.all_dates)
+        self.online = False
+
+        self.InitLearningData()
+        self.Init()
+        weight = zeros((Ndate - starting_date, self.ens.Nstation, self.Nsim),
+                       'd')
+        # The observations of a day are used to compute the weights of the
+        # next day, at the same hours.
+        for start in range(starting_date - Nslot, Ndate, Nslot):
+            end = minimum(start + Nslot, Ndate)
+            if end > starting_date:
+                first = maximum(start, starting_date)
+                weight[first - starting_date:end - starting_date] \
+                    = self.m[first - start:end - start]
+            if start + Nslot < Ndate:
+                self.UpdateState(self.learning_sim[start:end],
+                                 self.learning_obs[start:end],
+                                 self.learning_mask[start:end])
+
+        self.all_dates = self.ens.all_dates[starting_date:]
+        self.weight = [weight[:, i] for i in range(self.ens.Nstation)]
+        self.weight_ext = [WeightHistory(2 * self.Nsim)
+                           for i in range(self.ens.Nstation)]
+        self.weight_date = [self.all_dates for i in range(self.ens.Nstation)]
+        self.Combine()
@@ -0,0 +1,119 @@
+# Copyright (C) 2026, ENPC - INRIA - EDF R&D
+#
+# This file is part of AtmoPy library, a tool for data processing and
+# visualization in atmospheric sciences.
+#
+# AtmoPy is developed in the INRIA - ENPC joint project-team CLIME and in
+# the ENPC - EDF R&D joint laboratory CEREA.
+#
+# AtmoPy is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# AtmoPy is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for
+# more details.
+#
+# For more information, visit the AtmoPy home page:
+#     http://cerea.enpc.fr/polyphemus/atmopy.html
+
+
+import itertools
+import multiprocessing
+from atmopy.ensemble import combine
+
+
+# The ensemble, the learning data and the configurations of the sweep being
+# run, inherited by forked processes.
+_sweep = None
+
+
+def parameter_grid(**parameters):
+    """
+    Builds all combinations of parameter values.
+
+    @type parameters: keyword arguments
+    @param parameters: The list of values of each parameter.
+
+    @rtype: list of dict
+    @return: The list of all combinations of values, each combination being
+    a dictionary of keyword arguments.
+
+    Example:
+       >>> parameter_grid(Nlearning = [1, 5], learning_rate = [1.e-5, 2.e-5])
+       [{'Nlearning': 1, 'learning_rate': 1e-05},
+        {'Nlearning': 1, 'learning_rate': 2e-05},
+        {'Nlearning': 5, 'learning_rate': 1e-05},
+        {'Nlearning': 5, 'learning_rate': 2e-05}]
+    """
+    names = list(parameters.keys())
+    return [dict(zip(names, values))
+            for values in itertools.product(*[parameters[x] for x in names])]
+
+
+def _run_configuration(index):
+    """
+    Processes one configuration of a sweep.
+
+    @type index: integer
+    @param index: The index of the configuration.
+
+    @rtype: dict
+    @return: The statistics of the ensemble combination.
+    """
+    ens, learning_data, configurations, period = _sweep
+    method, parameters = configurations[index]
+    m = method(ens, process = False, statistics = False, **parameters)
+    m.learning_data = learning_data
+    m.Process()
+    m.ComputeStatistics(period)
+    return m.stat
+
+
+def sweep(ens, configurations, Nprocess = 1, period = None):
+    """
+    Computes the statistics of several ensemble methods, or of a method with
+    several sets of parameters. The learning data is gathered only once and
+    the configurations are distributed among forked processes, which share
+    the ensemble data.
+
+    @type ens: EnsembleData
+    @param ens: Ensemble data ready for computations.
+    @type configurations: list of (class, dict)
+    @param configurations: The list of configurations to be evaluated. A
+    configuration is made of an ensemble method (a class derived from
+    'EnsembleMethod') and of the keyword arguments passed to its constructor
+    (see 'parameter_grid').
+    @type Nprocess: integer
+    @param Nprocess: The number of processes.
+    @type period: 2-tuple of datetime, or None
+    @param period: The period over which the statistics are computed. If
+    None, the whole processed period is used.
+
+    @rtype: list of (string, dict, dict)
+    @return: For each configuration, the name of the method, its parameters
+    and its statistics (attribute 'stat' of the method).
+    """
+    global _sweep
+    learning_data = combine.collect_dense(ens.sim, ens.obs, ens.date,
+                                          ens.all_dates)
+    _sweep = (ens, learning_data, configurations, period)
+    try:
+        if Nprocess > 1 and len(configurations) > 1 \
+               and "fork" in multiprocessing.get_all_start_methods():
+            pool = multiprocessing.get_context("fork").Pool(Nprocess)
+            try:
+                stat = pool.map(_run_configuration,
+                                range(len(configurations)), chunksize = 1)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            stat = [_run_configuration(i)
+                    for i in range(len(configurations))]
+    finally:
+        _sweep = None
+    return [(configurations[i][0].__name__, configurations[i][1], stat[i])
+            for i in range(len(configurations))]
@@ -30,3 +30,4 @@ operations.
 from atmopy.io.binary import *
 from atmopy.io.measurement import *
 from atmopy.io.source import *
+from atmopy.io.compressed import *
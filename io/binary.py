@@ -23,6 +23,7 @@
 
 import numpy
 import datetime
+import json
 import sys, os
 sys.path.insert(0,
                 os.path.split(os.path.dirname(os.path.abspath(__file__)))[0])
@@ -72,7 +73,113 @@ def get_timesteps(filename, recordLength):
     return ts
 
 
-def load_binary(filename, shape, type = 'f'):
+def get_header_filename(filename):
+    """
+    Returns the name of the header file associated with a binary file.
+
+    @type filename: string
+    @param filename: The name of the binary file.
+
+    @rtype: string
+    @return: The name of the header file.
+    """
+    return filename + ".json"
+
+
+def write_header(filename, shape, type = 'f', **attributes):
+    """
+    Writes the header file associated with a binary file. The header is a
+    small JSON file that describes the content of the binary file.
+
+    @type filename: string
+    @param filename: The name of the binary file.
+    @type shape: tuple
+    @param shape: The shape of the data in the binary file.
+    @type type: string
+    @param type: Type of data in the binary file. Default is 'f'.
+    @type attributes: keyword arguments
+    @param attributes: Any other description of the data, e.g., t_min,
+    Delta_t, x_min, Delta_x, y_min, Delta_y or species. Dates are saved in
+    ISO format.
+    """
+    header = {"shape": [int(l) for l in shape],
+              "type": numpy.dtype(type).str}
+    for key, value in attributes.items():
+        if isinstance(value, datetime.datetime):
+            value = value.isoformat()
+        elif isinstance(value, datetime.timedelta):
+            value = value.total_seconds() / 3600.
+        elif isinstance(value, numpy.generic):
+            value = value.item()
+        header[key] = value
+    f = open(get_header_filename(filename), "w")
+    json.dump(header, f, indent = 1)
+    f.close()
+
+
+def read_header(filename):
+    """
+    Reads the header file associated with a binary file.
+
+    @type filename: string
+    @param filename: The name of the binary file.
+
+    @rtype: dict, or None
+    @return: The description of the binary file: "shape" (tuple), "type" and
+    the other attributes written in the header ("t_min" is converted to
+    datetime). None is returned if there is no header file.
+    """
+    header_filename = get_header_filename(filename)
+    if not os.path.isfile(header_filename):
+        return None
+    f = open(header_filename)
+    header = json.load(f)
+    f.close()
+    header["shape"] = tuple(header["shape"])
+    if "t_min" in header:
+        header["t_min"] = datetime.datetime.fromisoformat(header["t_min"])
+    return header
+
+
+def _get_description(filename, shape, type):
+    """
+    Completes the shape and the type of a binary file with its header, and
+    checks them against the header and the file size. A given shape is
+    consistent with the header if it has the same size, or if its records
+    (all dimensions but the first) have the same size as in the header and
+    it has at most as many time steps: the first time steps are then read.
+    """
+    header = read_header(filename)
+    if header is not None:
+        if shape is None:
+            shape = header["shape"]
+        elif numpy.prod(shape) != numpy.prod(header["shape"]):
+            partial = len(shape) > 0 and len(header["shape"]) > 0 \
+                      and shape[0] <= header["shape"][0] \
+                      and numpy.prod(shape[1:]) \
+                      == numpy.prod(header["shape"][1:])
+            if not partial:
+                raise Exception("Shape " + str(tuple(shape)) + " is not "
+                                + "consistent with the header of \""
+                                + filename + "\": " + str(header["shape"])
+                                + ".")
+        if type is None:
+            type = header["type"]
+    if shape is None:
+        raise Exception("No shape was provided and no header was found for "
+                        + "file \"" + filename + "\".")
+    if type is None:
+        type = 'f'
+    length = numpy.dtype(type).itemsize
+    for l in shape:
+        length *= l
+    if get_filesize(filename) < length:
+        raise Exception("File \"" + filename \
+              + "\" does not contain enough elements.")
+    return tuple(shape), type
+
+
+def load_binary(filename, shape = None, type = None):
     """
     Loads a binary file into an array using specified shape.
     Returns numpy.
@@ -81,14 +188,20 @@ def load_binary(filename, shape, type = 'f'):
     @param filename: The name of the file to load.
 
     @type shape: tuple
-    @param shape: The shape of the array to load from file.
+    @param shape: The shape of the array to load from file. If it is not
+    provided, it is read in the header file.
 
     @type type: string
-    @param type: Type of data read. Default is 'f'
+    @param type: Type of data read. Default is the type in the header file,
+    or 'f' if there is no header.
 
     @rtype: numpy.array
     @return: New array filled with binary data from specified file.
     """
+    if isinstance(filename, str):
+        shape, type = _get_description(filename, shape, type)
+    elif type is None:
+        type = 'f'
     length = 1
     for l in shape:
         length *= l
@@ -101,43 +214,100 @@ def load_binary(filename, shape, type = 'f'):
     return d
 
 
-def load_binary_first_level(filename, shape, type = 'f'):
+def load_binary_subset(filename, shape = None, t = None, z = None,
+                       y = None, x = None, type = None):
+    """
+    Loads a subset of a binary file into an array. The file is
+    memory-mapped, so that only the records that contain the selected data
+    are read.
+
+    @type filename: string
+    @param filename: The name of the file to load.
+
+    @type shape: tuple
+    @param shape: The shape of the data in the file: (T, Z, Y, X) or (T, Y,
+    X). If it is not provided, it is read in the header file.
+
+    @type t: integer, slice, list or None
+    @param t: The time step(s) to be read. All time steps are read if 't' is
+    None.
+
+    @type z: integer, slice, list or None
+    @param z: The level(s) to be read, for a 4D shape only. All levels are
+    read if 'z' is None.
+
+    @type y: integer, slice, list or None
+    @param y: The index (or indices) along y to be read. Everything is read
+    if 'y' is None.
+
+    @type x: integer, slice, list or None
+    @param x: The index (or indices) along x to be read. Everything is read
+    if 'x' is None.
+
+    @type type: string
+    @param type: Type of data read. Default is the type in the header file,
+    or 'f' if there is no header.
+
+    @rtype: numpy.array
+    @return: New array filled with the selected data. As with numpy
+    indexing, the dimensions selected with an integer are removed.
+    """
+    shape, type = _get_description(filename, shape, type)
+    if len(shape) == 4:
+        selection = [t, z, y, x]
+    elif len(shape) == 3:
+        if z is not None:
+            raise Exception("Levels can only be selected in a 4D shape.")
+        selection = [t, y, x]
+    else:
+        raise Exception("The shape should be (T, Z, Y, X) or (T, Y, X).")
+    selection = tuple([slice(None) if s is None else s for s in selection])
+
+    data = numpy.memmap(filename, dtype = type, mode = "r", shape = shape)
+    d = numpy.array(data[selection], dtype = 'd')
+    del data
+    return d
+
+
+def load_binary_first_level(filename, shape = None, type = None):
     """
     Loads a binary file into an array using specified 3D shape for
     X, Y and T dimensions (a time sequence of planes).
     If the given binary file is a 4D file (XYZT), the plane Z = 1 is
-    extracted.
+    extracted. Only this plane is read from the file.
 
     @type filename: string or Python file object.
     @param filename: The name of the file to load.
 
     @type shape: tuple
-    @param shape: The 3D shape of the array to load from file.
+    @param shape: The 3D shape of the array to load from file. It may be
+    omitted if the file has a header.
 
     @type type: string
-    @param type: Type of data read. Default is 'f'
+    @param type: Type of data read. Default is the type in the header file,
+    or 'f' if there is no header.
 
     @rtype: numpy.array
     @return: New 3D array os given shape filled with binary data
     from specified file.
     """
-    res = []
+    header = read_header(filename)
+    if header is not None and len(header["shape"]) == 4:
+        return load_binary_subset(filename, z = 0, type = type)
+    shape, type = _get_description(filename, shape, type)
     zsize = get_filesize(filename) \
-            / (numerictypes.getType(type).bytes * shape[0] \
-               * shape[1] * shape[2])
-    if zsize != 1:
-        res = load_binary(filename, shape, type)
+            // (numpy.dtype(type).itemsize * shape[0] \
+                * shape[1] * shape[2])
+    if zsize <= 1:
+        return load_binary(filename, shape, type)
     else:
         newshape = list(shape)
         newshape.insert(1, zsize)
-        # Use temp array to be sure that memory is freed
-        temp = load_binary(filename, newshape, type)
-        res = temp[:,0,:,:]
-        del temp
-    return res
+        return load_binary_subset(filename, newshape, z = 0, type = type)
 
 
-def save_binary(arrayToSave, filename, type = 'f'):
+def save_binary(arrayToSave, filename, type = 'f', header = False,
+                **attributes):
     """
     Saves a numpy in a binary file using specified type.
 
@@ -149,14 +319,27 @@ def save_binary(arrayToSave, filename, type = 'f'):
 
     @type type: string
     @param type: Format of data to save the array in file.
+
+    @type header: Boolean
+    @param header: Should a header file be written along with the binary
+    file? If 'attributes' are provided, the header is always written.
+
+    @type attributes: keyword arguments
+    @param attributes: Description of the data (t_min, Delta_t, species,
+    ...) to be saved in the header file. See 'write_header'.
     """
-    numpy.array(arrayToSave, dtype = type).tofile(filename)
+    arrayToSave = numpy.array(arrayToSave, dtype = type)
+    arrayToSave.tofile(filename)
+    if header or attributes:
+        write_header(filename, arrayToSave.shape, type, **attributes)
 
 
 
-def append_binary(arrayToSave, filename, type = 'f'):
+def append_binary(arrayToSave, filename, type = None):
     """
-    Saves a numpy in a binary file using specified type.
+    Appends a numpy array to a binary file using specified type. If the file
+    has a header, the array should contain whole time steps and its number of
+    time steps is added to the header.
 
     @type arrayToSave: numpy.array
     @param arrayToSave: The array to save.
@@ -165,13 +348,175 @@ def append_binary(arrayToSave, filename, type = 'f'):
     @param filename: The name of the file to save the array into.
 
     @type type: string
-    @param type: Format of data to save the array in file.
+    @param type: Format of data to save the array in file. Default is the
+    type in the header file, or 'f' if there is no header.
     """
+    header = None
+    if isinstance(filename, str):
+        header = read_header(filename)
+    if header is not None:
+        if type is None:
+            type = header["type"]
+        elif numpy.dtype(type) != numpy.dtype(header["type"]):
+            raise Exception("Type \"" + str(type) + "\" is not consistent "
+                            + "with the header of \"" + filename + "\": \""
+                            + header["type"] + "\".")
+        record = numpy.prod(header["shape"][1:], dtype = int)
+        if numpy.size(arrayToSave) % record != 0:
+            raise Exception("The array to be appended to \"" + filename
+                            + "\" should contain whole time steps of "
+                            + str(record) + " elements, not "
+                            + str(numpy.size(arrayToSave)) + " elements.")
+    elif type is None:
+        type = 'f'
     f = open(filename, 'ab')
-    numpy.array(arrayToSave, dtype = type).tofile(f)
+    arrayToSave = numpy.array(arrayToSave, dtype = type)
+    arrayToSave.tofile(f)
     f.close()
-    
-    
+    if header is not None:
+        # Updates the number of time steps in the header.
+        shape = list(header.pop("shape"))
+        header.pop("type")
+        shape[0] += arrayToSave.size // record
+        write_header(filename, shape, type, **header)
+
+
+def memmap_binary(filename, shape = None, type = None, mode = "r"):
+    """
+    Maps a binary file in memory.
+
+    @type filename: string
+    @param filename: The name of the file to be mapped.
+    @type shape: tuple
+    @param shape: The shape of the data in the file. If it is not provided,
+    it is read in the header file.
+    @type type: string
+    @param type: Type of data in the file. Default is the type in the header
+    file, or 'f' if there is no header.
+    @type mode: string
+    @param mode: The mode in which the file is opened: "r" (read-only), "r+"
+    (read and write) or "c" (copy-on-write).
+
+    @rtype: numpy.memmap
+    @return: The memory-mapped data, in the type of the file.
+    """
+    shape, type = _get_description(filename, shape, type)
+    return numpy.memmap(filename, dtype = type, mode = mode, shape = shape)
+
+
+class BinaryOutput:
+    """
+    BinaryOutput writes a binary file time step after time step. The whole
+    file is preallocated and memory-mapped when the instance is created, so
+    that every time step is written in place, without reopening the file.
+    """
+
+
+    def __init__(self, filename, shape, type = 'f', resume = False,
+                 step = None):
+        """
+        Preallocates (or reopens) the file and maps it in memory.
+
+        @type filename: string
+        @param filename: The name of the file to be written.
+        @type shape: tuple
+        @param shape: The shape of the whole data, time being the first
+        dimension.
+        @type type: string
+        @param type: Format of data to save in the file. Default is 'f'.
+        @type resume: Boolean
+        @param resume: If True, an existing file is opened for update and its
+        content is kept. Its size must be consistent with 'shape', and
+        'step' must be provided. If the file does not exist, it is created.
+        If 'resume' is False, the file is (re)created.
+        @type step: integer
+        @param step: The index of the next time step to be written, that is,
+        the number of time steps already written in the resumed file. It
+        defaults to 0 for a new file.
+        """
+        self.filename = filename
+        self.shape = tuple(shape)
+        self.type = numpy.dtype(type)
+        length = self.type.itemsize
+        for l in self.shape:
+            length *= l
+
+        resume = resume and os.path.isfile(filename)
+        if resume:
+            if get_filesize(filename) != length:
+                raise Exception("The size of file \"" + filename + "\" ("
+                                + str(get_filesize(filename)) + " bytes) is "
+                                + "not consistent with shape "
+                                + str(self.shape) + ".")
+            if step is None:
+                raise Exception("The index of the next time step to be "
+                                + "written must be provided to resume \""
+                                + filename + "\".")
+            if step < 0 or step > self.shape[0]:
+                raise Exception("Time step " + str(step) + " is out of range"
+                                + " [0, " + str(self.shape[0]) + "].")
+        else:
+            if step is None:
+                step = 0
+            f = open(filename, "wb")
+            if hasattr(os, "posix_fallocate") and length > 0:
+                # Reserves contiguous blocks on disk if possible.
+                os.posix_fallocate(f.fileno(), 0, length)
+            else:
+                f.truncate(length)
+            f.close()
+        self.data = numpy.memmap(filename, dtype = self.type, mode = "r+",
+                                 shape = self.shape)
+        # Index of the next time step to be written.
+        self.step = step
+
+
+    def Write(self, data, step = None):
+        """
+        Writes one time step in the file.
+
+        @type data: numpy.array
+        @param data: The data at the given time step. Its shape should be
+        'shape[1:]'.
+        @type step: integer
+        @param step: The index of the time step. By default, the time step
+        following the last written step.
+        """
+        if step is None:
+            step = self.step
+        if step < 0 or step >= self.shape[0]:
+            raise Exception("Time step " + str(step) + " is out of range [0, "
+                            + str(self.shape[0]) + "[.")
+        self.data[step] = data
+        self.step = step + 1
+
+
+    def Flush(self):
+        """
+        Writes to disk the time steps that were modified.
+        """
+        self.data.flush()
+
+
+    def Close(self):
+        """
+        Flushes and closes the file.
+        """
+        if self.data is not None:
+            self.data.flush()
+            # The mapping is closed once the array is released.
+            self.data = None
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.Close()
+
+
+
 def filter_config(config, data):
     """
     Filters data based on the cells and the days to be discarded according to
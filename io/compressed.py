@@ -0,0 +1,312 @@
+# Copyright (C) 2026, ENPC - INRIA - EDF R&D
+#
+# This file is part of AtmoPy library, a tool for data processing and
+# visualization in atmospheric sciences.
+#
+# AtmoPy is developed in the INRIA - ENPC joint project-team CLIME and in
+# the ENPC - EDF R&D joint laboratory CEREA.
+#
+# AtmoPy is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# AtmoPy is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for
+# more details.
+#
+# For more information, visit the AtmoPy home page:
+#     http://cerea.enpc.fr/polyphemus/atmopy.html
+
+
+"""
+Compressed storage of Polyphemus binary data. The data is split into chunks
+of 'Nt_chunk' time steps (and, for 4D data, of one level). Each chunk is
+compressed independently, so that any time step and any level can be read
+without decompressing the whole file.
+
+File layout:
+   0. the magic string 'ATMOPYZ1';
+   1. the compressed chunks;
+   2. the index, in JSON: shape, data type, compression and the position of
+   every chunk in the file;
+   3. the position of the index (unsigned 64-bit integer, little endian);
+   4. the magic string again.
+"""
+
+
+import json
+import struct
+import zlib
+import numpy
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+
+_magic = b"ATMOPYZ1"
+
+
+def _check_compression(compression):
+    """
+    Checks that a compression library is known and available.
+    """
+    if compression == "lz4":
+        if lz4 is None:
+            raise Exception("Compression \"lz4\" requires the Python "
+                            + "package \"lz4\", which is not installed.")
+    elif compression != "zlib":
+        raise Exception("Unknown compression \"" + compression + "\".")
+
+
+def _compress(data, compression, level):
+    if compression == "zlib":
+        return zlib.compress(data, level)
+    elif compression == "lz4":
+        return lz4.frame.compress(data, compression_level = level)
+    else:
+        raise Exception("Unknown compression \"" + compression + "\".")
+
+
+def _decompress(data, compression):
+    if compression == "zlib":
+        return zlib.decompress(data)
+    elif compression == "lz4":
+        return lz4.frame.decompress(data)
+    else:
+        raise Exception("Unknown compression \"" + compression + "\".")
+
+
+def _write_compressed(data, filename, type, Nt_chunk, compression, level):
+    """
+    Writes a compressed file from an array (or a memory-mapped file). The
+    input data is read one chunk at a time.
+    """
+    _check_compression(compression)
+    type = numpy.dtype(type)
+    shape = data.shape
+    if len(shape) == 4:
+        Nz = shape[1]
+    else:
+        Nz = 1
+    Nt_chunk = max(1, min(Nt_chunk, shape[0]))
+
+    f = open(filename, "wb")
+    f.write(_magic)
+    chunk = []
+    for t in range(0, shape[0], Nt_chunk):
+        block = data[t:t + Nt_chunk]
+        for z in range(Nz):
+            if len(shape) == 4:
+                values = numpy.ascontiguousarray(block[:, z], dtype = type)
+            else:
+                values = numpy.ascontiguousarray(block, dtype = type)
+            values = _compress(values.tobytes(), compression, level)
+            chunk.append([f.tell(), len(values)])
+            f.write(values)
+
+    index = {"shape": list(shape), "type": type.str, "Nt_chunk": Nt_chunk,
+             "Nz_chunk": Nz, "compression": compression, "chunk": chunk}
+    position = f.tell()
+    f.write(json.dumps(index).encode())
+    f.write(struct.pack("<Q", position))
+    f.write(_magic)
+    f.close()
+
+
+def save_compressed(arrayToSave, filename, type = 'f', Nt_chunk = 24,
+                    compression = "zlib", level = 6):
+    """
+    Saves an array in a compressed file, split in chunks along time (and
+    along levels for 4D arrays).
+
+    @type arrayToSave: numpy.array
+    @param arrayToSave: The array to save. Time is the first dimension.
+    @type filename: string
+    @param filename: The name of the file to save the array into.
+    @type type: string
+    @param type: Format of data to save the array in file.
+    @type Nt_chunk: integer
+    @param Nt_chunk: The number of time steps in a chunk.
+    @type compression: string
+    @param compression: The compression library: "zlib" or "lz4" (if
+    installed).
+    @type level: integer
+    @param level: The compression level.
+    """
+    _write_compressed(numpy.asarray(arrayToSave), filename, type, Nt_chunk,
+                      compression, level)
+
+
+def convert_binary(filename, shape, output_filename, type = 'f',
+                   Nt_chunk = 24, compression = "zlib", level = 6):
+    """
+    Converts a raw binary file into a compressed file. The binary file is
+    memory-mapped, so that it is never fully loaded in memory.
+
+    @type filename: string
+    @param filename: The name of the binary file to be converted.
+    @type shape: tuple
+    @param shape: The shape of the data in the binary file.
+    @type output_filename: string
+    @param output_filename: The name of the compressed file.
+    @type type: string
+    @param type: Type of data in the binary file. Default is 'f'.
+    @type Nt_chunk: integer
+    @param Nt_chunk: The number of time steps in a chunk.
+    @type compression: string
+    @param compression: The compression library: "zlib" or "lz4".
+    @type level: integer
+    @param level: The compression level.
+    """
+    data = numpy.memmap(filename, dtype = type, mode = "r",
+                        shape = tuple(shape))
+    _write_compressed(data, output_filename, type, Nt_chunk, compression,
+                      level)
+    del data
+
+
+class CompressedBinary:
+    """
+    CompressedBinary gives random access, by time step and level, to a file
+    written by 'save_compressed' or 'convert_binary'.
+    """
+
+
+    def __init__(self, filename):
+        """
+        Reads the index of the file.
+
+        @type filename: string
+        @param filename: The name of the compressed file.
+        """
+        self.filename = filename
+        self.file = open(filename, "rb")
+        if self.file.read(len(_magic)) != _magic:
+            raise Exception("File \"" + filename
+                            + "\" is not a compressed AtmoPy file.")
+        self.file.seek(- 8 - len(_magic), 2)
+        position = struct.unpack("<Q", self.file.read(8))[0]
+        end = self.file.tell()
+        self.file.seek(position)
+        index = json.loads(self.file.read(end - 8 - position).decode())
+        self.shape = tuple(index["shape"])
+        self.type = numpy.dtype(index["type"])
+        self.Nt_chunk = index["Nt_chunk"]
+        self.Nz_chunk = index["Nz_chunk"]
+        self.compression = index["compression"]
+        _check_compression(self.compression)
+        self.chunk = index["chunk"]
+        # Last decompressed chunk, to speed up consecutive reads.
+        self.cache = (None, None)
+
+
+    def GetChunk(self, ichunk):
+        """
+        Returns the data of a given chunk.
+
+        @type ichunk: integer
+        @param ichunk: The index of the chunk.
+
+        @rtype: numpy.array
+        @return: The data in the chunk: (time, ...) array, without the level
+        dimension for 4D data.
+        """
+        if self.cache[0] == ichunk:
+            return self.cache[1]
+        position, length = self.chunk[ichunk]
+        self.file.seek(position)
+        data = numpy.frombuffer(_decompress(self.file.read(length),
+                                            self.compression),
+                                dtype = self.type)
+        if len(self.shape) == 4:
+            data = data.reshape((-1, ) + self.shape[2:])
+        else:
+            data = data.reshape((-1, ) + self.shape[1:])
+        self.cache = (ichunk, data)
+        return data
+
+
+    def Read(self, t = None, z = None):
+        """
+        Reads a subset of the data.
+
+        @type t: integer, slice or None
+        @param t: The time step(s) to be read. All time steps are read if 't'
+        is None.
+        @type z: integer, slice or None
+        @param z: The level(s) to be read, for 4D data only. All levels are
+        read if 'z' is None.
+
+        @rtype: numpy.array
+        @return: The selected data, in the type of the file.
+        """
+        if t is None:
+            t = slice(None)
+        if z is None:
+            z = slice(None)
+        time = numpy.arange(self.shape[0])[t]
+        if len(self.shape) == 4:
+            level = numpy.arange(self.shape[1])[z]
+        else:
+            if z != slice(None):
+                raise Exception("Levels can only be selected in 4D data.")
+            level = numpy.array([0])
+
+        time_1d = numpy.atleast_1d(time)
+        level_1d = numpy.atleast_1d(level)
+        if len(self.shape) == 4:
+            out = numpy.empty((len(time_1d), len(level_1d))
+                              + self.shape[2:], dtype = self.type)
+        else:
+            out = numpy.empty((len(time_1d), ) + self.shape[1:],
+                              dtype = self.type)
+        block = time_1d // self.Nt_chunk
+        for ib in numpy.unique(block):
+            selection = numpy.where(block == ib)[0]
+            position = time_1d[selection] - ib * self.Nt_chunk
+            for il in range(len(level_1d)):
+                data = self.GetChunk(ib * self.Nz_chunk + level_1d[il])
+                if len(self.shape) == 4:
+                    out[selection, il] = data[position]
+                else:
+                    out[selection] = data[position]
+
+        if len(self.shape) == 4 and numpy.ndim(level) == 0:
+            out = out[:, 0]
+        if numpy.ndim(time) == 0:
+            out = out[0]
+        return out
+
+
+    def Close(self):
+        """
+        Closes the file.
+        """
+        self.file.close()
+        self.cache = (None, None)
+
+
+def load_compressed(filename, t = None, z = None):
+    """
+    Loads (a subset of) a compressed file into an array. Only the chunks that
+    contain the selected time steps and levels are decompressed.
+
+    @type filename: string
+    @param filename: The name of the compressed file.
+    @type t: integer, slice or None
+    @param t: The time step(s) to be read. All time steps are read if 't' is
+    None.
+    @type z: integer, slice or None
+    @param z: The level(s) to be read, for 4D data only. All levels are read
+    if 'z' is None.
+
+    @rtype: numpy.array
+    @return: New array filled with the selected data.
+    """
+    f = CompressedBinary(filename)
+    d = f.Read(t, z).astype('d')
+    f.Close()
+    return d
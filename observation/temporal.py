@@ -425,6 +425,63 @@ def masks_for_common_dates(dates0, dates1):
     return mask0, mask1
 
 
+def dates_to_keys(dates):
+    """
+    Converts dates into integer keys that preserve their order, so that lists
+    of dates may be compared, sorted and searched with numpy.
+
+    @type dates: list of datetime
+    @param dates: The dates to be converted.
+
+    @rtype: 1D numpy.array of integers
+    @return: The number of microseconds between 1970-01-01 and each date.
+    """
+    dates = list(dates)
+    if len(dates) == 0:
+        return numpy.zeros(0, dtype = "int64")
+    # Subtracting the epoch is much faster than numpy's conversion of
+    # datetime objects.
+    if isinstance(dates[0], datetime.datetime):
+        epoch = datetime.datetime(1970, 1, 1)
+    else:
+        epoch = datetime.date(1970, 1, 1)
+    microsecond = datetime.timedelta(microseconds = 1)
+    try:
+        return numpy.fromiter(((x - epoch) // microsecond for x in dates),
+                              dtype = "int64", count = len(dates))
+    except TypeError:
+        # Mixed dates and datetimes.
+        return numpy.asarray(dates,
+                             dtype = "datetime64[us]").astype("int64")
+
+
+def match_dates(dates, reference):
+    """
+    Finds the positions of dates in a list of reference dates. The reference
+    dates are sorted once, and the dates are searched with a binary search.
+
+    @type dates: list of datetime, or 1D numpy.array of integers
+    @param dates: The dates to be found, or their keys (see
+    'dates_to_keys').
+    @type reference: list of datetime, or 1D numpy.array of integers
+    @param reference: The reference dates, or their keys.
+
+    @rtype: 1D numpy.array of integers
+    @return: For each date, its index in 'reference' (the first index if the
+    date appears several times), or -1 if the date is not in 'reference'.
+    """
+    if not isinstance(dates, numpy.ndarray):
+        dates = dates_to_keys(dates)
+    if not isinstance(reference, numpy.ndarray):
+        reference = dates_to_keys(reference)
+    if len(reference) == 0:
+        return -numpy.ones(len(dates), dtype = "int")
+    order = numpy.argsort(reference, kind = "stable")
+    position = numpy.searchsorted(reference, dates, sorter = order)
+    position = order[numpy.minimum(position, len(reference) - 1)]
+    return numpy.where(reference[position] == dates, position, -1)
+
+
 def restrict_to_common_days(sim_dates, simulated, obs_dates, obs):
     """
     Gets items from data and dates so as to keep only
@@ -29,5 +29,6 @@ models performances.
 
 
 from atmopy.stat.measure import *
+from atmopy.stat.registry import *
 from atmopy.stat.compute import *
 from atmopy.stat.miscellaneous import *
@@ -26,7 +26,8 @@ import datetime
 import os, sys
 sys.path.insert(0,
                 os.path.split(os.path.dirname(os.path.abspath(__file__)))[0])
-import atmopy.talos, atmopy.observation, atmopy.stat.measure
+from atmopy import observation
+from atmopy.stat.registry import measure_registry
 sys.path.pop(0)
 
 
@@ -158,8 +159,6 @@ def compute_stat(sim, obs, measures, dates = None, stations = None, period =
 
     ### Initializations.
 
-    import inspect
-
     if isinstance(sim[0], ndarray):
         sim = (sim, )
 
@@ -186,25 +185,15 @@ def compute_stat(sim, obs, measures, dates = None, stations = None, period =
     Nsim = len(sim)
 
     # Functions to be applied.
-    if cutoff == None:
-        functions = talos.get_module_functions(measure, (1, 2), measures)
-    else:
-        functions = talos.get_module_functions(measure, (1, 2, 3), measures)
+    functions = measure_registry.GetNames(measures, cutoff is not None)
 
     ### Statistics.
 
     stat_all = dict(zip(functions, [[] for f in functions]))
 
     s, o = collect(sim, obs, dates, stations, period, stations_out)
-    for i in range(Nsim):
-        for f in functions:
-            Nargs = len(inspect.getargspec(getattr(measure, f))[0])
-            if Nargs == 1:
-                stat_all[f].append(getattr(measure, f)(o))
-            elif Nargs == 2:
-                stat_all[f].append(getattr(measure, f)(s[i], o))
-            else:   # Nargs == 3
-                stat_all[f].append(getattr(measure, f)(s[i], o, cutoff))
+    for f in functions:
+        stat_all[f] = list(measure_registry.Compute(f, s, o, cutoff))
 
     # To arrays.
     for k in stat_all.keys():
@@ -264,8 +253,6 @@ def compute_stat_step(dates, sim, obs, obs_type, measures, stations = None,
 
     ### Initializations.
 
-    import inspect
-
     if isinstance(sim[0], ndarray):
         sim = (sim, )
 
@@ -283,10 +270,7 @@ def compute_stat_step(dates, sim, obs, obs_type, measures, stations = None,
     Nstations = len(sim[0])
 
     # Functions to be applied.
-    if cutoff == None:
-        functions = talos.get_module_functions(measure, (1, 2), measures)
-    else:
-        functions = talos.get_module_functions(measure, (1, 2, 3), measures)
+    functions = measure_registry.GetNames(measures, cutoff is not None)
 
     ### Statistics.
 
@@ -296,7 +280,7 @@ def compute_stat_step(dates, sim, obs, obs_type, measures, stations = None,
     if obs_type == "hourly":
         range_delta = datetime.timedelta(0, 3600)
         Nsteps = (end_date - start_date).days * 24 \
-                 + (end_date - start_date).seconds / 3600 + 1
+                 + (end_date - start_date).seconds // 3600 + 1
     else:
         start_date = observation.midnight(start_date)
         end_date = observation.midnight(end_date)
@@ -314,16 +298,10 @@ def compute_stat_step(dates, sim, obs, obs_type, measures, stations = None,
         if float(len(o)) / float(Nstations) < ratio:
             continue
         output_dates.append(date)
-        for i in range(Nsim):
-            for f in functions:
-                Nargs = len(inspect.getargspec(getattr(measure, f))[0])
-                if Nargs == 1:
-                    stat_step[f][i].append(getattr(measure, f)(o))
-                elif Nargs == 2:
-                    stat_step[f][i].append(getattr(measure, f)(s[i], o))
-                else:   # Nargs == 3
-                    stat_step[f][i].append(getattr(measure, f)(s[i], o,
-                                                               cutoff))
+        for f in functions:
+            value = measure_registry.Compute(f, s, o, cutoff)
+            for i in range(Nsim):
+                stat_step[f][i].append(value[i])
 
     # To arrays.
     for k in stat_step.keys():
@@ -376,8 +354,6 @@ def compute_stat_station(sim, obs, measures, dates = None, stations = None,
 
     ### Initializations.
 
-    import inspect
-
     if isinstance(sim[0], ndarray):
         sim = (sim, )
 
@@ -392,10 +368,7 @@ def compute_stat_station(sim, obs, measures, dates = None, stations = None,
     Nsim = len(sim)
 
     # Functions to be applied.
-    if cutoff == None:
-        functions = talos.get_module_functions(measure, (1, 2), measures)
-    else:
-        functions = talos.get_module_functions(measure, (1, 2, 3), measures)
+    functions = measure_registry.GetNames(measures, cutoff is not None)
 
     ### Statistics.
 
@@ -405,16 +378,10 @@ def compute_stat_station(sim, obs, measures, dates = None, stations = None,
     for station in stations_out:
         s, o = \
            collect(sim, obs, dates, stations, period, station)
-        for i in range(Nsim):
-            for f in functions:
-                Nargs = len(inspect.getargspec(getattr(measure, f))[0])
-                if Nargs == 1:
-                    stat_station[f][i].append(getattr(measure, f)(o))
-                elif Nargs == 2:
-                    stat_station[f][i].append(getattr(measure, f)(s[i], o))
-                else:   # Nargs == 3
-                    stat_station[f][i].append(getattr(measure, f)(s[i], o,
-                                                                  cutoff))
+        for f in functions:
+            value = measure_registry.Compute(f, s, o, cutoff)
+            for i in range(Nsim):
+                stat_station[f][i].append(value[i])
 
     # To arrays.
     for k in stat_station.keys():
@@ -0,0 +1,469 @@
+# Copyright (C) 2026, ENPC - INRIA - EDF R&D
+#
+# This file is part of AtmoPy library, a tool for data processing and
+# visualization in atmospheric sciences.
+#
+# AtmoPy is developed in the INRIA - ENPC joint project-team CLIME and in
+# the ENPC - EDF R&D joint laboratory CEREA.
+#
+# AtmoPy is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 2 of the License, or (at your option)
+# any later version.
+#
+# AtmoPy is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for
+# more details.
+#
+# For more information, visit the AtmoPy home page:
+#     http://cerea.enpc.fr/polyphemus/atmopy.html
+
+
+import numpy
+from atmopy import talos
+from atmopy.stat import measure
+
+
+#######################
+# VECTORIZED MEASURES #
+#######################
+
+
+# The functions below compute a measure for a whole ensemble at once. 'sim'
+# is a 2D-array (simulations x concentrations) and 'obs' a 1D-array. They
+# return a 1D-array (indexed by simulations) equal to the results of the
+# corresponding function of module 'measure' applied to each simulation.
+
+
+def _filter(sim, obs, cutoff):
+    mask = obs > cutoff
+    return sim[:, mask], obs[mask]
+
+
+def _mbe(sim, obs):
+    return (sim - obs).mean(1)
+
+
+def _mage(sim, obs):
+    return abs(sim - obs).mean(1)
+
+
+def _mnge(sim, obs, cutoff = 0.):
+    sim, obs = _filter(sim, obs, cutoff)
+    return (abs(sim - obs) / obs).mean(1)
+
+
+def _rmse(sim, obs):
+    return numpy.sqrt(((sim - obs) ** 2).mean(1))
+
+
+def _correlation(sim, obs):
+    diff1 = sim - sim.mean(1)[:, numpy.newaxis]
+    diff2 = obs - obs.mean()
+    return (diff1 * diff2).mean(1) / numpy.sqrt((diff1 * diff1).mean(1)
+                                                * (diff2 * diff2).mean())
+
+
+def _determination(sim, obs):
+    return _correlation(sim, obs) ** 2
+
+
+def _mnbe(sim, obs, cutoff = 0.):
+    sim, obs = _filter(sim, obs, cutoff)
+    return ((sim - obs) / obs).mean(1)
+
+
+def _mfbe(sim, obs, cutoff = 0.):
+    sim, obs = _filter(sim, obs, cutoff)
+    return 2 * ((sim - obs) / (sim + obs)).mean(1)
+
+
+def _fge(sim, obs, cutoff = 0.):
+    sim, obs = _filter(sim, obs, cutoff)
+    return 2 * (abs((sim - obs) / (sim + obs))).mean(1)
+
+
+def _bf(sim, obs, cutoff = 0.):
+    sim, obs = _filter(sim, obs, cutoff)
+    return (sim / obs).mean(1)
+
+
+def _upa(sim, obs):
+    max_obs = obs.max()
+    return (sim.max(1) - max_obs) / max_obs
+
+
+def _nmb(sim, obs):
+    return (sim - obs).sum(1) / obs.sum()
+
+
+def _nme(sim, obs):
+    return abs(sim - obs).sum(1) / obs.sum()
+
+
+def _rnmse_2(sim, obs, cutoff = 0.):
+    sim, obs = _filter(sim, obs, cutoff)
+    tmp = (sim - obs) / obs
+    return numpy.sqrt((tmp * tmp).mean(1))
+
+
+def _fac2(sim, obs):
+    return ((sim >= 0.5 * obs) & (sim <= 2. * obs)).mean(1)
+
+
+def _fac5(sim, obs):
+    return ((sim >= 0.2 * obs) & (sim <= 5. * obs)).mean(1)
+
+
+def _nmse_1(sim, obs):
+    return ((sim - obs) ** 2).mean(1) / (sim.mean(1) * obs.mean())
+
+
+def _fmt(sim, obs):
+    min_tot = numpy.minimum(sim, obs).sum(1)
+    max_tot = numpy.maximum(sim, obs).sum(1)
+    out = numpy.zeros(len(sim), dtype = 'd')
+    nonzero = max_tot != 0.
+    out[nonzero] = min_tot[nonzero] / max_tot[nonzero]
+    return out
+
+
+def _fb(sim, obs):
+    sim_mean = sim.mean(1)
+    return 2.0 * (sim_mean - obs.mean()) / (sim_mean + obs.mean())
+
+
+def _er(sim, obs):
+    return (2.0 * abs(sim - obs) / (sim + obs)).mean(1)
+
+
+def _nmse(sim, obs):
+    return ((sim - obs) ** 2).mean(1) / (sim * obs).mean(1)
+
+
+def _nad(sim, obs):
+    return abs(sim - obs).mean(1) / (sim.mean(1) + obs.mean())
+
+
+_vectorized = {"mbe": _mbe, "mage": _mage, "mnge": _mnge, "rmse": _rmse,
+               "correlation": _correlation, "determination": _determination,
+               "mnbe": _mnbe, "mfbe": _mfbe, "fge": _fge, "bf": _bf,
+               "upa": _upa, "nmb": _nmb, "nme": _nme, "rnmse_2": _rnmse_2,
+               "fac2": _fac2, "fac5": _fac5, "nmse_1": _nmse_1, "fmt": _fmt,
+               "fb": _fb, "er": _er, "nmse": _nmse, "nad": _nad}
+
+
+####################
+# GROUPED MEASURES #
+####################
+
+
+# The functions below compute a measure for a whole ensemble and for several
+# groups of data (e.g., stations) at once. 'sim' is a 3D-array (simulations x
+# concentrations x groups), 'obs' a 2D-array (concentrations x groups) and
+# 'mask' a 2D-array (concentrations x groups) which is True where data is
+# available. They return a 2D-array (simulations x groups) equal to the
+# results of the corresponding function of module 'measure' applied to the
+# available data of each simulation and each group.
+
+
+def _grouped_mean(data, mask):
+    return numpy.where(mask, data, 0.).sum(-2) / mask.sum(0)
+
+
+def _grouped_sum(data, mask):
+    return numpy.where(mask, data, 0.).sum(-2)
+
+
+def _grouped_mbe(sim, obs, mask):
+    return _grouped_mean(sim - obs, mask)
+
+
+def _grouped_mage(sim, obs, mask):
+    return _grouped_mean(abs(sim - obs), mask)
+
+
+def _grouped_rmse(sim, obs, mask):
+    return numpy.sqrt(_grouped_mean((sim - obs) ** 2, mask))
+
+
+def _grouped_correlation(sim, obs, mask):
+    diff1 = sim - _grouped_mean(sim, mask)[:, numpy.newaxis]
+    diff2 = obs - _grouped_mean(obs, mask)
+    return _grouped_mean(diff1 * diff2, mask) \
+           / numpy.sqrt(_grouped_mean(diff1 * diff1, mask)
+                        * _grouped_mean(diff2 * diff2, mask))
+
+
+def _grouped_determination(sim, obs, mask):
+    return _grouped_correlation(sim, obs, mask) ** 2
+
+
+def _grouped_nmb(sim, obs, mask):
+    return _grouped_sum(sim - obs, mask) / _grouped_sum(obs, mask)
+
+
+def _grouped_nme(sim, obs, mask):
+    return _grouped_sum(abs(sim - obs), mask) / _grouped_sum(obs, mask)
+
+
+def _grouped_nmse_1(sim, obs, mask):
+    return _grouped_mean((sim - obs) ** 2, mask) \
+           / (_grouped_mean(sim, mask) * _grouped_mean(obs, mask))
+
+
+def _grouped_fb(sim, obs, mask):
+    sim_mean = _grouped_mean(sim, mask)
+    obs_mean = _grouped_mean(obs, mask)
+    return 2.0 * (sim_mean - obs_mean) / (sim_mean + obs_mean)
+
+
+def _grouped_nmse(sim, obs, mask):
+    return _grouped_mean((sim - obs) ** 2, mask) \
+           / _grouped_mean(sim * obs, mask)
+
+
+def _grouped_nad(sim, obs, mask):
+    return _grouped_mean(abs(sim - obs), mask) \
+           / (_grouped_mean(sim, mask) + _grouped_mean(obs, mask))
+
+
+_grouped = {"mbe": _grouped_mbe, "mage": _grouped_mage,
+            "rmse": _grouped_rmse, "correlation": _grouped_correlation,
+            "determination": _grouped_determination, "nmb": _grouped_nmb,
+            "nme": _grouped_nme, "nmse_1": _grouped_nmse_1, "fb": _grouped_fb,
+            "nmse": _grouped_nmse, "nad": _grouped_nad}
+
+
+############
+# REGISTRY #
+############
+
+
+class Measure:
+    """
+    Describes a statistical measure: the function, its number of arguments,
+    whether it supports a cutoff and whether it may be computed for a whole
+    ensemble, or for a whole ensemble and several groups of data, at once.
+    """
+
+    def __init__(self, name, function, Nargs, vectorized = None,
+                 grouped = None):
+        """
+        @type name: string
+        @param name: The name of the measure.
+        @type function: function
+        @param function: The function that computes the measure. Its
+        arguments are the simulated data (if any), the observations and
+        possibly the cutoff.
+        @type Nargs: integer
+        @param Nargs: The number of arguments of 'function'.
+        @type vectorized: function or None
+        @param vectorized: The function that computes the measure for a 2D
+        array of simulated data (simulations x concentrations), or None if
+        there is no such function.
+        @type grouped: function or None
+        @param grouped: The function that computes the measure for a 3D
+        array of simulated data (simulations x concentrations x groups), or
+        None if there is no such function.
+        """
+        self.name = name
+        self.function = function
+        self.Nargs = Nargs
+        self.cutoff = self.Nargs == 3
+        self.vectorized = vectorized
+        self.grouped = grouped
+
+    def __call__(self, sim, obs, cutoff = None):
+        """
+        Computes the measure for one simulation.
+
+        @type sim: 1D-array
+        @param sim: The simulated concentrations (discarded if the measure
+        only depends on the observations).
+        @type obs: 1D-array
+        @param obs: The observations.
+        @type cutoff: float, or None
+        @param cutoff: The cutoff, only used by measures with three
+        arguments.
+
+        @rtype: float
+        @return: The measure.
+        """
+        if self.Nargs == 1:
+            return self.function(obs)
+        elif self.Nargs == 2:
+            return self.function(sim, obs)
+        else:
+            return self.function(sim, obs, cutoff)
+
+    def Ensemble(self, sim, obs, cutoff = None):
+        """
+        Computes the measure for a set of simulations.
+
+        @type sim: 2D-array
+        @param sim: The simulated concentrations (simulations x
+        concentrations).
+        @type obs: 1D-array
+        @param obs: The observations.
+        @type cutoff: float, or None
+        @param cutoff: The cutoff, only used by measures with three
+        arguments.
+
+        @rtype: 1D-array
+        @return: The measure for each simulation.
+        """
+        if self.Nargs == 1:
+            return numpy.array([self.function(obs)] * len(sim))
+        if self.vectorized is not None and len(obs) != 0:
+            if self.Nargs == 2:
+                return numpy.asarray(self.vectorized(sim, obs), dtype = 'd')
+            else:
+                return numpy.asarray(self.vectorized(sim, obs, cutoff),
+                                     dtype = 'd')
+        return numpy.array([self(x, obs, cutoff) for x in sim])
+
+    def Grouped(self, sim, obs, mask, cutoff = None):
+        """
+        Computes the measure for a set of simulations and for several groups
+        of data, e.g., for all stations.
+
+        @type sim: 3D-array
+        @param sim: The simulated concentrations (simulations x
+        concentrations x groups).
+        @type obs: 2D-array
+        @param obs: The observations (concentrations x groups).
+        @type mask: 2D-array
+        @param mask: The mask (concentrations x groups) which is True where
+        data is available.
+        @type cutoff: float, or None
+        @param cutoff: The cutoff, only used by measures with three
+        arguments.
+
+        @rtype: 2D-array
+        @return: The measure for each simulation and each group. It is NaN
+        for groups without data.
+        """
+        if self.Nargs != 1 and self.grouped is not None:
+            with numpy.errstate(invalid = "ignore", divide = "ignore"):
+                return numpy.asarray(self.grouped(sim, obs, mask),
+                                     dtype = 'd')
+        output = numpy.empty((len(sim), mask.shape[1]), dtype = 'd')
+        for i in range(mask.shape[1]):
+            if mask[:, i].any():
+                output[:, i] = self.Ensemble(sim[:, mask[:, i], i],
+                                             obs[mask[:, i], i], cutoff)
+            else:
+                output[:, i] = numpy.nan
+        return output
+
+
+class MeasureRegistry:
+    """
+    Registry of the statistical measures of a module. The arities of the
+    measures are those cached by 'talos.get_function_arity', so that the
+    measures may be listed and called by name without further
+    introspection.
+    """
+
+    def __init__(self, module, vectorized = {}, grouped = {}):
+        """
+        @type module: module
+        @param module: The module in which the measures are found.
+        @type vectorized: dict
+        @param vectorized: The ensemble versions of the measures, indexed by
+        their names.
+        @type grouped: dict
+        @param grouped: The grouped versions of the measures, indexed by
+        their names.
+        """
+        self.measure = {}
+        arity = talos.get_function_arity(module)
+        for name in sorted(arity.keys()):
+            if not name.startswith("_"):
+                self.measure[name] = Measure(name, getattr(module, name),
+                                             arity[name],
+                                             vectorized.get(name),
+                                             grouped.get(name))
+
+    def __contains__(self, name):
+        return name in self.measure
+
+    def __getitem__(self, name):
+        return self.measure[name]
+
+    def GetNames(self, measures = ("all", ), cutoff = False):
+        """
+        Lists the measures that may be computed.
+
+        @type measures: list of string, or string
+        @param measures: The measures to be possibly listed. If 'measures'
+        contains 'all', then all measures are listed (only once).
+        @type cutoff: Boolean
+        @param cutoff: True if measures with a cutoff should be included,
+        False otherwise.
+
+        @rtype: list of string
+        @return: The names of the selected measures.
+        """
+        if isinstance(measures, str):
+            measures = (measures, )
+        if "all" in measures:
+            measures = sorted(self.measure.keys())
+        if cutoff:
+            Nargs = (1, 2, 3)
+        else:
+            Nargs = (1, 2)
+        return [x for x in measures
+                if x in self.measure and self.measure[x].Nargs in Nargs]
+
+    def Compute(self, name, sim, obs, cutoff = None):
+        """
+        Computes a measure for one simulation or a set of simulations.
+
+        @type name: string
+        @param name: The name of the measure.
+        @type sim: 1D-array or 2D-array
+        @param sim: The simulated concentrations of one simulation, or of a
+        set of simulations (simulations x concentrations).
+        @type obs: 1D-array
+        @param obs: The observations.
+        @type cutoff: float, or None
+        @param cutoff: The cutoff, only used by measures with three
+        arguments.
+
+        @rtype: float or 1D-array
+        @return: The measure, or the measures indexed by simulations.
+        """
+        if numpy.ndim(sim) == 2:
+            return self.measure[name].Ensemble(sim, obs, cutoff)
+        else:
+            return self.measure[name](sim, obs, cutoff)
+
+    def ComputeGrouped(self, name, sim, obs, mask, cutoff = None):
+        """
+        Computes a measure for a set of simulations and for several groups of
+        data (e.g., stations) at once.
+
+        @type name: string
+        @param name: The name of the measure.
+        @type sim: 3D-array
+        @param sim: The simulated concentrations (simulations x
+        concentrations x groups).
+        @type obs: 2D-array
+        @param obs: The observations (concentrations x groups).
+        @type mask: 2D-array
+        @param mask: The mask (concentrations x groups) which is True where
+        data is available.
+        @type cutoff: float, or None
+        @param cutoff: The cutoff, only used by measures with three
+        arguments.
+
+        @rtype: 2D-array
+        @return: The measures indexed by simulations and groups.
+        """
+        return self.measure[name].Grouped(sim, obs, mask, cutoff)
+
+
+measure_registry = MeasureRegistry(measure, _vectorized, _grouped)
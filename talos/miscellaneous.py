@@ -119,6 +119,32 @@ def remove_file(files):
             os.remove(file)
 
 
+_function_arity = {}
+
+
+def get_function_arity(module):
+    """
+    Returns the number of arguments of the functions from a given module. The
+    module is only inspected the first time, the result is then cached.
+
+    @type module: module
+    @param module: The module in which the functions are found.
+
+    @rtype: dict
+    @return: The number of arguments of every function of 'module', indexed
+    by the function names.
+    """
+    if module.__name__ not in _function_arity:
+        import inspect
+        arity = {}
+        for x in dir(module):
+            function = getattr(module, x)
+            if inspect.isfunction(function):
+                arity[x] = len(inspect.signature(function).parameters)
+        _function_arity[module.__name__] = arity
+    return _function_arity[module.__name__]
+
+
 def apply_module_functions(module, args, functions = ("all", )):
     """
     Applies functions (with the right number of arguments) from a given module
@@ -136,13 +162,12 @@ def apply_module_functions(module, args, functions = ("all", )):
     @return: The list of applied functions and the list of results.
     """
     Nargs = len(args)
-    import inspect, types
+    arity = get_function_arity(module)
     if "all" in functions:
-        functions = [x for x in dir(module)
-                     if inspect.isfunction(getattr(module, x))]
+        functions = sorted(arity.keys())
     out_functions, results = [], []
     for f in functions:
-        if len(inspect.getargspec(getattr(module, f))[0]) == Nargs:
+        if arity.get(f) == Nargs:
             out_functions.append(f)
             results.append(getattr(module, f)(*args))
     return out_functions, results
@@ -164,15 +189,14 @@ def get_module_functions(module, Nargs, functions = ("all", )):
     @return: The list of functions that could be called with 'Nargs'
     arguments.
     """
-    import inspect, types
     if isinstance(Nargs, int):
         Nargs = (Nargs, )
+    arity = get_function_arity(module)
     if "all" in functions:
-        functions = [x for x in dir(module)
-                     if inspect.isfunction(getattr(module, x))]
+        functions = sorted(arity.keys())
     out_functions = []
     for f in functions:
-        if len(inspect.getargspec(getattr(module, f))[0]) in Nargs:
+        if arity.get(f) in Nargs:
             out_functions.append(f)
     return out_functions
 